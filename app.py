@@ -1,25 +1,71 @@
 import os
 import re
+import sys
+import json
+import hmac
 import uuid
+import time
+import random
+import asyncio
+import sqlite3
+import csv
+import hashlib
+import tempfile
+import contextvars
+import threading
 import datetime as dt
-import requests
+import importlib.util
 import unicodedata
-from collections import defaultdict
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from types import SimpleNamespace
 
+import httpx
 from fastapi import FastAPI, Request, Response
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, um journal por processo não é garantido
+    fcntl = None
 from dotenv import load_dotenv
 
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+# numpy só é importado no primeiro resumo de vários períodos (_numpy); sem
+# ele esses também saem do PeriodIndex, um período por vez. As bibliotecas
+# do Google também ficam para o primeiro uso (_google): o import do app não
+# paga por elas.
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+np = None
+
+def _numpy():
+    global np
+    if np is None and HAS_NUMPY:
+        import numpy
+        np = numpy
+    return np
 
 load_dotenv()
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_app):
+    INBOUND.start()
+    TENANTS.start()
+    if SHEETS_WARMUP:
+        _BACKGROUND.add(asyncio.create_task(warm_up()))
+    yield
+    await INBOUND.drain(WEBHOOK_DRAIN_TIMEOUT)
+    await asyncio.to_thread(TENANTS.stop, WEBHOOK_DRAIN_TIMEOUT)
+    await close_wa_client()
+
+app = FastAPI(lifespan=lifespan)
 
 GRAPH_VER = "v22.0"
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
-# Estado por número: {"tx": {...}, "await": "...", "stage": "..."}
-PENDING = {}
+# Estado por número: Session(tx, step, stage, last), com expiração por inatividade.
+# Guardado em SESSIONS (memória ou SQLite compartilhado entre workers).
 
 ORIGENS_RECEITA = [
     "Salário", "Férias", "13º", "Bônus", "Comissão", "PLR",
@@ -32,38 +78,576 @@ CATEGORIAS_DESPESA = [
 PAGAMENTOS_DESPESA = ["pix", "débito", "crédito", "dinheiro", "desconhecido"]
 
 MSG_SALVO = "Show, já registrei aqui no nosso BD, quando tiver mais alguma movimentação me sinalize aqui!"
+MSG_SESSAO_EXPIRADA = "Sua sessão expirou por inatividade, então vamos começar de novo."
 TXT_INICIAL = "Olá, bora conferir saldos hoje ou você quer registrar algo?"
 
+# =========================================================
+# Métricas (formato texto do Prometheus, em /metrics)
+# =========================================================
+# Contadores em memória do processo, sem dependência externa: observar custa
+# uma busca binária nos buckets e um incremento sob lock. Com vários workers
+# uvicorn cada processo tem os seus (o scrape cai em um deles).
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _label_str(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Histogram:
+    """Histograma com buckets fixos, uma série por combinação de labels."""
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = METRIC_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}          # labels -> [contagem por bucket (+Inf no fim), soma]
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            s = self.series.get(labels)
+            if s is None:
+                s = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            s[0][i] += 1
+            s[1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self.series.items()]
+        for labels, counts, total in sorted(series):
+            acc = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                acc += n
+                le = f'le="{bound}"'
+                out.append(f"{self.name}_bucket{_label_str(self.labels, labels, le)} {acc}")
+            out.append(f"{self.name}_sum{_label_str(self.labels, labels)} {total}")
+            out.append(f"{self.name}_count{_label_str(self.labels, labels)} {acc}")
+        return out
+
+class _Timer:
+    __slots__ = ("hist", "labels", "t0")
+
+    def __init__(self, hist: Histogram, labels: tuple):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, *self.labels)
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.values = defaultdict(int)
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] += amount
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        out.extend(f"{self.name}{_label_str(self.labels, labels)} {v}" for labels, v in items)
+        return out
+
+class Gauge:
+    """Valor lido na hora do scrape (fn sem argumentos)."""
+
+    def __init__(self, name: str, doc: str, fn):
+        self.name = name
+        self.doc = doc
+        self.fn = fn
+        METRICS.append(self)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge", f"{self.name} {self.fn()}"]
+
+METRICS = []
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            print("METRICS ERROR:", metric.name, repr(e))
+    return "\n".join(lines) + "\n"
+
+M_WEBHOOK = Histogram("finbot_webhook_seconds", "POST /webhook (parse, dedupe e enfileiramento)")
+M_TURN = Histogram("finbot_turn_seconds", "Turno do wizard por mensagem, pelo passo em que a sessão estava", ("step",))
+M_WA_SEND = Histogram("finbot_wa_send_seconds", "Envio ao Graph (_post_wa), com esperas e retries", ("type",))
+M_APPEND = Histogram("finbot_append_row_seconds", "append_row/append_rows", ("backend",))
+M_READ_ALL = Histogram("finbot_read_all_rows_seconds", "read_all_rows", ("backend",))
+M_RESUMO = Histogram("finbot_build_resumo_seconds", "build_resumo_text/build_resumo_texts")
+M_ROWS_READ = Counter("finbot_sheets_rows_read_total", "Linhas lidas do Sheets", ("source",))
+M_ERRORS = Counter("finbot_errors_total", "Erros por serviço e status HTTP", ("service", "code"))
+M_IMPORT_ROWS = Counter("finbot_import_rows_total", "Linhas de extrato importadas, puladas (duplicata) ou inválidas", ("result",))
+
+# =========================================================
+# Tracing por mensagem e profiling sob demanda
+# =========================================================
+# Uma fração (TRACE_SAMPLE_RATE, 0 = desligado) das mensagens recebidas vira
+# um trace: spans em volta de envios ao Graph, chamadas ao Sheets, sessão e
+# agregações, gravados como uma linha JSON por mensagem em TRACE_PATH
+# ("-" = stderr). Sem dados do usuário nos spans, só nomes, tempos e contagens.
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+TRACE_PATH = os.environ.get("TRACE_PATH", "traces.jsonl")
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "").strip()
+PROFILE_MAX_WEBHOOKS = 10000
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_TOP = 80
+
+_TRACE = contextvars.ContextVar("trace", default=None)
+
+class Trace:
+    __slots__ = ("request_id", "t0", "wall", "spans", "attrs")
+
+    def __init__(self, request_id: str, **attrs):
+        self.request_id = request_id
+        self.t0 = time.perf_counter()
+        self.wall = time.time()
+        self.spans = []
+        self.attrs = attrs
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "ts": dt.datetime.utcfromtimestamp(self.wall).isoformat(timespec="milliseconds") + "Z",
+            "request_id": self.request_id,
+            **self.attrs,
+            "duration_ms": round((time.perf_counter() - self.t0) * 1000, 3),
+            "spans": self.spans,
+        }, ensure_ascii=False, default=str)
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "t0")
+
+    def __init__(self, trace: Trace, name: str, attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.perf_counter()
+        rec = {
+            "name": self.name,
+            "start_ms": round((self.t0 - self.trace.t0) * 1000, 3),
+            "duration_ms": round((t1 - self.t0) * 1000, 3),
+            **self.attrs,
+        }
+        if exc_type is not None:
+            rec["error"] = exc_type.__name__
+        self.trace.spans.append(rec)  # list.append: seguro vindo de to_thread
+
+class _NoSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+def span(name: str, **attrs):
+    """Span no trace da mensagem atual; fora de um trace amostrado não faz nada."""
+    trace = _TRACE.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, attrs)
+
+class TraceSink:
+    def __init__(self, path: str):
+        self.path = path
+        self.fh = None
+        self.lock = threading.Lock()
+
+    def write(self, trace: Trace):
+        line = trace.to_json() + "\n"
+        with self.lock:
+            if self.fh is None:
+                self.fh = sys.stderr if self.path == "-" else open(self.path, "a", encoding="utf-8")
+            self.fh.write(line)
+            self.fh.flush()
+
+TRACE_SINK = TraceSink(TRACE_PATH)
+
+def start_trace(request_id: str, **attrs):
+    """Sorteia se a mensagem é rastreada; devolve o token do contextvar (ou None)."""
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    return _TRACE.set(Trace(request_id or uuid.uuid4().hex, **attrs))
+
+def finish_trace(token, **attrs):
+    if token is None:
+        return
+    trace = _TRACE.get()
+    _TRACE.reset(token)
+    trace.attrs.update(attrs)
+    try:
+        TRACE_SINK.write(trace)
+    except OSError as e:
+        print("TRACE WRITE ERROR:", repr(e))
+
+class Profiler:
+    """
+    Profiling das próximas N mensagens, ligado por POST /admin/profile.
+
+    - "cprofile": cProfile no thread do event loop, onde os turnos rodam
+      (chamadas do Sheets em to_thread ficam de fora).
+    - "sampling": um thread amostra as pilhas de todos os threads a cada
+      PROFILE_SAMPLE_INTERVAL; sai em formato "collapsed" (flamegraph) e
+      por função com mais amostras no topo da pilha.
+
+    Começa quando é armado e para quando a N-ésima mensagem termina; o
+    resultado fica em GET /admin/profile até o próximo arm.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mode = None
+        self.remaining = 0
+        self.count = 0
+        self.started = 0.0
+        self.prof = None
+        self.stop_event = None
+        self.sampler = None
+        self.stacks = defaultdict(int)
+        self.result = None
+
+    def arm(self, webhooks: int, mode: str):
+        """Chamado no event loop (o cProfile liga no thread de quem chama)."""
+        with self.lock:
+            if self.remaining:
+                raise RuntimeError("profiling já em andamento")
+            self.mode = mode
+            self.started = time.perf_counter()
+            self.result = None
+            if mode == "cprofile":
+                import cProfile
+                prof = cProfile.Profile()
+                prof.enable()
+                self.prof = prof
+            else:
+                self.stacks = defaultdict(int)
+                self.stop_event = threading.Event()
+                self.sampler = threading.Thread(target=self._sample, args=(self.stop_event,), name="profiler", daemon=True)
+                self.sampler.start()
+            self.remaining = self.count = webhooks
+
+    def tick(self):
+        """Fim de uma mensagem (no event loop)."""
+        if not self.remaining:
+            return
+        with self.lock:
+            if not self.remaining:
+                return
+            self.remaining -= 1
+            if not self.remaining:
+                self._stop()
+
+    def _stop(self):
+        seconds = round(time.perf_counter() - self.started, 3)
+        if self.prof is not None:
+            import io
+            import pstats
+            self.prof.disable()
+            out = io.StringIO()
+            pstats.Stats(self.prof, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            self.prof = None
+            profile = out.getvalue()
+        else:
+            self.stop_event.set()
+            self.sampler.join()
+            self.sampler = None
+            by_func = defaultdict(int)
+            for stack, n in self.stacks.items():
+                by_func[stack.rsplit(";", 1)[-1]] += n
+            top = sorted(self.stacks.items(), key=lambda x: x[1], reverse=True)[:PROFILE_TOP]
+            profile = {
+                "samples": sum(self.stacks.values()),
+                "interval_s": PROFILE_SAMPLE_INTERVAL,
+                "top_functions": sorted(by_func.items(), key=lambda x: x[1], reverse=True)[:PROFILE_TOP],
+                "collapsed": [f"{stack} {n}" for stack, n in top],
+            }
+        self.result = {"mode": self.mode, "webhooks": self.count, "seconds": seconds, "profile": profile}
+
+    def _sample(self, stop: threading.Event):
+        me = threading.get_ident()
+        stacks = self.stacks
+        while not stop.wait(PROFILE_SAMPLE_INTERVAL):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stacks[";".join(reversed(names))] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            state = "running" if self.remaining else ("done" if self.result else "idle")
+            return {"state": state, "mode": self.mode, "remaining": self.remaining, "result": self.result}
+
+PROFILER = Profiler()
+
 # =========================================================
 # WhatsApp: envio
 # =========================================================
+# Um único AsyncClient por processo: mantém conexões keep-alive (HTTP/2 quando
+# o servidor negocia) com o graph.facebook.com em vez de abrir uma por envio.
+# WA_GRAPH_BASE permite apontar para o mock local (bench/mock_graph.py).
+WA_HTTP2 = os.environ.get("WA_HTTP2", "1") != "0"
+WA_MAX_CONNECTIONS = int(os.environ.get("WA_MAX_CONNECTIONS", "20"))
+
+_WA_CLIENT = None
+
 def wa_url():
+    base = os.environ.get("WA_GRAPH_BASE", "https://graph.facebook.com").rstrip("/")
     phone_number_id = os.environ["WA_PHONE_NUMBER_ID"]
-    return f"https://graph.facebook.com/{GRAPH_VER}/{phone_number_id}/messages"
+    return f"{base}/{GRAPH_VER}/{phone_number_id}/messages"
 
 def wa_headers():
     token = os.environ["WA_ACCESS_TOKEN"]
     return {"Authorization": f"Bearer {token}"}
 
-def _post_wa(payload: dict):
-    r = requests.post(wa_url(), headers=wa_headers(), json=payload, timeout=20)
-    if r.status_code >= 400:
-        print("WHATSAPP API ERROR:", r.status_code, r.text)
-    r.raise_for_status()
-    return r.json()
+def wa_client():
+    global _WA_CLIENT
+    if _WA_CLIENT is None or _WA_CLIENT.is_closed:
+        _WA_CLIENT = httpx.AsyncClient(
+            http2=WA_HTTP2,
+            timeout=httpx.Timeout(20.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=WA_MAX_CONNECTIONS,
+                max_keepalive_connections=WA_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+        )
+    return _WA_CLIENT
+
+async def close_wa_client():
+    global _WA_CLIENT
+    if _WA_CLIENT is not None:
+        await _WA_CLIENT.aclose()
+        _WA_CLIENT = None
+
+# Durante um turno do wizard os envios são só enfileirados no outbox do turno;
+# saem depois que o novo estado da sessão foi gravado (ver handle_message).
+_OUTBOX = contextvars.ContextVar("wa_outbox", default=None)
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Limites de vazão do Graph: por número de envio (WA_PHONE_NUMBER_ID) e, se
+# configurado, pelo app inteiro. 0 desliga o balde.
+WA_RATE_PER_NUMBER = float(os.environ.get("WA_RATE_PER_NUMBER", "80"))
+WA_RATE_PER_APP = float(os.environ.get("WA_RATE_PER_APP", "0"))
+WA_RETRY_MAX = int(os.environ.get("WA_RETRY_MAX", "4"))
+WA_RETRY_QUEUE_MAX = int(os.environ.get("WA_RETRY_QUEUE_MAX", "500"))
+WA_RETRY_BASE = 0.5
+WA_RETRY_CAP = 30.0
+# códigos de erro do Graph que significam "devagar" mesmo vindo com status 400
+WA_THROTTLE_CODES = {4, 80007, 130429, 131056}
+
+WA_STATS = {"sent": 0, "queued": 0, "throttled": 0, "retried": 0, "dropped": 0, "waiting": 0, "retrying": 0}
+
+class TokenBucket:
+    """
+    rate fichas/s com rajada de até burst. Quem chega sem ficha fica devendo
+    e espera a sua vez (a ordem de chegada é a ordem de saída); pause() segura
+    o balde inteiro, ex.: depois de um 429 com Retry-After. Só é usado no event
+    loop, então dispensa lock.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Pega uma ficha e devolve quantos segundos esperar antes de usá-la."""
+        now = time.monotonic()
+        wait = max(0.0, self.paused_until - now)
+        if self.rate <= 0:
+            return wait
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            wait = max(wait, -self.tokens / self.rate)
+        return wait
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+_WA_APP_BUCKET = TokenBucket(WA_RATE_PER_APP)
+_WA_NUMBER_BUCKETS = {}
+
+def _wa_buckets():
+    phone_number_id = os.environ["WA_PHONE_NUMBER_ID"]
+    bucket = _WA_NUMBER_BUCKETS.get(phone_number_id)
+    if bucket is None:
+        bucket = _WA_NUMBER_BUCKETS[phone_number_id] = TokenBucket(WA_RATE_PER_NUMBER)
+    return _WA_APP_BUCKET, bucket
+
+def _wa_throttled(r: httpx.Response) -> bool:
+    if r.status_code == 429:
+        return True
+    if r.status_code != 400:
+        return False
+    try:
+        return (r.json().get("error") or {}).get("code") in WA_THROTTLE_CODES
+    except ValueError:
+        return False
+
+def _retry_after(r) -> float:
+    try:
+        return max(0.0, float(r.headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+async def _post_wa(payload):
+    """payload: dict da Graph API ou bytes já serializados (PayloadTemplate.render)."""
+    outbox = _OUTBOX.get()
+    if outbox is not None:
+        outbox.append(payload)
+        return None
+    return await _send_wa(payload)
+
+def _wa_type(payload) -> str:
+    """text / button / list, para o label das métricas (bytes: procura no JSON já pronto)."""
+    if isinstance(payload, bytes):
+        for kind in ("button", "list", "text"):
+            if b'"type":"%s"' % kind.encode() in payload:
+                return kind
+        return "other"
+    if payload.get("type") == "interactive":
+        return (payload.get("interactive") or {}).get("type") or "interactive"
+    return payload.get("type") or "other"
+
+async def _send_wa(payload):
+    """
+    Um envio ao Graph passando pelos baldes de vazão. 429, erros de throttling
+    do Graph, 5xx e falhas de rede são refeitos até WA_RETRY_MAX vezes, com o
+    Retry-After do servidor ou backoff exponencial com jitter. No máximo
+    WA_RETRY_QUEUE_MAX envios ficam esperando retry ao mesmo tempo; além disso,
+    ou esgotadas as tentativas, o envio é descartado (logado, sem exceção).
+    Outros 4xx continuam levantando erro.
+    """
+    kind = _wa_type(payload)
+    with M_WA_SEND.time(kind), span("wa.send", type=kind):
+        return await _send_wa_attempts(payload)
+
+async def _send_wa_attempts(payload):
+    buckets = _wa_buckets()
+    for attempt in range(WA_RETRY_MAX + 1):
+        wait = max(b.reserve() for b in buckets)
+        if wait > 0:
+            WA_STATS["queued"] += 1
+            WA_STATS["waiting"] += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                WA_STATS["waiting"] -= 1
+
+        try:
+            if isinstance(payload, bytes):
+                r = await wa_client().post(wa_url(), headers={**wa_headers(), **_JSON_HEADERS}, content=payload)
+            else:
+                r = await wa_client().post(wa_url(), headers=wa_headers(), json=payload)
+        except httpx.TransportError as e:
+            r, reason = None, repr(e)
+            M_ERRORS.inc("whatsapp", "transport")
+        else:
+            if r.status_code < 400:
+                WA_STATS["sent"] += 1
+                return r.json()
+            reason = f"{r.status_code} {r.text[:300]}"
+            M_ERRORS.inc("whatsapp", str(r.status_code))
+            if _wa_throttled(r):
+                WA_STATS["throttled"] += 1
+            elif r.status_code < 500:
+                print("WHATSAPP API ERROR:", reason)
+                r.raise_for_status()
+
+        delay = _retry_after(r)
+        if delay and r is not None and _wa_throttled(r):
+            for b in buckets:
+                b.pause(delay)
+        if attempt == WA_RETRY_MAX or WA_STATS["retrying"] >= WA_RETRY_QUEUE_MAX:
+            break
+        delay = delay or random.uniform(0, min(WA_RETRY_CAP, WA_RETRY_BASE * 2 ** attempt))
+        WA_STATS["retried"] += 1
+        WA_STATS["retrying"] += 1
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            WA_STATS["retrying"] -= 1
+
+    WA_STATS["dropped"] += 1
+    print("WHATSAPP API ERROR: descartando envio após", attempt + 1, "tentativa(s):", reason)
+    return None
+
+async def send_concurrently(*coros):
+    """Envios independentes entre si: saem em paralelo (também quando vêm do outbox)."""
+    outbox = _OUTBOX.get()
+    if outbox is None:
+        return await asyncio.gather(*coros)
+    group = []
+    token = _OUTBOX.set(group)
+    try:
+        for c in coros:
+            await c
+    finally:
+        _OUTBOX.reset(token)
+    outbox.append(group)
+
+async def flush_outbox(outbox: list):
+    for item in outbox:
+        if isinstance(item, list):
+            await asyncio.gather(*(_post_wa(p) for p in item))
+        else:
+            await _post_wa(item)
 
-def send_whatsapp_text(to: str, text: str):
-    return _post_wa({
+def _text_payload(text: str) -> dict:
+    return {
         "messaging_product": "whatsapp",
-        "to": to,
         "type": "text",
         "text": {"body": text[:3800]},
-    })
+    }
 
-def send_whatsapp_buttons(to: str, body_text: str, buttons: list):
-    return _post_wa({
+def _buttons_payload(body_text: str, buttons: list) -> dict:
+    return {
         "messaging_product": "whatsapp",
-        "to": to,
         "type": "interactive",
         "interactive": {
             "type": "button",
@@ -75,12 +659,11 @@ def send_whatsapp_buttons(to: str, body_text: str, buttons: list):
                 ]
             },
         },
-    })
+    }
 
-def send_whatsapp_list(to: str, body_text: str, button_label: str, rows: list, section_title: str = "Opções"):
-    return _post_wa({
+def _list_payload(body_text: str, button_label: str, rows: list, section_title: str = "Opções") -> dict:
+    return {
         "messaging_product": "whatsapp",
-        "to": to,
         "type": "interactive",
         "interactive": {
             "type": "list",
@@ -97,36 +680,404 @@ def send_whatsapp_list(to: str, body_text: str, button_label: str, rows: list, s
                 }],
             },
         },
-    })
+    }
+
+async def send_whatsapp_text(to: str, text: str):
+    return await _post_wa({"to": to, **_text_payload(text)})
+
+async def send_whatsapp_buttons(to: str, body_text: str, buttons: list):
+    return await _post_wa({"to": to, **_buttons_payload(body_text, buttons)})
+
+async def send_whatsapp_list(to: str, body_text: str, button_label: str, rows: list, section_title: str = "Opções"):
+    return await _post_wa({"to": to, **_list_payload(body_text, button_label, rows, section_title)})
+
+class PayloadTemplate:
+    """
+    Mensagem estática serializada uma vez (no import); por envio só o
+    destinatário é costurado entre os dois pedaços de JSON já prontos.
+    """
+
+    __slots__ = ("head", "tail")
+    _MARK = "\x00to\x00"
+
+    def __init__(self, payload: dict):
+        body = json.dumps({"to": self._MARK, **payload}, ensure_ascii=False, separators=(",", ":")).encode()
+        self.head, self.tail = body.split(json.dumps(self._MARK).encode(), 1)
+
+    def render(self, to: str) -> bytes:
+        return self.head + json.dumps(to).encode() + self.tail
+
+    async def send(self, to: str):
+        return await _post_wa(self.render(to))
 
 # =========================================================
 # Google Sheets
 # =========================================================
+# Cliente único por processo: as credenciais são carregadas uma vez e o token é
+# renovado antes de expirar. O httplib2 não é thread-safe, então cada thread
+# (to_thread / workers) recebe o seu próprio service com um AuthorizedHttp
+# reaproveitado entre chamadas.
+SHEETS_HTTP_TIMEOUT = 30
+TOKEN_REFRESH_MARGIN = dt.timedelta(minutes=5)
+# Endpoint alternativo (ex.: bench/fake_sheets.py); sem GOOGLE_APPLICATION_CREDENTIALS
+# as chamadas saem sem autenticação.
+SHEETS_API_ENDPOINT = os.environ.get("GOOGLE_SHEETS_API_ENDPOINT", "").rstrip("/")
+# Documento de discovery do Sheets v4: o que vem dentro do googleapiclient, ou
+# um JSON local em SHEETS_DISCOVERY_DOC. Nunca é buscado na rede.
+SHEETS_DISCOVERY_DOC = os.environ.get("SHEETS_DISCOVERY_DOC", "").strip()
+# Warm-up em segundo plano logo depois do start: importa as bibliotecas,
+# carrega o discovery e autentica antes da primeira mensagem precisar.
+SHEETS_WARMUP = os.environ.get("SHEETS_WARMUP", "0") == "1"
+SHEETS_WARMUP_DELAY = 0.5
+
+@lru_cache(maxsize=1)
+def _google():
+    """
+    Bibliotecas do Google (e requests/httplib2), importadas no primeiro uso
+    do Sheets, não no import do app (~130 ms a menos na partida a frio).
+    """
+    import httplib2
+    import requests
+    from google.auth.credentials import AnonymousCredentials
+    from google.auth.transport.requests import Request
+    from google.oauth2.service_account import Credentials
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.errors import HttpError
+
+    return SimpleNamespace(
+        httplib2=httplib2, requests=requests, AnonymousCredentials=AnonymousCredentials, Request=Request,
+        Credentials=Credentials, AuthorizedHttp=AuthorizedHttp, build_from_document=build_from_document,
+        HttpError=HttpError,
+    )
+
+# Métodos do Sheets que o app usa. O googleapiclient monta a docstring de cada
+# método a partir dos schemas no primeiro acesso, em cada service (~300 ms
+# para o recurso spreadsheets inteiro, por causa do batchUpdate).
+SHEETS_VALUES_METHODS = ("get", "batchGet", "append")
+
+@lru_cache(maxsize=1)
+def _sheets_discovery() -> dict:
+    """
+    Discovery do Sheets v4 já parseado e reduzido a spreadsheets.values
+    (SHEETS_VALUES_METHODS), compartilhado por todos os services. O
+    build_from_document completa o dict (parâmetros comuns) na primeira vez;
+    isso é feito aqui, uma vez só, para as threads não o alterarem depois.
+    """
+    g = _google()
+    if SHEETS_DISCOVERY_DOC:
+        with open(SHEETS_DISCOVERY_DOC, encoding="utf-8") as f:
+            doc = json.load(f)
+    else:
+        from googleapiclient import discovery_cache
+        doc = json.loads(discovery_cache.get_static_doc("sheets", "v4"))
+    values = doc["resources"]["spreadsheets"]["resources"]["values"]
+    values["methods"] = {k: v for k, v in values["methods"].items() if k in SHEETS_VALUES_METHODS}
+    doc["resources"]["spreadsheets"] = {"methods": {}, "resources": {"values": values}}
+    g.build_from_document(doc, http=g.httplib2.Http()).spreadsheets().values()
+    return doc
+
+_SHEETS_LOCK = threading.Lock()
+_SHEETS_CREDS = None
+_SHEETS_AUTH_REQUEST = None
+_SHEETS_GEN = 0
+_SHEETS_LOCAL = threading.local()
+
+def _sheets_credentials():
+    """
+    Devolve as credenciais compartilhadas, renovando o token quando faltar
+    menos que TOKEN_REFRESH_MARGIN para expirar.
+    """
+    global _SHEETS_CREDS, _SHEETS_AUTH_REQUEST
+    g = _google()
+    with _SHEETS_LOCK:
+        if _SHEETS_CREDS is None:
+            if SHEETS_API_ENDPOINT and not os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"):
+                _SHEETS_CREDS = g.AnonymousCredentials()
+                return _SHEETS_CREDS
+            creds_path = os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
+            _SHEETS_CREDS = g.Credentials.from_service_account_file(creds_path, scopes=SCOPES)
+            _SHEETS_AUTH_REQUEST = g.Request(session=g.requests.Session())
+        creds = _SHEETS_CREDS
+        if isinstance(creds, g.AnonymousCredentials):
+            return creds
+        expiry = creds.expiry
+        if not creds.token or (expiry and expiry - dt.datetime.utcnow() < TOKEN_REFRESH_MARGIN):
+            creds.refresh(_SHEETS_AUTH_REQUEST)
+        return creds
+
 def _sheets_service():
-    creds_path = os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
-    creds = Credentials.from_service_account_file(creds_path, scopes=SCOPES)
-    return build("sheets", "v4", credentials=creds)
+    creds = _sheets_credentials()
+    local = _SHEETS_LOCAL
+    if getattr(local, "gen", None) != _SHEETS_GEN:
+        g = _google()
+        http = g.AuthorizedHttp(creds, http=g.httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT))
+        options = {"api_endpoint": SHEETS_API_ENDPOINT} if SHEETS_API_ENDPOINT else None
+        local.svc = g.build_from_document(_sheets_discovery(), http=http, client_options=options)
+        local.gen = _SHEETS_GEN
+    return local.svc
+
+def warm_up_sheets():
+    """Tudo que a primeira chamada ao Sheets pagaria, menos a chamada em si."""
+    _sheets_service()
+    _numpy()
+
+_BACKGROUND = set()
+
+async def warm_up():
+    await asyncio.sleep(SHEETS_WARMUP_DELAY)  # deixa o servidor começar a atender antes
+    t0 = time.perf_counter()
+    try:
+        await asyncio.to_thread(warm_up_sheets)
+        print("WARMUP: Sheets pronto em", round((time.perf_counter() - t0) * 1000), "ms")
+    except Exception as e:
+        print("WARMUP ERROR:", repr(e))
+    finally:
+        _BACKGROUND.discard(asyncio.current_task())
+
+def reset_sheets_service():
+    """
+    Descarta credenciais e services de todas as threads; a próxima chamada
+    reconstrói tudo do zero. Usado quando uma chamada falha por auth/conexão.
+    """
+    global _SHEETS_CREDS, _SHEETS_AUTH_REQUEST, _SHEETS_GEN
+    with _SHEETS_LOCK:
+        _SHEETS_CREDS = None
+        _SHEETS_AUTH_REQUEST = None
+        _SHEETS_GEN += 1
+
+def _sheets_execute(request):
+    try:
+        return request.execute()
+    except _google().HttpError as e:
+        M_ERRORS.inc("sheets", str(e.resp.status))
+        if e.resp.status in (401, 403):
+            reset_sheets_service()
+        raise
+    except Exception:
+        # timeout / conexão quebrada: o Http da thread pode ter ficado inválido
+        M_ERRORS.inc("sheets", "transport")
+        reset_sheets_service()
+        raise
+
+# =========================================================
+# Agendador de chamadas ao Sheets (cota por minuto)
+# =========================================================
+SHEETS_QUOTA_PER_MINUTE = int(os.environ.get("SHEETS_QUOTA_PER_MINUTE", "60"))
+SHEETS_QUOTA_WINDOW = float(os.environ.get("SHEETS_QUOTA_WINDOW", "60"))  # a do Google é por minuto
+SHEETS_RETRY_MAX = int(os.environ.get("SHEETS_RETRY_MAX", "5"))
+SHEETS_RETRY_BASE = 1.0
+SHEETS_RETRY_CAP = 32.0
+
+_IN_FLIGHT = float("inf")
+
+class _Flight:
+    """Uma leitura em andamento que outras chamadas idênticas esperam."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SheetsScheduler:
+    """
+    Porta única para o Sheets (todas as chamadas saem de threads).
+
+    - Cota: conta as chamadas dos últimos `window` segundos (pelo fim de cada
+      chamada, que é quando o servidor com certeza já a contou) e segura quem
+      passaria de per_window. Leituras só usam até read_limit, deixando uma
+      folga para gravações.
+    - Prioridade: enquanto houver gravação esperando vez, nenhuma leitura sai.
+    - 429/503: todo mundo recua junto (Retry-After ou backoff exponencial
+      com jitter, crescendo a cada falha seguida) e leituras tentam de novo.
+      Gravações só repetem em 429 (recusadas antes de aplicar); num 503 o
+      erro sobe e quem grava confere o que entrou antes de reenviar: o
+      journal e a réplica do SQLite pelos IDs, o import de extratos pela
+      chave de duplicata.
+    - Leituras idênticas em andamento (mesma chave) viram uma chamada só.
+    - parent: outro scheduler (a cota do projeto inteiro) que cada chamada
+      também precisa respeitar; é assim que a cota de um tenant fica abaixo
+      da global. 429/503 fazem os dois recuarem.
+
+    make recebe o service da thread e devolve o request do googleapiclient;
+    é chamado de novo a cada tentativa.
+    """
+
+    def __init__(self, per_window: int, window: float, parent: "SheetsScheduler" = None):
+        self.set_quota(per_window)
+        self.window = window
+        self.parent = parent
+        self.cond = threading.Condition()
+        self.sent = deque()
+        self.writers = 0
+        self.backoff_until = 0.0
+        self.failures = 0
+        self.inflight = {}
+        self.stats = {"reads": 0, "writes": 0, "coalesced": 0, "waited": 0, "throttled": 0, "retries": 0}
+
+    def set_quota(self, per_window: int):
+        self.per_window = max(1, per_window)
+        self.read_limit = max(1, self.per_window - max(1, self.per_window // 10))
+
+    def read(self, key, make):
+        with self.cond:
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = _Flight()
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            with span("sheets.read", op=key[0], coalesced=True):
+                flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._run(make, write=False)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.cond:
+                del self.inflight[key]
+            flight.done.set()
+
+    def write(self, make):
+        return self._run(make, write=True)
+
+    def _run(self, make, write: bool):
+        with span("sheets.write" if write else "sheets.read") as sp:
+            return self._attempts(make, write, sp)
+
+    def _attempts(self, make, write: bool, sp):
+        for attempt in range(SHEETS_RETRY_MAX + 1):
+            t0 = time.perf_counter()
+            slot = self._acquire(write)
+            parent_slot = self.parent._acquire(write) if self.parent is not None else None
+            sp.set(attempts=attempt + 1, wait_ms=round((time.perf_counter() - t0) * 1000, 3))
+            try:
+                res = _sheets_execute(make(_sheets_service()))
+            except _google().HttpError as e:
+                status = e.resp.status
+                if status not in (429, 503):
+                    raise
+                self._back_off(e.resp.get("retry-after"))
+                if self.parent is not None:
+                    self.parent._back_off(e.resp.get("retry-after"))
+                if attempt == SHEETS_RETRY_MAX or (write and status != 429):
+                    raise
+                with self.cond:
+                    self.stats["retries"] += 1
+                continue
+            finally:
+                self._release(slot)
+                if parent_slot is not None:
+                    self.parent._release(parent_slot)
+            with self.cond:
+                self.failures = 0
+                self.stats["writes" if write else "reads"] += 1
+            return res
+
+    def _acquire(self, write: bool):
+        with self.cond:
+            if write:
+                self.writers += 1
+            limit = self.per_window if write else self.read_limit
+            waited = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    while self.sent and now - self.sent[0][0] >= self.window:
+                        self.sent.popleft()
+                    timeout = self.backoff_until - now
+                    if timeout <= 0:
+                        full = len(self.sent) >= limit
+                        if not full and (write or not self.writers):
+                            slot = [_IN_FLIGHT]  # só começa a vencer quando a chamada termina
+                            self.sent.append(slot)
+                            return slot
+                        # cota cheia: espera o mais antigo vencer; atrás de uma
+                        # chamada em andamento ou de gravação, espera o notify
+                        oldest = self.sent[0][0] if full else _IN_FLIGHT
+                        timeout = self.window - (now - oldest) if oldest != _IN_FLIGHT else None
+                    if not waited:
+                        waited = True
+                        self.stats["waited"] += 1
+                    self.cond.wait(timeout)
+            finally:
+                if write:
+                    self.writers -= 1
+                    self.cond.notify_all()
+
+    def _release(self, slot: list):
+        with self.cond:
+            slot[0] = time.monotonic()
+            self.cond.notify_all()
+
+    def _back_off(self, retry_after):
+        with self.cond:
+            self.stats["throttled"] += 1
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = random.uniform(0.5, 1.0) * min(SHEETS_RETRY_CAP, SHEETS_RETRY_BASE * 2 ** self.failures)
+            self.failures += 1
+            self.backoff_until = max(self.backoff_until, time.monotonic() + delay)
+            self.cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            now = time.monotonic()
+            used = sum(1 for (t,) in self.sent if now - t < self.window)
+            return {
+                **self.stats,
+                "used": used,
+                "quota": self.per_window,
+                "backoff_s": round(max(0.0, self.backoff_until - now), 2),
+            }
+
+SHEETS = SheetsScheduler(SHEETS_QUOTA_PER_MINUTE, SHEETS_QUOTA_WINDOW)
 
 def append_row(values: list):
     """
     Append no range definido. Importante: o range deve apontar para a aba correta.
     Recomendado no Render: GOOGLE_SHEETS_RANGE = SuaAba!A1:L
     """
-    spreadsheet_id = os.environ["GOOGLE_SHEETS_SPREADSHEET_ID"]
-    rng = os.environ.get("GOOGLE_SHEETS_RANGE", "lancamentos!A1:L")
-    svc = _sheets_service()
-    body = {"values": [values]}
-    return (
-        svc.spreadsheets()
+    return append_rows([values])
+
+def append_rows(rows: list):
+    """
+    Várias linhas num único values.append (mesmo range de append_row).
+    Com LEDGER_BACKEND=sqlite as linhas vão para o ledger local e chegam ao
+    Sheets pela réplica. Vai para a planilha do tenant atual.
+    """
+    tenant = current_tenant()
+    with M_APPEND.time(LEDGER_BACKEND):
+        if LEDGER_BACKEND == "sqlite":
+            return tenant.ledger().append(rows)
+        res = sheets_append_rows(rows, tenant)
+        tenant.ledger().add_local(rows, _first_row_of((res.get("updates") or {}).get("updatedRange")))
+        return res
+
+def sheets_append_rows(rows: list, tenant: "Tenant" = None):
+    """O values.append em si, sem passar pelo ledger local."""
+    tenant = tenant or current_tenant()
+    spreadsheet_id = tenant.spreadsheet_id
+    body = {"values": rows}
+    return tenant.sheets.write(
+        lambda svc: svc.spreadsheets()
         .values()
         .append(
             spreadsheetId=spreadsheet_id,
-            range=rng,
+            range=tenant.append_range,
             valueInputOption="USER_ENTERED",
             insertDataOption="INSERT_ROWS",
             body=body,
         )
-        .execute()
     )
 
 def _norm_header(h: str) -> str:
@@ -152,115 +1103,1571 @@ def _norm_header(h: str) -> str:
 
 def read_all_rows():
     """
-    Lê a planilha e devolve lista de dicts com chaves NORMALIZADAS:
+    Lê a planilha inteira e devolve lista de dicts com chaves NORMALIZADAS:
     id,timestamp,tipo,valor,moeda,categoria,descricao,pagamento,data,confianca,confirmado,mensagem_original
+    Caminho lento (uma leitura completa por chamada); resumo e consultas usam
+    o espelho local (ledger()), que guarda os dados em LedgerStore.
+    Com LEDGER_BACKEND=sqlite lê do ledger local. Planilha do tenant atual.
     """
-    spreadsheet_id = os.environ["GOOGLE_SHEETS_SPREADSHEET_ID"]
-    rng = os.environ.get("GOOGLE_SHEETS_READ_RANGE") or os.environ.get("GOOGLE_SHEETS_RANGE", "lancamentos!A1:L")
-    svc = _sheets_service()
-    res = svc.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=rng).execute()
-    values = res.get("values") or []
+    with M_READ_ALL.time(LEDGER_BACKEND):
+        if LEDGER_BACKEND == "sqlite":
+            return ledger().read_all()
+        return _sheets_read_all_rows()
 
-    # Debug (mantém; ajuda quando der ruim)
-    print("READ_RANGE =", rng)
-    print("ROWS_READ  =", len(values))
-    print("HEADERS_RAW=", values[0] if values else "EMPTY")
+def _sheets_read_all_rows():
+    return list(iter_rows())
 
-    if not values or len(values) < 2:
-        return []
+def iter_rows():
+    """
+    Mesmas linhas do read_all_rows, uma por vez: a planilha é lida em janelas
+    (iter_sheet_chunks) e só a janela atual (e a seguinte, já pedida) fica
+    em memória.
+    """
+    tenant = current_tenant()
+    headers = None
+    for raw_headers, _, lines in iter_sheet_chunks(tenant.spreadsheet_id, tenant.read_range, sheets=tenant.sheets):
+        if headers is None:
+            headers, _ = _header_map(tuple(raw_headers))
+        M_ROWS_READ.inc("read_all_rows", amount=len(lines))
+        yield from _rows_from_values(headers, lines)
 
-    headers = [_norm_header(h) for h in values[0]]
+def _rows_from_values(headers: list, lines: list):
     rows = []
-    for line in values[1:]:
+    for line in lines:
         row = {}
         for i, h in enumerate(headers):
             row[h] = line[i] if i < len(line) else ""
         rows.append(row)
-
-    print("HEADERS_NORM=", headers)
-    print("SAMPLE_ROW  =", rows[0] if rows else "NO_DATA")
     return rows
 
+@lru_cache(maxsize=32)
+def _header_map(raw_headers: tuple):
+    """
+    Headers crus -> (headers normalizados, {header: posição}).
+    Cacheado pela tupla (hash) dos headers: o _norm_header só roda quando o header muda.
+    """
+    headers = tuple(_norm_header(h) for h in raw_headers)
+    pos = {}
+    for i, h in enumerate(headers):
+        pos.setdefault(h, i)
+    return headers, pos
+
+_UPDATED_RANGE_RE = re.compile(r"![A-Za-z]+(\d+)")
+
+def _first_row_of(rng: str) -> int:
+    """"lancamentos!A120:L122" -> 120 (0 se não der para saber)."""
+    m = _UPDATED_RANGE_RE.search(rng or "")
+    return int(m.group(1)) if m else 0
+
 # =========================================================
-# Helpers
+# Store colunar do ledger
 # =========================================================
-def now_iso():
-    return dt.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+TIPO_CODES = {"receita": 1, "despesa": 2}
+TIPO_NAMES = {1: "receita", 2: "despesa"}
+TEXT_CACHE_MAX = 2048
 
-def today_iso():
-    return dt.date.today().isoformat()
+class LedgerStore:
+    """
+    Lançamentos em colunas compactas, um array por campo:
+    - dates: ordinal da data (0 = sem data válida)
+    - values: float64, com o sinal que veio da planilha
+    - tipos: 1 receita, 2 despesa, 0 outro
+    - cats / pays: códigos de categoria (já normalizada) e pagamento, internados
+      em cat_names / pay_names
+    - sheet_rows: número da linha na planilha (0 = desconhecido)
 
-def parse_valor(text: str):
-    t = (text or "").lower()
-    m = re.search(r"(\d{1,9}(?:[.,]\d{2})?)", t)
-    if not m:
-        return None
-    raw = m.group(1).replace(".", "").replace(",", ".")
-    try:
-        return float(raw)
-    except:
-        return None
+    descricao e mensagem_original não ficam em memória: text() busca a célula
+    via loader(sheet_row, campo) e guarda num LRU pequeno.
+    """
 
-def parse_data(text: str):
-    t = (text or "").lower().strip()
-    if t == "hoje":
-        return dt.date.today().isoformat()
-    if t == "ontem":
-        return (dt.date.today() - dt.timedelta(days=1)).isoformat()
+    def __init__(self, pos: dict, loader=None):
+        self.pos = pos
+        self.loader = loader
+        self.dates = array("i")
+        self.values = array("d")
+        self.tipos = bytearray()
+        self.cats = array("H")
+        self.pays = array("H")
+        self.sheet_rows = array("i")
+        self.cat_names, self.cat_codes = [], {}
+        self.pay_names, self.pay_codes = [], {}
+        self.text_cache = OrderedDict()
+        self._date_cache = {}
 
-    m = re.search(r"\b(\d{1,2})[\/\-](\d{1,2})(?:[\/\-](\d{2,4}))?\b", t)
-    if not m:
-        return None
-    d = int(m.group(1))
-    mo = int(m.group(2))
-    y = m.group(3)
-    if y is None:
-        y = dt.date.today().year
-    else:
-        y = int(y)
-        if y < 100:
-            y += 2000
-    try:
-        return dt.date(y, mo, d).isoformat()
-    except:
-        return None
+    def __len__(self):
+        return len(self.dates)
 
-def normalize_sign(tx: dict):
-    if tx.get("valor") is None:
-        return
-    v = float(tx["valor"])
-    if tx.get("tipo") == "despesa":
-        tx["valor"] = -abs(v)
-    elif tx.get("tipo") == "receita":
-        tx["valor"] = abs(v)
+    @staticmethod
+    def _intern(names: list, codes: dict, s: str) -> int:
+        code = codes.get(s)
+        if code is None:
+            code = codes[s] = len(names)
+            names.append(sys.intern(s))
+        return code
 
-def ensure_receita_descricao(tx: dict):
-    # Receita não pergunta descrição; preenche automático para manter coluna consistente
-    if tx.get("tipo") != "receita":
-        return
-    if tx.get("descricao") and str(tx["descricao"]).strip():
-        return
-    origem = (tx.get("categoria") or "").strip()
-    original = (tx.get("mensagem_original") or "").strip()
-    if origem:
-        tx["descricao"] = f"Receita - {origem}"
-    elif original:
-        tx["descricao"] = original[:180]
-    else:
-        tx["descricao"] = "Receita"
+    def append_line(self, line: list, sheet_row: int = 0) -> int:
+        """Faz o parse de uma linha crua do Sheets direto para as colunas; devolve o índice."""
+        self.extend([line], sheet_row)
+        return len(self.dates) - 1
 
-def tx_to_row(tx: dict):
-    """
-    Grava na ordem do SEU header (normalizado):
-    ID, TIMESTAMP, TIPO, VALOR, MOEDA, CATEGORIA, DESCRIÇÃO, pagamento..., Data, confianca..., confirmado..., mensagem_original...
-    """
-    return [
-        tx.get("id", ""),
-        tx.get("timestamp", ""),
-        tx.get("tipo", ""),
-        tx.get("valor", ""),
-        tx.get("moeda", "BRL"),
-        tx.get("categoria", ""),
+    def extend(self, lines, first_sheet_row: int = 0):
+        """Uma passada só sobre as linhas cruas, sem montar dicts no caminho."""
+        pos = self.pos
+        p_data, p_valor, p_tipo = pos.get("data", -1), pos.get("valor", -1), pos.get("tipo", -1)
+        p_cat, p_pag = pos.get("categoria", -1), pos.get("pagamento", -1)
+        date_cache, cat_codes, pay_codes = self._date_cache, self.cat_codes, self.pay_codes
+        dates, values, tipos, cats, pays, rows = (
+            self.dates, self.values, self.tipos, self.cats, self.pays, self.sheet_rows
+        )
+        row = first_sheet_row
+        for line in lines:
+            n = len(line)
+            raw_date = line[p_data] if 0 <= p_data < n else ""
+            day = date_cache.get(raw_date)
+            if day is None:
+                d = _parse_date_any(raw_date)
+                day = date_cache[raw_date] = d.toordinal() if d else 0
+
+            cat = line[p_cat] if 0 <= p_cat < n else ""
+            cat = (cat or "Sem categoria").strip() or "Sem categoria"
+            cat_code = cat_codes.get(cat)
+            if cat_code is None:
+                cat_code = self._intern(self.cat_names, cat_codes, cat)
+
+            pay = (line[p_pag] if 0 <= p_pag < n else "").strip().lower()
+            pay_code = pay_codes.get(pay)
+            if pay_code is None:
+                pay_code = self._intern(self.pay_names, pay_codes, pay)
+
+            dates.append(day)
+            values.append(_to_float(line[p_valor]) if 0 <= p_valor < n else 0.0)
+            tipos.append(TIPO_CODES.get((line[p_tipo] if 0 <= p_tipo < n else "").strip().lower(), 0))
+            cats.append(cat_code)
+            pays.append(pay_code)
+            rows.append(row)
+            if row:
+                row += 1
+
+    def remember_text(self, i: int, line: list):
+        """Guarda os textos de uma linha que já temos em mãos (ex.: acabou de ser gravada)."""
+        for field in ("descricao", "mensagem_original"):
+            p = self.pos.get(field)
+            if p is not None and p < len(line):
+                self._cache_put((i, field), str(line[p]))
+
+    def _cache_put(self, key, value):
+        self.text_cache[key] = value
+        self.text_cache.move_to_end(key)
+        if len(self.text_cache) > TEXT_CACHE_MAX:
+            self.text_cache.popitem(last=False)
+
+    def text(self, i: int, field: str) -> str:
+        key = (i, field)
+        if key in self.text_cache:
+            self.text_cache.move_to_end(key)
+            return self.text_cache[key]
+        row = self.sheet_rows[i]
+        if not row or self.loader is None:
+            return ""
+        value = self.loader(row, field)
+        self._cache_put(key, value)
+        return value
+
+    def tipo(self, i: int) -> str:
+        return TIPO_NAMES.get(self.tipos[i], "")
+
+    def categoria(self, i: int) -> str:
+        return self.cat_names[self.cats[i]]
+
+    def pagamento(self, i: int) -> str:
+        return self.pay_names[self.pays[i]]
+
+# =========================================================
+# Espelho local do ledger
+# =========================================================
+LEDGER_RESYNC_SECONDS = float(os.environ.get("LEDGER_RESYNC_SECONDS", "900"))
+# intervalo mínimo entre leituras do rabo: pedidos em rajada reaproveitam a última
+LEDGER_TAIL_MIN_SECONDS = float(os.environ.get("LEDGER_TAIL_MIN_SECONDS", "2"))
+# "sheets": a planilha é a fonte (journal + espelho); "sqlite": ledger local + réplica
+LEDGER_BACKEND = os.environ.get("LEDGER_BACKEND", "sheets").strip().lower()
+
+_RANGE_RE = re.compile(r"^(?:(.+)!)?([A-Za-z]+)(\d*)(?::([A-Za-z]+)(\d*))?$")
+
+def _split_range(rng: str):
+    """
+    "lancamentos!A1:L" -> ("lancamentos", "A", 1, "L"). None se o range não
+    tiver esse formato (aí o espelho sempre faz leitura completa).
+    """
+    m = _RANGE_RE.match(rng.strip())
+    if not m or not m.group(4) or m.group(5):
+        return None
+    sheet, c0, r0, c1 = m.group(1), m.group(2).upper(), m.group(3), m.group(4).upper()
+    return (sheet, c0, int(r0 or 1), c1)
+
+def _col_number(col: str) -> int:
+    n = 0
+    for ch in col:
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+def _col_letter(n: int) -> str:
+    s = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+SHEETS_CHUNK_ROWS = int(os.environ.get("SHEETS_CHUNK_ROWS", "5000"))
+SHEETS_PREFETCH_THREADS = int(os.environ.get("SHEETS_PREFETCH_THREADS", "4"))
+# threads fixos para a janela seguinte: cada um monta o service (thread-local) uma vez só
+_CHUNK_POOL = ThreadPoolExecutor(max_workers=max(1, SHEETS_PREFETCH_THREADS), thread_name_prefix="sheets-chunk")
+
+def iter_sheet_chunks(spreadsheet_id: str, read_range: str, chunk_rows: int = None, sheets: SheetsScheduler = None):
+    """
+    Lê read_range em janelas de chunk_rows linhas de dados e gera
+    (header cru, número na planilha da 1ª linha da janela, linhas).
+
+    Com "lancamentos!A1:L" e 5000: A1:L5001 (header + 5000), A5002:L10001,
+    ... A janela seguinte é pedida (num thread do _CHUNK_POOL, pelo
+    scheduler) assim que a atual chega, enquanto quem consome processa a atual. A API corta as
+    linhas vazias do fim de cada janela, então uma janela incompleta pode
+    ser só uma faixa vazia no meio da aba: a leitura segue até uma janela
+    voltar vazia (uma leitura a mais no fim). Range fora do formato
+    "Aba!A1:L": uma leitura só (linha inicial 0 = desconhecida). sheets: o
+    scheduler do tenant (padrão: o do tenant atual).
+    """
+    chunk_rows = max(1, chunk_rows or SHEETS_CHUNK_ROWS)
+    parts = _split_range(read_range)
+    sheets = sheets or current_tenant().sheets
+
+    def fetch(rng: str) -> list:
+        res = sheets.read(
+            ("get", spreadsheet_id, rng),
+            lambda svc: svc.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=rng),
+        )
+        return res.get("values") or []
+
+    if parts is None:
+        values = fetch(read_range)
+        yield (values[0] if values else []), 0, values[1:]
+        return
+
+    sheet, c0, r0, c1 = parts
+    prefix = f"{sheet}!" if sheet else ""
+    ctx = contextvars.copy_context()  # spans do trace atual também no thread
+    nxt = None
+    try:
+        with span("sheets.chunk", rows=chunk_rows + 1):
+            values = fetch(f"{prefix}{c0}{r0}:{c1}{r0 + chunk_rows}")
+        header, lines = (values[0] if values else []), values[1:]
+        first = r0 + 1
+        while True:
+            nxt = None
+            if lines:
+                lo = first + chunk_rows
+                nxt = _CHUNK_POOL.submit(ctx.run, fetch, f"{prefix}{c0}{lo}:{c1}{lo + chunk_rows - 1}")
+            yield header, first, lines
+            if nxt is None:
+                return
+            first += chunk_rows
+            with span("sheets.chunk", rows=chunk_rows, prefetched=nxt.done()):
+                lines = nxt.result()
+            if not lines:
+                return
+    finally:
+        if nxt is not None:
+            nxt.cancel()  # consumidor parou no meio: a janela seguinte não é mais pedida
+
+class LedgerMirror:
+    """
+    Cópia local da aba de lançamentos, guardada num LedgerStore.
+
+    A primeira leitura baixa o range inteiro; as seguintes buscam, num único
+    batchGet, só o header e o "rabo" a partir da última linha sincronizada.
+    Faz leitura completa de novo a cada resync_seconds ou se o header mudar.
+
+    Linhas gravadas por este processo (journal / append_rows) entram no
+    espelho (add_local) e ficam em "unconfirmed" até aparecerem na planilha: o
+    ID (coluna "id") evita duplicá-las no rabo, e uma leitura completa as
+    reaplica enquanto ainda não chegaram ao Sheets. add_local está no caminho
+    do ack: só enfileira sob local_lock, e quem sincroniza (com self.lock,
+    que pode durar uma leitura completa pela rede) aplica a fila no fim.
+    """
+
+    def __init__(self, tenant: "Tenant", resync_seconds: float):
+        self.tenant = tenant
+        self.spreadsheet_id = tenant.spreadsheet_id
+        self.read_range = tenant.read_range
+        self.parts = _split_range(self.read_range)
+        self.resync_seconds = resync_seconds
+        self.lock = threading.Lock()
+        self.local_lock = threading.Lock()
+        self.local = []           # [(linhas, first_row)] de add_local ainda não aplicadas
+        self.raw_headers = None
+        self.store = LedgerStore({})
+        self.ids = set()
+        self.unconfirmed = OrderedDict()  # id -> linha local ainda não vista na planilha
+        self.sheet_rows = 0       # linhas de dados já lidas da planilha (inclui vazias)
+        self.synced_at = 0.0
+        self.tail_synced_at = 0.0
+        self.version = 0          # muda sempre que o conteúdo do espelho muda
+        self.index = PeriodIndex()
+
+    def window_totals(self, windows: list):
+        """
+        [(total_rec, total_des, rec_by_cat, des_by_cat)] para cada (start, end)
+        de windows; None se a planilha não tem lançamentos. Um período só (o
+        caso comum, cache de resumo que expirou com um lançamento novo) sai do
+        PeriodIndex, sem varrer as linhas; vários, com numpy, saem de uma
+        passada só (aggregate_windows).
+        """
+        with self.lock:
+            with span("ledger.sync"):
+                self._sync()
+            if not len(self.store):
+                return None
+            vectorized = HAS_NUMPY and len(windows) > 1
+            with span("ledger.aggregate", rows=len(self.store), windows=len(windows), numpy=vectorized):
+                if vectorized:
+                    return aggregate_windows(self.store, windows)
+                return [self.index.totals(start, end) for start, end in windows]
+
+    def synced_version(self) -> int:
+        """Sincroniza e devolve a versão atual (chave de cache dos resumos)."""
+        with self.lock:
+            self._sync()
+            return self.version
+
+    def _sync(self, force: bool = False):
+        now = time.monotonic()
+        stale = now - self.synced_at >= self.resync_seconds
+        if self.raw_headers is None or stale or self.parts is None:
+            self._full_sync()
+        elif force or now - self.tail_synced_at >= LEDGER_TAIL_MIN_SECONDS:
+            self._tail_sync()
+        self._apply_local()  # inclusive as que chegaram durante a leitura
+
+    def _first_data_row(self) -> int:
+        return self.parts[2] + 1 if self.parts else 0
+
+    def _full_sync(self):
+        # janela por janela direto para as colunas: a matriz inteira nunca fica em memória
+        store, ids, rows, start = None, set(), 0, None
+        for raw_headers, first_row, lines in iter_sheet_chunks(self.spreadsheet_id, self.read_range, sheets=self.tenant.sheets):
+            if start is None:
+                start = first_row
+            if store is None:
+                self.raw_headers = raw_headers
+                _, pos = _header_map(tuple(raw_headers))
+                store = LedgerStore(pos, loader=self._load_text)
+                id_pos = pos.get("id")
+            with span("ledger.build_store", rows=len(lines)):
+                store.extend(lines, first_row)
+                if id_pos is not None:
+                    ids.update(line[id_pos] for line in lines if id_pos < len(line) and line[id_pos])
+            # posição, não contagem: uma janela curta (faixa vazia) não encerra a aba
+            rows = first_row - start + len(lines) if first_row else rows + len(lines)
+            M_ROWS_READ.inc("mirror_full", amount=len(lines))
+
+        self.store = store
+        self.ids = ids
+        self.index = PeriodIndex.from_store(store)
+        self.sheet_rows = rows
+        self.synced_at = self.tail_synced_at = time.monotonic()
+        self.version += 1
+
+        for rid in [rid for rid in self.unconfirmed if rid in self.ids]:
+            del self.unconfirmed[rid]
+        self._add(list(self.unconfirmed.values()), keep_text=True)
+
+    def _tail_sync(self):
+        sheet, c0, r0, c1 = self.parts
+        prefix = f"{sheet}!" if sheet else ""
+        header_rng = f"{prefix}{c0}{r0}:{c1}{r0}"
+        tail_rng = f"{prefix}{c0}{r0 + 1 + self.sheet_rows}:{c1}"
+        res = self.tenant.sheets.read(
+            ("batchGet", self.spreadsheet_id, header_rng, tail_rng),
+            lambda svc: svc.spreadsheets().values().batchGet(
+                spreadsheetId=self.spreadsheet_id, ranges=[header_rng, tail_rng]
+            ),
+        )
+        self.tail_synced_at = time.monotonic()
+        ranges = res.get("valueRanges") or [{}, {}]
+        header_vals = ranges[0].get("values") or [[]]
+        if header_vals[0] != self.raw_headers:
+            self._full_sync()
+            return
+
+        tail = ranges[1].get("values") or []
+        M_ROWS_READ.inc("mirror_tail", amount=len(tail))
+        if not tail:
+            return
+        first_row = self._first_data_row() + self.sheet_rows
+        self.sheet_rows += len(tail)
+        self._add(tail, first_row, from_sheet=True)
+
+    def _row_id(self, line: list) -> str:
+        id_pos = self.store.pos.get("id")
+        return line[id_pos] if id_pos is not None and id_pos < len(line) else ""
+
+    def _add(self, lines: list, first_row: int = 0, keep_text: bool = False, from_sheet: bool = False):
+        store = self.store
+        added = False
+        for k, line in enumerate(lines):
+            rid = self._row_id(line)
+            if rid:
+                if from_sheet:
+                    self.unconfirmed.pop(rid, None)
+                if rid in self.ids:
+                    continue
+                self.ids.add(rid)
+            i = store.append_line(line, first_row + k if first_row else 0)
+            if keep_text:
+                store.remember_text(i, line)
+            self.index.add_store_row(store, i)
+            added = True
+        if added:
+            self.version += 1
+
+    def add_local(self, lines: list, first_row: int = 0):
+        """Linhas gravadas por este processo (formato tx_to_row), já no Sheets ou só no journal."""
+        lines = [["" if v is None else str(v) for v in line] for line in lines]
+        with self.local_lock:
+            self.local.append((lines, first_row))
+
+    def _apply_local(self):
+        # com self.lock
+        with self.local_lock:
+            batches, self.local = self.local, []
+        for lines, first_row in batches:
+            for line in lines:
+                # antes do primeiro sync não há header: no tx_to_row o ID é a 1ª coluna
+                rid = self._row_id(line) if self.raw_headers is not None else line[0]
+                if rid and (rid in self.unconfirmed or rid not in self.ids):
+                    self.unconfirmed[rid] = line
+            if self.raw_headers is not None:
+                self._add(lines, first_row, keep_text=True)
+            # sem header ainda: a primeira leitura completa aplica "unconfirmed"
+
+    def sheet_ids(self, ids) -> set:
+        """Quais destes IDs já estão de fato na planilha (sincroniza antes)."""
+        with self.lock:
+            self._sync(force=True)
+            return {rid for rid in ids if rid in self.ids and rid not in self.unconfirmed}
+
+    def _load_text(self, sheet_row: int, field: str) -> str:
+        """Busca uma célula de texto (descricao, mensagem_original) sob demanda."""
+        p = self.store.pos.get(field)
+        if p is None or self.parts is None:
+            return ""
+        sheet, c0, _, _ = self.parts
+        col = _col_letter(_col_number(c0) + p)
+        rng = f"{sheet}!{col}{sheet_row}" if sheet else f"{col}{sheet_row}"
+        res = self.tenant.sheets.read(
+            ("get", self.spreadsheet_id, rng),
+            lambda svc: svc.spreadsheets().values().get(spreadsheetId=self.spreadsheet_id, range=rng),
+        )
+        values = res.get("values") or [[""]]
+        return values[0][0] if values[0] else ""
+
+    def text(self, i: int, field: str) -> str:
+        with self.lock:
+            return self.store.text(i, field)
+
+def ledger():
+    """Ledger (espelho ou SQLite) do tenant atual."""
+    return current_tenant().ledger()
+
+# =========================================================
+# Journal local + gravação em lote no Sheets (write-behind)
+# =========================================================
+JOURNAL_PATH = os.environ.get("LEDGER_JOURNAL_PATH", "ledger_journal.jsonl")
+JOURNAL_FLUSH_ROWS = int(os.environ.get("JOURNAL_FLUSH_ROWS", "50"))
+JOURNAL_FLUSH_SECONDS = float(os.environ.get("JOURNAL_FLUSH_SECONDS", "2"))
+JOURNAL_RETRY_SECONDS = float(os.environ.get("JOURNAL_RETRY_SECONDS", "10"))
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+JOURNAL_MAX_SLOTS = 64
+
+class LedgerJournal:
+    """
+    Lançamentos confirmados vão primeiro para um arquivo append-only local
+    (uma linha JSON por lançamento, com fsync) e o usuário recebe o ack na hora.
+    Um thread de fundo grava no Sheets em lotes (append_rows) quando junta
+    flush_rows linhas ou a mais antiga passa de flush_seconds.
+
+    O byte até onde tudo já foi gravado fica em <path>.offset. Na primeira
+    subida do thread, as entradas entre o offset e o fim do arquivo na
+    abertura (as de uma execução anterior) são reenviadas; antes disso os IDs
+    são conferidos na planilha, para que um crash entre o append e a
+    atualização do offset nunca duplique linhas. O mesmo vale para um lote
+    cujo append falhou: o erro (503, timeout) pode ter vindo depois da
+    gravação, então o reenvio só leva os IDs que a planilha ainda não tem.
+
+    Com vários workers uvicorn, cada processo trava (flock) um "slot":
+    ledger_journal.jsonl, ledger_journal.1.jsonl, ... e recupera o que ficou
+    pendente no seu. Quem pega o slot 0 também adota os slots que ninguém
+    travou (a execução anterior tinha mais workers): as entradas pendentes
+    deles vão para o seu journal e o offset do slot órfão avança.
+    """
+
+    def __init__(self, tenant: "Tenant", path: str, flush_rows: int, flush_seconds: float):
+        self.tenant = tenant
+        self.base_path = path
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self.cond = threading.Condition()
+        self.pending = []         # [(offset do fim da entrada, linha, monotonic)]
+        self.fh = None
+        self.size = 0
+        self.recover_end = 0      # fim do arquivo na abertura: o que vem depois já está em pending
+        self.recovered = False
+        self.adopted = False      # slots órfãos já conferidos (só o slot 0 confere)
+        self.uncertain = False    # último append falhou: pode ter chegado ao Sheets
+        self.thread = None
+        self.stopping = False
+        self.stats = {"appended": 0, "flushed": 0, "batches": 0, "failures": 0, "replayed": 0, "skipped": 0}
+
+    # --- arquivo -------------------------------------------------------
+    def _slot_path(self, slot: int) -> str:
+        if slot == 0:
+            return self.base_path
+        root, ext = os.path.splitext(self.base_path)
+        return f"{root}.{slot}{ext}"
+
+    def _open(self):
+        if self.fh is not None:
+            return
+        for slot in range(JOURNAL_MAX_SLOTS):
+            path = self._slot_path(slot)
+            fh = open(path, "ab")
+            if fcntl is None:
+                break
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                fh.close()
+        else:
+            raise RuntimeError("JOURNAL: nenhum slot livre")
+        self.path = path
+        self.offset_path = path + ".offset"
+        self._drop_partial_tail()
+        self.fh = fh
+        self.size = self.recover_end = fh.seek(0, os.SEEK_END)
+
+    def _drop_partial_tail(self):
+        # crash no meio de uma escrita deixa uma linha sem "\n" no fim: descarta
+        # (nunca foi confirmada ao usuário, o fsync não tinha voltado)
+        try:
+            with open(self.path, "rb+") as f:
+                if f.seek(0, os.SEEK_END) == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) == b"\n":
+                    return
+                f.seek(0)
+                data = f.read()
+                f.truncate(data.rfind(b"\n") + 1)
+        except FileNotFoundError:
+            pass
+
+    def _read_offset(self, offset_path: str = None) -> int:
+        try:
+            with open(offset_path or self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, offset: int, offset_path: str = None):
+        offset_path = offset_path or self.offset_path
+        tmp = offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, offset_path)
+
+    @staticmethod
+    def _read_entries(path: str, offset: int, end: int = None) -> list:
+        """[(offset do fim da entrada, linha)] de offset até end (ou o fim do arquivo)."""
+        entries = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for data in f:
+                if end is not None and offset >= end:
+                    break
+                offset += len(data)
+                try:
+                    entries.append((offset, json.loads(data)["row"]))
+                except (ValueError, KeyError):
+                    break  # linha truncada por crash no meio da escrita
+        return entries
+
+    def _maybe_compact(self, offset: int):
+        # tudo gravado e arquivo grande: recomeça do zero
+        if offset == self.size and self.size > JOURNAL_COMPACT_BYTES:
+            self.fh.truncate(0)
+            self.size = 0
+            self._write_offset(0)
+
+    # --- API -----------------------------------------------------------
+    def append(self, rows: list):
+        """Grava as linhas no journal com fsync; quando volta, o lançamento é durável."""
+        with self.cond:
+            self._open()
+            self._write_rows(rows)
+            self.stats["appended"] += len(rows)
+        self.tenant.ledger().add_local(rows)
+        self.start()
+
+    def _write_rows(self, rows: list):
+        # com self.cond
+        now = time.monotonic()
+        chunks = []
+        for row in rows:
+            data = (json.dumps({"row": row}, ensure_ascii=False) + "\n").encode()
+            chunks.append(data)
+            self.size += len(data)
+            self.pending.append((self.size, row, now))
+        self.fh.write(b"".join(chunks))
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+        self.cond.notify()
+
+    def start(self):
+        with self.cond:
+            if self.thread is not None:
+                return
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="ledger-journal", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout: float) -> bool:
+        """
+        Tenta gravar o que falta (até timeout); o resto fica no journal para o
+        próximo start. True se o thread de flush terminou.
+        """
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+        self.thread = None
+        return thread is None or not thread.is_alive()
+
+    def close(self):
+        """Fecha o arquivo e solta o flock do slot (depois de um stop que terminou)."""
+        with self.cond:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+
+    def snapshot(self):
+        with self.cond:
+            return {**self.stats, "pending": len(self.pending)}
+
+    # --- thread de flush -----------------------------------------------
+    def _recover(self):
+        """Reenvia o que uma execução anterior deixou no journal (uma vez por journal)."""
+        with self.cond:
+            if self.recovered:
+                return
+            self._open()
+            # depois de recover_end são appends deste processo, já em pending
+            entries = self._read_entries(self.path, self._read_offset(), self.recover_end)
+        if not entries:
+            with self.cond:
+                self.recovered = True
+            return
+
+        already = self.tenant.ledger().sheet_ids([row[0] for _, row in entries if row and row[0]])
+        missing = [(end, row) for end, row in entries if not row or row[0] not in already]
+        print("JOURNAL RECOVER:", len(entries), "entradas,", len(entries) - len(missing), "já estavam na planilha")
+        now = time.monotonic()
+        with self.cond:
+            self.pending[:0] = [(end, row, now) for end, row in missing]
+            self.stats["replayed"] += len(missing)
+            self.recovered = True
+            if not self.pending:
+                self._write_offset(self.size)
+        if missing:
+            self.tenant.ledger().add_local([row for _, row in missing])
+
+    def _adopt_orphans(self):
+        """
+        Slot 0: copia para este journal as entradas pendentes dos outros slots
+        que ninguém trava. Os IDs que já estão na planilha ou na fila daqui
+        ficam de fora; o offset do órfão só avança depois do fsync da cópia.
+        """
+        if self.adopted:
+            return
+        if fcntl is None or self.path != self.base_path:
+            self.adopted = True
+            return
+        for slot in range(1, JOURNAL_MAX_SLOTS):
+            path = self._slot_path(slot)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as fh:
+                try:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # slot de um worker vivo: ele mesmo recupera
+                entries = self._read_entries(path, self._read_offset(path + ".offset"))
+                if not entries:
+                    continue
+                already = self.tenant.ledger().sheet_ids([row[0] for _, row in entries if row and row[0]])
+                with self.cond:
+                    skip = already | {row[0] for _, row, _ in self.pending if row}
+                    missing = [row for _, row in entries if not row or row[0] not in skip]
+                    if missing:
+                        self._write_rows(missing)
+                        self.stats["replayed"] += len(missing)
+                self._write_offset(entries[-1][0], path + ".offset")
+                print("JOURNAL ADOPT:", path, len(entries), "entradas,", len(missing), "para reenviar")
+                if missing:
+                    self.tenant.ledger().add_local(missing)
+        self.adopted = True
+
+    def _due(self) -> bool:
+        if not self.pending:
+            return False
+        if self.stopping or len(self.pending) >= self.flush_rows:
+            return True
+        return time.monotonic() - self.pending[0][2] >= self.flush_seconds
+
+    def _run(self):
+        _TENANT.set(self.tenant)
+        # nada sai antes da recuperação: o offset gravado depois de um lote
+        # novo passaria por cima das entradas antigas ainda não reenviadas
+        while not (self.recovered and self.adopted):
+            try:
+                self._recover()
+                self._adopt_orphans()
+            except Exception as e:
+                print("JOURNAL RECOVER ERROR:", repr(e))
+                with self.cond:
+                    if self.stopping:
+                        return
+                    self.cond.wait(JOURNAL_RETRY_SECONDS)
+
+        while True:
+            with self.cond:
+                while not self._due():
+                    if self.stopping:
+                        return
+                    timeout = None
+                    if self.pending:
+                        timeout = max(0.0, self.flush_seconds - (time.monotonic() - self.pending[0][2]))
+                    self.cond.wait(timeout)
+                batch = self.pending[: self.flush_rows]
+
+            rows = [row for _, row, _ in batch]
+            try:
+                if self.uncertain:
+                    present = self.tenant.ledger().sheet_ids([row[0] for row in rows if row and row[0]])
+                    rows = [row for row in rows if not row or row[0] not in present]
+                    self.uncertain = False
+                    with self.cond:
+                        self.stats["skipped"] += len(batch) - len(rows)
+                if rows:
+                    append_rows(rows)
+            except Exception as e:
+                print("JOURNAL FLUSH ERROR:", repr(e))
+                with self.cond:
+                    self.uncertain = True
+                    self.stats["failures"] += 1
+                    if self.stopping:
+                        return
+                    self.cond.wait(JOURNAL_RETRY_SECONDS)
+                continue
+
+            with self.cond:
+                del self.pending[: len(batch)]
+                offset = self.size if not self.pending else batch[-1][0]
+                self._write_offset(offset)
+                self._maybe_compact(offset)
+                self.stats["flushed"] += len(batch)
+                self.stats["batches"] += 1
+
+# =========================================================
+# Ledger em SQLite (primário) + réplica no Sheets
+# =========================================================
+LEDGER_DB = os.environ.get("LEDGER_DB", "ledger.db")
+REPLICA_BATCH_ROWS = int(os.environ.get("LEDGER_REPLICA_BATCH_ROWS", "200"))
+# teto de linhas por values.append quando há fila (ex.: depois de um import)
+REPLICA_MAX_BATCH_ROWS = int(os.environ.get("LEDGER_REPLICA_MAX_BATCH_ROWS", "5000"))
+REPLICA_FLUSH_SECONDS = float(os.environ.get("LEDGER_REPLICA_FLUSH_SECONDS", "2"))
+REPLICA_RETRY_SECONDS = float(os.environ.get("LEDGER_REPLICA_RETRY_SECONDS", "10"))
+
+# mesma ordem do tx_to_row (e do header da planilha)
+LEDGER_COLUMNS = (
+    "id", "timestamp", "tipo", "valor", "moeda", "categoria", "descricao",
+    "pagamento", "data", "confianca", "confirmado", "mensagem_original",
+)
+
+class SqliteLedger:
+    """
+    Lançamentos num SQLite local (WAL, synchronous=FULL): quando append volta,
+    o lançamento é durável e o ack pode sair. Resumos e consultas leem daqui,
+    com índices por data (dia, em ordinal), tipo e categoria.
+
+    A aba do Sheets vira réplica: um thread de fundo manda as linhas com
+    replicated = 0 em lotes (um values.append por lote, pelo SHEETS) e marca
+    as que foram. Se um append falha (ou o processo caiu no meio de um), os IDs
+    da coluna de ID da planilha são conferidos antes do próximo lote, para não
+    duplicar. Com vários workers, só quem trava (flock) <db>.replica.lock
+    replica; os outros só gravam no banco.
+
+    Na primeira subida com o banco vazio, a planilha existente é importada
+    (já como replicada). Mesma API do LedgerJournal (append/start/stop/snapshot)
+    e do LedgerMirror (synced_version/window_totals).
+    """
+
+    def __init__(self, tenant: "Tenant", path: str, batch_rows: int, flush_seconds: float):
+        self.tenant = tenant
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS ledger ("
+            "seq INTEGER PRIMARY KEY, id TEXT UNIQUE, timestamp TEXT, tipo TEXT NOT NULL,"
+            " valor REAL NOT NULL, moeda TEXT, categoria TEXT NOT NULL, descricao TEXT,"
+            " pagamento TEXT, data TEXT, confianca, confirmado, mensagem_original TEXT,"
+            " dia INTEGER NOT NULL, replicated INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS ledger_dia ON ledger (dia)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ledger_tipo ON ledger (tipo, dia)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ledger_categoria ON ledger (categoria, dia)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ledger_pending ON ledger (seq) WHERE replicated = 0")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ledger_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.lock = threading.Lock()
+        self.seed_lock = threading.Lock()
+        self.seeded = False
+        self.batch_rows = max(1, batch_rows)
+        self.max_batch_rows = max(self.batch_rows, REPLICA_MAX_BATCH_ROWS)
+        self.flush_seconds = flush_seconds
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopping = False
+        self.unsent = 0           # gravados por este processo desde o último lote
+        self.lock_fh = None
+        # pendentes de uma execução anterior podem ter chegado ao Sheets sem ser marcados
+        self.uncertain = self.db.execute("SELECT EXISTS (SELECT 1 FROM ledger WHERE replicated = 0)").fetchone()[0]
+        self.stats = {"appended": 0, "replicated": 0, "batches": 0, "failures": 0, "seeded": 0}
+
+    # --- gravação / consultas ------------------------------------------
+    @staticmethod
+    def _record(line: list, replicated: int) -> tuple:
+        vals = dict(zip(LEDGER_COLUMNS, line))
+        d = _parse_date_any(vals.get("data"))
+        return (
+            vals.get("id") or None,
+            vals.get("timestamp"),
+            str(vals.get("tipo") or "").strip().lower(),
+            _to_float(vals.get("valor")),
+            vals.get("moeda"),
+            str(vals.get("categoria") or "").strip(),
+            vals.get("descricao"),
+            vals.get("pagamento"),
+            vals.get("data"),
+            vals.get("confianca"),
+            vals.get("confirmado"),
+            vals.get("mensagem_original"),
+            d.toordinal() if d else 0,
+            replicated,
+        )
+
+    def _insert(self, lines: list, replicated: int = 0, meta: dict = None) -> int:
+        """meta (ledger_meta) vai na mesma transação das linhas."""
+        with self.lock:
+            before = self.db.total_changes
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany(
+                    f"INSERT OR IGNORE INTO ledger ({', '.join(LEDGER_COLUMNS)}, dia, replicated)"
+                    f" VALUES ({', '.join('?' * (len(LEDGER_COLUMNS) + 2))})",
+                    [self._record(line, replicated) for line in lines],
+                )
+                inserted = self.db.total_changes - before
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO ledger_meta (key, value) VALUES (?, ?)", (meta or {}).items()
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            return inserted
+
+    def append(self, rows: list):
+        """Grava as linhas (formato tx_to_row); IDs repetidos são ignorados."""
+        added = self._insert(rows)
+        with self.cond:
+            self.stats["appended"] += added
+            self.unsent += added
+            if self.unsent >= self.batch_rows:
+                self.cond.notify()
+        self.start()
+        return added
+
+    def synced_version(self) -> int:
+        """Muda a cada lançamento novo (chave de cache dos resumos)."""
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(MAX(seq), 0) FROM ledger").fetchone()[0]
+
+    def window_totals(self, windows: list):
+        """Mesmo formato do LedgerMirror.window_totals, por GROUP BY no índice de dia."""
+        out = []
+        with self.lock:
+            if self.db.execute("SELECT NOT EXISTS (SELECT 1 FROM ledger)").fetchone()[0]:
+                return None
+            for start, end in windows:
+                total = {"receita": 0.0, "despesa": 0.0}
+                by_cat = {"receita": {}, "despesa": {}}
+                for tipo, cat, value in self.db.execute(
+                    "SELECT tipo, CASE categoria WHEN '' THEN 'Sem categoria' ELSE categoria END, SUM(ABS(valor))"
+                    " FROM ledger WHERE dia BETWEEN ? AND ? AND tipo IN ('receita', 'despesa')"
+                    " GROUP BY 1, 2",
+                    (start.toordinal(), end.toordinal()),
+                ):
+                    total[tipo] += value
+                    by_cat[tipo][cat] = value
+                out.append((total["receita"], total["despesa"], by_cat["receita"], by_cat["despesa"]))
+        return out
+
+    def read_all(self) -> list:
+        """Todas as linhas como dicts (mesmas chaves e valores em texto do read_all_rows)."""
+        return list(self.iter_all())
+
+    def iter_all(self, chunk_rows: int = None):
+        """
+        As linhas do read_all, uma por vez: páginas de chunk_rows por seq, com o
+        lock só durante cada SELECT (gravações seguem no meio da leitura).
+        """
+        chunk_rows = chunk_rows or SHEETS_CHUNK_ROWS
+        last = 0
+        while True:
+            with self.lock:
+                page = self.db.execute(
+                    f"SELECT seq, {', '.join(LEDGER_COLUMNS)} FROM ledger WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (last, chunk_rows),
+                ).fetchall()
+            for line in page:
+                yield {k: "" if v is None else str(v) for k, v in zip(LEDGER_COLUMNS, line[1:])}
+            if len(page) < chunk_rows:
+                return
+            last = page[-1][0]
+
+    # --- réplica -------------------------------------------------------
+    def start(self):
+        with self.cond:
+            if self.thread is not None:
+                return
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="ledger-replica", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout: float):
+        """Tenta replicar o que falta (até timeout); o resto sai no próximo start."""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+        self.thread = None
+
+    def snapshot(self):
+        with self.lock:
+            pending = self.db.execute("SELECT COUNT(*) FROM ledger WHERE replicated = 0").fetchone()[0]
+        with self.cond:
+            return {**self.stats, "pending": pending, "replicator": self.lock_fh is not None}
+
+    def _claim(self) -> bool:
+        """Um replicador por banco: flock não bloqueante em <db>.replica.lock."""
+        if self.lock_fh is not None:
+            return True
+        fh = open(self.path + ".replica.lock", "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fh.close()
+                return False
+        self.lock_fh = fh
+        return True
+
+    def ensure_seeded(self):
+        """
+        Banco novo: importa o que já está na planilha, marcado como replicado.
+        Uma vez só, entre threads (seed_lock) e entre workers (flock em
+        <db>.seed.lock): quem chega depois espera e encontra o 'seeded' gravado.
+        Cada janela lida é gravada na mesma transação que o 'seed_rows' (linhas
+        da planilha já consumidas), então um seed interrompido continua de onde
+        parou em vez de inserir de novo as linhas sem ID.
+        """
+        if self.seeded:
+            return
+        with self.seed_lock:
+            if self.seeded:
+                return
+            with open(self.path + ".seed.lock", "a") as fh:
+                if fcntl is not None:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                self._seed()
+            self.seeded = True
+
+    def _seed(self):
+        with self.lock:
+            meta = dict(self.db.execute("SELECT key, value FROM ledger_meta WHERE key IN ('seeded', 'seed_rows')"))
+        if "seeded" in meta:
+            return
+        skip = done = int(meta.get("seed_rows") or 0)
+        tenant = self.tenant
+        cols = None
+        for raw_headers, _, lines in iter_sheet_chunks(tenant.spreadsheet_id, tenant.read_range, sheets=tenant.sheets):
+            if cols is None:
+                _, pos = _header_map(tuple(raw_headers))
+                cols = [pos.get(name) for name in LEDGER_COLUMNS]
+            M_ROWS_READ.inc("sqlite_seed", amount=len(lines))
+            done += len(lines)
+            fresh, skip = lines[skip:], max(0, skip - len(lines))
+            fresh = [
+                [line[p] if p is not None and p < len(line) else "" for p in cols]
+                for line in fresh if any(line)
+            ]
+            self.stats["seeded"] += self._insert(fresh, replicated=1, meta={"seed_rows": str(done)})
+        self._insert([], meta={"seeded": "1"})
+        print("LEDGER SEED:", self.stats["seeded"], "linhas importadas da planilha")
+
+    def _sheet_ids(self) -> set:
+        """IDs já presentes na planilha (só a coluna de ID, que é a primeira)."""
+        spreadsheet_id = self.tenant.spreadsheet_id
+        parts = _split_range(self.tenant.append_range)
+        if parts:
+            sheet, c0, r0, _ = parts
+            rng = f"{sheet}!{c0}{r0}:{c0}" if sheet else f"{c0}{r0}:{c0}"
+        else:
+            rng = self.tenant.append_range
+        res = self.tenant.sheets.read(
+            ("get", spreadsheet_id, rng),
+            lambda svc: svc.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=rng),
+        )
+        return {line[0] for line in res.get("values") or [] if line and line[0]}
+
+    def _pending(self) -> list:
+        with self.lock:
+            return self.db.execute(
+                f"SELECT seq, {', '.join(LEDGER_COLUMNS)} FROM ledger WHERE replicated = 0"
+                " ORDER BY seq LIMIT ?",
+                (self.max_batch_rows,),
+            ).fetchall()
+
+    def _mark(self, seqs: list):
+        with self.lock:
+            self.db.executemany("UPDATE ledger SET replicated = 1 WHERE seq = ?", [(s,) for s in seqs])
+
+    def _replicate_batch(self) -> bool:
+        """Manda um lote; False quando não havia nada pendente."""
+        batch = self._pending()
+        if batch and self.uncertain:
+            present = self._sheet_ids()
+            self._mark([line[0] for line in batch if line[1] in present])
+            self.uncertain = False
+            batch = self._pending()
+        if not batch:
+            return False
+        rows = [["" if v is None else v for v in line[1:]] for line in batch]
+        try:
+            sheets_append_rows(rows, self.tenant)
+        except Exception:
+            self.uncertain = True
+            raise
+        self._mark([line[0] for line in batch])
+        with self.cond:
+            self.stats["replicated"] += len(batch)
+            self.stats["batches"] += 1
+        return True
+
+    def _run(self):
+        _TENANT.set(self.tenant)
+        while True:
+            with self.cond:
+                if self.unsent < self.batch_rows and not self.stopping:
+                    self.cond.wait(self.flush_seconds)
+                self.unsent = 0
+                stopping = self.stopping
+            try:
+                if self._claim():
+                    self.ensure_seeded()
+                    while self._replicate_batch():
+                        pass
+            except Exception as e:
+                print("LEDGER REPLICA ERROR:", repr(e))
+                with self.cond:
+                    self.stats["failures"] += 1
+                    if not self.stopping:
+                        self.cond.wait(REPLICA_RETRY_SECONDS)
+            if stopping:
+                return
+
+# =========================================================
+# Tenants: número do WhatsApp -> planilha própria
+# =========================================================
+TENANTS_FILE = os.environ.get("TENANTS_FILE", "").strip()
+TENANTS_RELOAD_SECONDS = float(os.environ.get("TENANTS_RELOAD_SECONDS", "5"))
+# cota de Sheets por tenant (chamadas por SHEETS_QUOTA_WINDOW), dentro da global; 0 = só a global
+TENANT_QUOTA_PER_MINUTE = int(os.environ.get("TENANT_SHEETS_QUOTA_PER_MINUTE", "0"))
+
+def _default_range() -> str:
+    return os.environ.get("GOOGLE_SHEETS_RANGE", "lancamentos!A1:L")
+
+def _tenant_path(path: str, key: str) -> str:
+    """ledger_journal.jsonl + 5511... -> ledger_journal.5511....jsonl"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{re.sub(r'[^0-9A-Za-z_-]', '', key)}{ext}"
+
+def _sheet_tag(spreadsheet_id: str, append_range: str) -> str:
+    """Hash curto da planilha: o número que muda de planilha ganha journal e banco novos."""
+    return hashlib.blake2b(f"{spreadsheet_id}|{append_range}".encode(), digest_size=4).hexdigest()
+
+class Tenant:
+    """
+    Dono de uma planilha. Cada tenant tem o próprio ledger (espelho ou
+    SQLite), journal, cache de resumos e, com quota_per_minute, o próprio
+    SheetsScheduler (filho do SHEETS global), de modo que um usuário pesado
+    não tira do cache nem da cota o que é dos outros. Tudo é criado no
+    primeiro uso.
+
+    O tenant "default" vem das variáveis de ambiente e usa os caminhos
+    originais (LEDGER_JOURNAL_PATH, LEDGER_DB); os demais ganham o número e
+    um hash da planilha no nome do arquivo (ledger_journal.<n>-<hash>.jsonl).
+    """
+
+    def __init__(self, key: str, spreadsheet_id: str, append_range: str, read_range: str = "",
+                 quota_per_minute: int = 0, name: str = ""):
+        self.key = key
+        self.name = name or key
+        self.spreadsheet_id = spreadsheet_id
+        self.append_range = append_range
+        self.read_range = read_range or append_range
+        self.quota_per_minute = quota_per_minute
+        self._sheets = SheetsScheduler(quota_per_minute, SHEETS_QUOTA_WINDOW, parent=SHEETS) if quota_per_minute else None
+        self.default = key == "default"
+        # o que ficou pendente num journal é da planilha dele: trocar a planilha
+        # de um número não pode reenviar essas linhas para a nova
+        tag = f"{key}-{_sheet_tag(spreadsheet_id, append_range)}"
+        self.journal_path = JOURNAL_PATH if self.default else _tenant_path(JOURNAL_PATH, tag)
+        self.ledger_db = LEDGER_DB if self.default else _tenant_path(LEDGER_DB, tag)
+        self.lock = threading.Lock()
+        self._ledger = None
+        self._journal = None
+        self._resumo = None
+
+    @classmethod
+    def from_env(cls):
+        rng = _default_range()
+        return cls(
+            "default",
+            os.environ.get("GOOGLE_SHEETS_SPREADSHEET_ID", ""),
+            rng,
+            os.environ.get("GOOGLE_SHEETS_READ_RANGE") or rng,
+            TENANT_QUOTA_PER_MINUTE,
+        )
+
+    @classmethod
+    def from_config(cls, number: str, cfg: dict):
+        rng = cfg.get("range") or _default_range()
+        return cls(
+            number,
+            cfg["spreadsheet_id"],
+            rng,
+            cfg.get("read_range") or rng,
+            int(cfg.get("sheets_quota_per_minute", TENANT_QUOTA_PER_MINUTE)),
+            cfg.get("name") or "",
+        )
+
+    def same_sheet(self, other: "Tenant") -> bool:
+        return (self.spreadsheet_id, self.append_range, self.read_range) == (
+            other.spreadsheet_id, other.append_range, other.read_range)
+
+    @property
+    def sheets(self) -> SheetsScheduler:
+        return self._sheets or SHEETS
+
+    def set_quota(self, quota_per_minute: int):
+        """Muda a cota sem perder ledger nem caches (reload do TENANTS_FILE)."""
+        self.quota_per_minute = quota_per_minute
+        if not quota_per_minute:
+            self._sheets = None
+        elif self._sheets is None:
+            self._sheets = SheetsScheduler(quota_per_minute, SHEETS_QUOTA_WINDOW, parent=SHEETS)
+        else:
+            with self._sheets.cond:
+                self._sheets.set_quota(quota_per_minute)
+                self._sheets.cond.notify_all()
+
+    def ledger(self):
+        with self.lock:
+            if self._ledger is None and LEDGER_BACKEND == "sqlite":
+                self._ledger = SqliteLedger(self, self.ledger_db, REPLICA_BATCH_ROWS, REPLICA_FLUSH_SECONDS)
+            elif self._ledger is None:
+                self._ledger = LedgerMirror(self, LEDGER_RESYNC_SECONDS)
+            return self._ledger
+
+    def writer(self):
+        """Para onde vão os lançamentos confirmados: journal + Sheets, ou SQLite + réplica."""
+        if LEDGER_BACKEND == "sqlite":
+            return self.ledger()
+        with self.lock:
+            if self._journal is None:
+                self._journal = LedgerJournal(self, self.journal_path, JOURNAL_FLUSH_ROWS, JOURNAL_FLUSH_SECONDS)
+            return self._journal
+
+    def resumo_cache(self):
+        with self.lock:
+            if self._resumo is None:
+                self._resumo = ResumoCache(RESUMO_CACHE_MAX)
+            return self._resumo
+
+    def stop(self, timeout: float):
+        with self.lock:
+            writer = self._ledger if LEDGER_BACKEND == "sqlite" else self._journal
+        if writer is None:
+            return
+        if writer.stop(timeout) and LEDGER_BACKEND != "sqlite":
+            writer.close()  # solta o slot: um tenant novo com o mesmo número não cai no .1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            writer = self._ledger if LEDGER_BACKEND == "sqlite" else self._journal
+            resumo = self._resumo
+        return {
+            "name": self.name,
+            "journal": writer.snapshot() if writer is not None else None,
+            "resumo_cache": resumo.snapshot() if resumo is not None else None,
+            "sheets": self._sheets.snapshot() if self._sheets is not None else None,
+        }
+
+class TenantRegistry:
+    """
+    Número do WhatsApp -> Tenant.
+
+    Sem TENANTS_FILE há um tenant só, o das variáveis de ambiente, que atende
+    ALLOWED_WA_NUMBER ou, se ele estiver vazio, qualquer número (o
+    comportamento de sempre).
+
+    Com TENANTS_FILE, um JSON
+        {"5511999990000": {"spreadsheet_id": "...", "range": "lancamentos!A1:L",
+                           "read_range": "...", "sheets_quota_per_minute": 30,
+                           "name": "Ana"}, ...}
+    só os números do arquivo são atendidos (range/read_range caem nos das
+    variáveis de ambiente; a cota em TENANT_SHEETS_QUOTA_PER_MINUTE). O
+    arquivo é relido quando muda (mtime conferido no máximo a cada
+    reload_seconds, no caminho do webhook): tenants com a mesma planilha
+    continuam com ledger e caches (só a cota é atualizada); os que mudaram
+    de planilha ou saíram do arquivo param de receber mensagens e o journal
+    deles termina de gravar num thread à parte. Um arquivo inválido mantém a
+    configuração anterior.
+    """
+
+    def __init__(self, path: str, reload_seconds: float):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.lock = threading.Lock()
+        self.default = Tenant.from_env()
+        self.tenants = {}
+        self.stamp = None
+        self.checked_at = 0.0
+        self.started = False
+        self.stats = {"reloads": 0, "errors": 0, "retired": 0}
+        if path:
+            self._maybe_reload(force=True)
+
+    def get(self, number: str):
+        """Tenant do número, ou None se o número não é atendido."""
+        if not self.path:
+            allowed = os.environ.get("ALLOWED_WA_NUMBER", "").strip()
+            return self.default if not allowed or number == allowed else None
+        self._maybe_reload()
+        return self.tenants.get(number)
+
+    def all(self) -> list:
+        if not self.path:
+            return [self.default]
+        with self.lock:
+            return list(self.tenants.values())
+
+    def __len__(self):
+        return len(self.all())
+
+    def _maybe_reload(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.reload_seconds:
+            return
+        with self.lock:
+            if not force and now - self.checked_at < self.reload_seconds:
+                return
+            self.checked_at = now
+            try:
+                st = os.stat(self.path)
+                stamp = (st.st_mtime_ns, st.st_size)
+                if stamp == self.stamp:
+                    return
+                self.stamp = stamp  # arquivo inválido: um erro por versão, não um por checagem
+                with open(self.path, encoding="utf-8") as f:
+                    cfg = json.load(f)
+                fresh = {str(num): Tenant.from_config(str(num), c) for num, c in cfg.items()}
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                self.stats["errors"] += 1
+                print("TENANTS RELOAD ERROR:", self.path, repr(e))
+                return
+            current = {}
+            for num, tenant in fresh.items():
+                old = self.tenants.get(num)
+                if old is not None and old.same_sheet(tenant):
+                    old.name = tenant.name
+                    if old.quota_per_minute != tenant.quota_per_minute:
+                        old.set_quota(tenant.quota_per_minute)
+                    tenant = old
+                current[num] = tenant
+            retired = [t for num, t in self.tenants.items() if current.get(num) is not t]
+            added = [t for num, t in current.items() if self.tenants.get(num) is not t]
+            self.tenants = current
+            self.stats["reloads"] += 1
+            self.stats["retired"] += len(retired)
+        print("TENANTS:", len(current), "números,", len(retired), "removidos/alterados")
+        for tenant in retired:
+            threading.Thread(target=tenant.stop, args=(WEBHOOK_DRAIN_TIMEOUT,), daemon=True).start()
+        if self.started:
+            for tenant in added:
+                tenant.writer().start()
+
+    def start(self):
+        """
+        Sobe o writer de cada tenant (o journal reenvia o que ficou pendente);
+        daqui em diante os tenants que entram por reload sobem ao entrar.
+        """
+        self.started = True
+        for tenant in self.all():
+            tenant.writer().start()
+
+    def stop(self, timeout: float):
+        threads = [threading.Thread(target=t.stop, args=(timeout,)) for t in self.all()]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+    def snapshot(self, detail: bool = False) -> dict:
+        """Contadores do registro; detail inclui cada tenant (número e nome: só para admin)."""
+        out = {**self.stats, "count": len(self)}
+        if detail:
+            out["tenants"] = {t.key: t.snapshot() for t in self.all()}
+        return out
+
+TENANTS = TenantRegistry(TENANTS_FILE, TENANTS_RELOAD_SECONDS)
+Gauge("finbot_tenants", "Tenants atendidos (números com planilha)", lambda: len(TENANTS))
+
+# tenant da mensagem em processamento (e dos threads de journal/réplica de cada um)
+_TENANT = contextvars.ContextVar("tenant", default=None)
+
+def current_tenant() -> Tenant:
+    return _TENANT.get() or TENANTS.default
+
+# =========================================================
+# Helpers
+# =========================================================
+def now_iso():
+    return dt.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+
+def today_iso():
+    return dt.date.today().isoformat()
+
+def parse_valor(text: str):
+    t = (text or "").lower()
+    m = re.search(r"(\d{1,9}(?:[.,]\d{2})?)", t)
+    if not m:
+        return None
+    raw = m.group(1).replace(".", "").replace(",", ".")
+    try:
+        return float(raw)
+    except:
+        return None
+
+def parse_data(text: str):
+    t = (text or "").lower().strip()
+    if t == "hoje":
+        return dt.date.today().isoformat()
+    if t == "ontem":
+        return (dt.date.today() - dt.timedelta(days=1)).isoformat()
+
+    m = re.search(r"\b(\d{1,2})[\/\-](\d{1,2})(?:[\/\-](\d{2,4}))?\b", t)
+    if not m:
+        return None
+    d = int(m.group(1))
+    mo = int(m.group(2))
+    y = m.group(3)
+    if y is None:
+        y = dt.date.today().year
+    else:
+        y = int(y)
+        if y < 100:
+            y += 2000
+    try:
+        return dt.date(y, mo, d).isoformat()
+    except:
+        return None
+
+# Lançamento numa mensagem só: "mercado 35,90 pix ontem pão e leite".
+# As listas dos menus viram dicts pela forma dobrada (minúsculas, sem acento),
+# então cada palavra custa uma consulta de dict; valor e data passam por
+# regex compiladas no import e terminam em parse_valor/parse_data.
+def _fold(s: str) -> str:
+    """"Alimentação" -> "alimentacao", "13º" -> "13o"."""
+    s = (s or "").lower()
+    if s.isascii():
+        return s
+    s = unicodedata.normalize("NFKD", s)
+    return "".join(c for c in s if not unicodedata.combining(c))
+
+# "Outros" pede texto livre no wizard; numa frase não diz nada
+TEXTO_CATEGORIAS = {_fold(c): c for c in CATEGORIAS_DESPESA if c != "Outros"}
+TEXTO_ORIGENS = {_fold(o): o for o in ORIGENS_RECEITA if o != "Outros"}
+TEXTO_PAGAMENTOS = {
+    "despesa": {_fold(p): p for p in PAGAMENTOS_DESPESA if p != "desconhecido"},
+    "receita": {"pix": "pix", "dinheiro": "dinheiro"},  # mesmas opções de MENU_RECEBIMENTO
+}
+TEXTO_TIPOS = {
+    "despesa": "despesa", "gastei": "despesa", "paguei": "despesa", "comprei": "despesa",
+    "receita": "receita", "recebi": "receita", "ganhei": "receita",
+}
+# palavras de ligação que sobram nas pontas da descrição
+TEXTO_LIGACAO = frozenset(("de", "do", "da", "no", "na", "em", "com", "via", "pelo", "pela", "e", "r$"))
+
+_TEXTO_VALOR_RE = re.compile(r"^(?:r\$)?(?:\d{1,3}(?:\.\d{3})+|\d+)(?:[.,]\d{1,2})?$")
+_TEXTO_MILHAR_RE = re.compile(r"\.(?=\d{3}(?:\D|$))")
+_TEXTO_DATA_RE = re.compile(r"^(?:hoje|ontem|\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?)$")
+_TEXTO_BORDA = ".,;:!?()\"'"
+
+def _texto_valor(token: str):
+    """(valor, explícito?) de um token de dinheiro; explícito = tem centavos ou R$."""
+    t = token[2:] if token.startswith("r$") else token
+    t = _TEXTO_MILHAR_RE.sub("", t)  # 1.234,56 -> 1234,56
+    explicit = token.startswith("r$") or "," in t or "." in t
+    t = t.replace(".", ",")  # "35.90" também é 35,90
+    if t[-2:-1] == ",":
+        t += "0"  # parse_valor só lê centavos com 2 dígitos: 35,9 -> 35,90
+    return parse_valor(t), explicit
+
+def parse_lancamento(text: str):
+    """
+    Campos de um lançamento escritos numa frase (tipo, valor, categoria,
+    pagamento, data, descricao e confianca), ou None quando a frase não tem
+    ao menos tipo e valor. O tipo vem de uma palavra ("gastei", "recebi",
+    "despesa"...) ou da categoria/origem reconhecida; o que não foi
+    reconhecido vira a descrição.
+
+    confianca: 0,3 + 0,6 x a fração dos campos obrigatórios que a frase
+    preencheu, menos 0,1 se havia mais de um número candidato a valor.
+    """
+    words = (text or "").split()
+    folded = [_fold(w).strip(_TEXTO_BORDA) for w in words]
+    used = [False] * len(words)
+    tipo = categoria = origem = data = None
+    valores = []
+    for i, w in enumerate(folded):
+        if w in TEXTO_TIPOS and tipo is None:
+            tipo, used[i] = TEXTO_TIPOS[w], True
+        elif w in TEXTO_CATEGORIAS and categoria is None:
+            categoria, used[i] = (i, TEXTO_CATEGORIAS[w]), True
+        elif w in TEXTO_ORIGENS and origem is None:
+            origem, used[i] = (i, TEXTO_ORIGENS[w]), True
+        elif _TEXTO_DATA_RE.match(w) and data is None:
+            data = parse_data(w)
+            used[i] = data is not None
+        elif _TEXTO_VALOR_RE.match(w):
+            valores.append(i)
+
+    tipo = tipo or ("despesa" if categoria else "receita" if origem else None)
+    # "mercado" numa receita (ou "reembolso" numa despesa) volta para a descrição
+    cat = categoria if tipo == "despesa" else origem if tipo == "receita" else None
+    for other in (categoria, origem):
+        if other is not None and other is not cat:
+            used[other[0]] = False
+    if tipo is None or not valores:
+        return None
+
+    parsed = [(i, *_texto_valor(folded[i])) for i in valores]
+    explicit = [p for p in parsed if p[2] and p[1] is not None]
+    i, valor, _ = (explicit or parsed)[0]
+    if valor is None:
+        return None
+    used[i] = True
+
+    pagamento = None
+    for k, w in enumerate(folded):
+        if not used[k] and w in TEXTO_PAGAMENTOS[tipo]:
+            pagamento, used[k] = TEXTO_PAGAMENTOS[tipo][w], True
+            break
+
+    rest = [w for k, w in enumerate(words) if not used[k]]
+    while rest and _fold(rest[0]).strip(_TEXTO_BORDA) in TEXTO_LIGACAO:
+        rest.pop(0)
+    while rest and _fold(rest[-1]).strip(_TEXTO_BORDA) in TEXTO_LIGACAO:
+        rest.pop()
+    descricao = " ".join(rest).strip(_TEXTO_BORDA + " ") or None
+
+    fields = {
+        "tipo": tipo, "valor": valor, "categoria": cat[1] if cat else None,
+        "pagamento": pagamento, "data": data, "descricao": descricao,
+    }
+    required = required_fields(fields)
+    filled = sum(1 for f in required if fields.get(f) is not None)
+    penalty = 0.1 if len(valores) > 1 else 0.0
+    fields["confianca"] = round(0.3 + 0.6 * filled / len(required) - penalty, 2)
+    return fields
+
+def normalize_sign(tx: dict):
+    if tx.get("valor") is None:
+        return
+    v = float(tx["valor"])
+    if tx.get("tipo") == "despesa":
+        tx["valor"] = -abs(v)
+    elif tx.get("tipo") == "receita":
+        tx["valor"] = abs(v)
+
+def ensure_receita_descricao(tx: dict):
+    # Receita não pergunta descrição; preenche automático para manter coluna consistente
+    if tx.get("tipo") != "receita":
+        return
+    if tx.get("descricao") and str(tx["descricao"]).strip():
+        return
+    origem = (tx.get("categoria") or "").strip()
+    original = (tx.get("mensagem_original") or "").strip()
+    if origem:
+        tx["descricao"] = f"Receita - {origem}"
+    elif original:
+        tx["descricao"] = original[:180]
+    else:
+        tx["descricao"] = "Receita"
+
+def tx_to_row(tx: dict):
+    """
+    Grava na ordem do SEU header (normalizado):
+    ID, TIMESTAMP, TIPO, VALOR, MOEDA, CATEGORIA, DESCRIÇÃO, pagamento..., Data, confianca..., confirmado..., mensagem_original...
+    """
+    return [
+        tx.get("id", ""),
+        tx.get("timestamp", ""),
+        tx.get("tipo", ""),
+        tx.get("valor", ""),
+        tx.get("moeda", "BRL"),
+        tx.get("categoria", ""),
         tx.get("descricao", ""),
         tx.get("pagamento", ""),
         tx.get("data", ""),
@@ -299,53 +2706,110 @@ def next_missing(tx: dict):
 # =========================================================
 # Wizard / telas
 # =========================================================
-def ask_inicio(to: str):
-    send_whatsapp_buttons(
-        to,
-        TXT_INICIAL,
-        [
-            {"id": "inicio_receita", "title": "Receita"},
-            {"id": "inicio_despesa", "title": "Despesa"},
-            {"id": "inicio_resumo", "title": "Resumo"},
-        ],
-    )
+# Telas fixas são montadas uma vez no import como PayloadTemplate; por envio
+# só o destinatário muda. ask_confirm (depende do lançamento) continua
+# montando o payload na hora.
+MENU_INICIO = PayloadTemplate(_buttons_payload(
+    TXT_INICIAL,
+    [
+        {"id": "inicio_receita", "title": "Receita"},
+        {"id": "inicio_despesa", "title": "Despesa"},
+        {"id": "inicio_resumo", "title": "Resumo"},
+    ],
+))
+MENU_ORIGEM = PayloadTemplate(_list_payload(
+    "Qual a ORIGEM dessa receita?", "Escolher",
+    [{"id": f"origem_{o.lower().replace('º','o').replace(' ', '_')}", "title": o} for o in ORIGENS_RECEITA],
+    section_title="Origem",
+))
+MENU_CATEGORIA = PayloadTemplate(_list_payload(
+    "Qual a CATEGORIA dessa despesa?", "Escolher",
+    [{"id": f"cat_{c.lower().replace(' ', '_')}", "title": c} for c in CATEGORIAS_DESPESA],
+    section_title="Categoria",
+))
+MENU_PAGAMENTO = PayloadTemplate(_list_payload(
+    "Como foi o pagamento?", "Escolher",
+    [{"id": f"pay_{p.replace('é','e').replace('í','i')}", "title": p} for p in PAGAMENTOS_DESPESA],
+    section_title="Pagamento",
+))
+MENU_RECEBIMENTO = PayloadTemplate(_buttons_payload(
+    "Como foi o recebimento?",
+    [
+        {"id": "rec_dinheiro", "title": "Dinheiro"},
+        {"id": "rec_pix", "title": "PIX"},
+    ],
+))
+MENU_DATA = PayloadTemplate(_buttons_payload(
+    "Qual a data de competência?",
+    [
+        {"id": "data_hoje", "title": "Hoje"},
+        {"id": "data_ontem", "title": "Ontem"},
+        {"id": "data_outra", "title": "Outra"},
+    ],
+))
+# 3 botões (limite do WhatsApp) + lista “Outros” com mais opções
+MENU_RESUMO = PayloadTemplate(_buttons_payload(
+    "Qual resumo você quer ver?",
+    [
+        {"id": "res_diario", "title": "Diário"},
+        {"id": "res_semanal", "title": "Semanal"},
+        {"id": "res_mensal", "title": "Mensal"},
+    ],
+))
+MENU_RESUMO_OUTROS = PayloadTemplate(_list_payload(
+    "Ou escolha em Outros:", "Abrir",
+    [
+        {"id": "res_3m", "title": "3 meses", "description": "Últimos 3 meses"},
+        {"id": "res_6m", "title": "6 meses", "description": "Últimos 6 meses"},
+        {"id": "res_12m", "title": "12 meses", "description": "Últimos 12 meses"},
+    ],
+    section_title="Outros",
+))
+
+def _text_template(text: str) -> PayloadTemplate:
+    return PayloadTemplate(_text_payload(text))
+
+PROMPTS = {
+    "valor": _text_template("Qual o VALOR? Ex: 35,90"),
+    "descricao": _text_template("Qual a DESCRIÇÃO (curta)? Ex: pão e leite"),
+    "data": _text_template("Digite a data (dd/mm) ou 'hoje' / 'ontem'."),
+    "origem": _text_template("Digite a ORIGEM (texto). Ex: Salário, PLR, etc."),
+    "categoria": _text_template("Digite a CATEGORIA (texto). Ex: Pet, Viagem, etc."),
+}
+PROMPT_GENERICO = _text_template("Preciso de uma informação (texto).")
+
+AVISO_SALVO = _text_template(MSG_SALVO)
+AVISO_EXPIRADA = _text_template(MSG_SESSAO_EXPIRADA)
+AVISO_CANCELADO = _text_template("Cancelado. Mande qualquer mensagem para começar de novo.")
+AVISO_CONFIRMAR = _text_template("Selecione SIM para gravar ou CANCELAR para descartar.")
+AVISO_LISTA = _text_template("Escolha uma opção na lista.")
+AVISO_PAGAMENTO = _text_template("Escolha uma opção na lista de pagamento.")
+AVISO_RECEBIMENTO = _text_template("Use os botões: Dinheiro ou PIX.")
+AVISO_DATA = _text_template("Use os botões: Hoje / Ontem / Outra.")
+AVISO_VALOR_INVALIDO = _text_template("Valor inválido. Ex: 35,90")
+AVISO_DATA_INVALIDA = _text_template("Data inválida. Use hoje/ontem ou dd/mm (ex: 29/12).")
+
+async def ask_inicio(to: str):
+    await MENU_INICIO.send(to)
 
-def ask_categoria_ou_origem(to: str, tx: dict):
+async def ask_categoria_ou_origem(to: str, tx: dict):
     if tx.get("tipo") == "receita":
-        rows = [{"id": f"origem_{o.lower().replace('º','o').replace(' ', '_')}", "title": o} for o in ORIGENS_RECEITA]
-        send_whatsapp_list(to, "Qual a ORIGEM dessa receita?", "Escolher", rows, section_title="Origem")
+        await MENU_ORIGEM.send(to)
     else:
-        rows = [{"id": f"cat_{c.lower().replace(' ', '_')}", "title": c} for c in CATEGORIAS_DESPESA]
-        send_whatsapp_list(to, "Qual a CATEGORIA dessa despesa?", "Escolher", rows, section_title="Categoria")
+        await MENU_CATEGORIA.send(to)
 
-def ask_pagamento_despesa(to: str):
-    rows = [{"id": f"pay_{p.replace('é','e').replace('í','i')}", "title": p} for p in PAGAMENTOS_DESPESA]
-    send_whatsapp_list(to, "Como foi o pagamento?", "Escolher", rows, section_title="Pagamento")
+async def ask_pagamento_despesa(to: str):
+    await MENU_PAGAMENTO.send(to)
 
-def ask_recebimento_receita(to: str):
-    send_whatsapp_buttons(
-        to,
-        "Como foi o recebimento?",
-        [
-            {"id": "rec_dinheiro", "title": "Dinheiro"},
-            {"id": "rec_pix", "title": "PIX"},
-        ],
-    )
+async def ask_recebimento_receita(to: str):
+    await MENU_RECEBIMENTO.send(to)
 
-def ask_data(to: str):
-    send_whatsapp_buttons(
-        to,
-        "Qual a data de competência?",
-        [
-            {"id": "data_hoje", "title": "Hoje"},
-            {"id": "data_ontem", "title": "Ontem"},
-            {"id": "data_outra", "title": "Outra"},
-        ],
-    )
+async def ask_data(to: str):
+    await MENU_DATA.send(to)
 
-def ask_confirm(to: str, tx: dict):
+async def ask_confirm(to: str, tx: dict):
     msg = format_confirm(tx) + "\n\nSelecione:"
-    send_whatsapp_buttons(
+    await send_whatsapp_buttons(
         to,
         msg,
         [
@@ -354,65 +2818,39 @@ def ask_confirm(to: str, tx: dict):
         ],
     )
 
-def ask_resumo_periodo(to: str):
-    # 3 botões (limite do WhatsApp)
-    send_whatsapp_buttons(
-        to,
-        "Qual resumo você quer ver?",
-        [
-            {"id": "res_diario", "title": "Diário"},
-            {"id": "res_semanal", "title": "Semanal"},
-            {"id": "res_mensal", "title": "Mensal"},
-        ],
-    )
+async def ask_resumo_periodo(to: str):
+    # As duas mensagens são independentes: saem em paralelo
+    await send_concurrently(MENU_RESUMO.send(to), MENU_RESUMO_OUTROS.send(to))
 
-    # Lista “Outros” com mais opções
-    rows = [
-        {"id": "res_3m", "title": "3 meses", "description": "Últimos 3 meses"},
-        {"id": "res_6m", "title": "6 meses", "description": "Últimos 6 meses"},
-        {"id": "res_12m", "title": "12 meses", "description": "Últimos 12 meses"},
-    ]
-    send_whatsapp_list(to, "Ou escolha em Outros:", "Abrir", rows, section_title="Outros")
-
-def ask_text_field(to: str, field: str, tx: dict):
-    if field == "valor":
-        send_whatsapp_text(to, "Qual o VALOR? Ex: 35,90")
-    elif field == "descricao":
-        send_whatsapp_text(to, "Qual a DESCRIÇÃO (curta)? Ex: pão e leite")
-    elif field == "data":
-        send_whatsapp_text(to, "Digite a data (dd/mm) ou 'hoje' / 'ontem'.")
-    elif field == "categoria":
-        if tx.get("tipo") == "receita":
-            send_whatsapp_text(to, "Digite a ORIGEM (texto). Ex: Salário, PLR, etc.")
-        else:
-            send_whatsapp_text(to, "Digite a CATEGORIA (texto). Ex: Pet, Viagem, etc.")
-    else:
-        send_whatsapp_text(to, "Preciso de uma informação (texto).")
+async def ask_text_field(to: str, field: str, tx: dict):
+    if field == "categoria" and tx.get("tipo") == "receita":
+        field = "origem"
+    await PROMPTS.get(field, PROMPT_GENERICO).send(to)
 
-def continue_wizard(to: str, tx: dict):
+async def continue_wizard(to: str, tx: dict):
     nxt = next_missing(tx)
     if nxt is None:
         ensure_receita_descricao(tx)
         normalize_sign(tx)
-        ask_confirm(to, tx)
+        await ask_confirm(to, tx)
         return "confirm"
 
     if nxt == "categoria":
-        ask_categoria_ou_origem(to, tx)
+        await ask_categoria_ou_origem(to, tx)
         return "categoria"
 
     if nxt == "pagamento":
         if tx.get("tipo") == "receita":
-            ask_recebimento_receita(to)
+            await ask_recebimento_receita(to)
             return "recebimento"
-        ask_pagamento_despesa(to)
+        await ask_pagamento_despesa(to)
         return "pagamento"
 
     if nxt == "data":
-        ask_data(to)
+        await ask_data(to)
         return "data"
 
-    ask_text_field(to, nxt, tx)
+    await ask_text_field(to, nxt, tx)
     return nxt
 
 # =========================================================
@@ -478,55 +2916,256 @@ def get_period_range(kind: str):
     if kind == "diario":
         start = today
 
-    elif kind == "semanal":
-        start = today - dt.timedelta(days=6)
+    elif kind == "semanal":
+        start = today - dt.timedelta(days=6)
+
+    elif kind == "mensal":
+        start = today.replace(day=1)
+
+    elif kind == "3m":
+        start = today - dt.timedelta(days=90)
+
+    elif kind == "6m":
+        start = today - dt.timedelta(days=182)
+
+    elif kind == "12m":
+        start = today - dt.timedelta(days=364)
+
+    else:
+        start = today
+
+    return start, today
+
+class PeriodIndex:
+    """
+    Agregados por dia com somas acumuladas, ordenados por data.
+
+    days[i] é o ordinal de um dia com lançamentos; rec[i]/des[i] somam receitas
+    e despesas de todos os dias até days[i] (inclusive) e by_cat[(tipo, cat)]
+    faz o mesmo por categoria (com a contagem acumulada em cat_count, para
+    categorias que só têm lançamentos de valor zero também aparecerem).
+    Um período qualquer custa duas buscas binárias e uma subtração por série.
+    """
+
+    def __init__(self):
+        self.days = []
+        self.rec = []
+        self.des = []
+        self.by_cat = {}
+        self.cat_count = {}
+
+    @classmethod
+    def from_store(cls, store: "LedgerStore"):
+        # agrega por dia usando os códigos do store; nomes só no fim
+        per_day = defaultdict(lambda: defaultdict(lambda: [0.0, 0]))
+        for day, tipo, cat, val in zip(store.dates, store.tipos, store.cats, store.values):
+            if day and tipo:
+                agg = per_day[day][(tipo, cat)]
+                agg[0] += abs(val)
+                agg[1] += 1
+
+        idx = cls()
+        idx.days = sorted(per_day)
+        n = len(idx.days)
+        keys = {key for d in per_day.values() for key in d}
+        sums = {key: [0.0] * n for key in keys}
+        counts = {key: [0] * n for key in keys}
+        acc_rec = acc_des = 0.0
+        acc_sum = dict.fromkeys(keys, 0.0)
+        acc_cnt = dict.fromkeys(keys, 0)
+        for i, day in enumerate(idx.days):
+            for key, (val, cnt) in per_day[day].items():
+                acc_sum[key] += val
+                acc_cnt[key] += cnt
+                if key[0] == TIPO_CODES["receita"]:
+                    acc_rec += val
+                else:
+                    acc_des += val
+            idx.rec.append(acc_rec)
+            idx.des.append(acc_des)
+            for key in keys:
+                sums[key][i] = acc_sum[key]
+                counts[key][i] = acc_cnt[key]
+        names = {key: (TIPO_NAMES[key[0]], store.cat_names[key[1]]) for key in keys}
+        idx.by_cat = {names[key]: arr for key, arr in sums.items()}
+        idx.cat_count = {names[key]: arr for key, arr in counts.items()}
+        return idx
+
+    def add_store_row(self, store: "LedgerStore", i: int):
+        day, tipo = store.dates[i], store.tipos[i]
+        if day and tipo:
+            self.add(day, TIPO_NAMES[tipo], store.categoria(i), abs(store.values[i]))
+
+    def add(self, day: int, tipo: str, cat: str, val: float):
+        """Inclui um lançamento. No caso comum (data de hoje/recente) só toca o fim das séries."""
+        days = self.days
+        p = bisect_left(days, day)
+        if p == len(days) or days[p] != day:
+            days.insert(p, day)
+            for arr in (self.rec, self.des, *self.by_cat.values(), *self.cat_count.values()):
+                arr.insert(p, arr[p - 1] if p else 0)
+        key = (tipo, cat)
+        if key not in self.by_cat:
+            self.by_cat[key] = [0.0] * len(days)
+            self.cat_count[key] = [0] * len(days)
+        total = self.rec if tipo == "receita" else self.des
+        sums, counts = self.by_cat[key], self.cat_count[key]
+        for i in range(p, len(days)):
+            total[i] += val
+            sums[i] += val
+            counts[i] += 1
+
+    def totals(self, start: dt.date, end: dt.date):
+        """(total_rec, total_des, rec_by_cat, des_by_cat) para start <= data <= end."""
+        lo = bisect_left(self.days, start.toordinal())
+        hi = bisect_right(self.days, end.toordinal())
+
+        def span(arr):
+            if lo >= hi:
+                return 0
+            return arr[hi - 1] - (arr[lo - 1] if lo else 0)
+
+        rec_by_cat, des_by_cat = {}, {}
+        for key, arr in self.by_cat.items():
+            if span(self.cat_count[key]):
+                tipo, cat = key
+                (rec_by_cat if tipo == "receita" else des_by_cat)[cat] = span(arr)
+        return float(span(self.rec)), float(span(self.des)), rec_by_cat, des_by_cat
+
+def aggregate_windows(store: "LedgerStore", windows: list):
+    """
+    Totais de vários períodos (start, end) numa passada só sobre as colunas do
+    store, vistas como arrays numpy sem cópia.
+
+    Os limites de todos os períodos viram uma lista ordenada de cortes; cada
+    lançamento cai num segmento entre cortes (searchsorted) e um bincount
+    soma valor e contagem por (segmento, tipo, categoria). Cada período é a
+    soma de uma faixa contígua de segmentos, então o custo por período não
+    depende do número de linhas.
+    """
+    np = _numpy()
+    n_cat = max(len(store.cat_names), 1)
+    cuts = np.unique(np.array(
+        [b for start, end in windows for b in (start.toordinal(), end.toordinal() + 1)], dtype=np.int64
+    ))
+    n_seg = len(cuts) + 1
+
+    # As views seguram o buffer dos arrays do store (que não podem crescer
+    # enquanto isso); ficam só dentro desta função, sob o lock do espelho.
+    days = np.frombuffer(store.dates, dtype=np.intc)
+    tipos = np.frombuffer(store.tipos, dtype=np.uint8)
+    ok = (days > 0) & (tipos > 0)
+    seg = np.searchsorted(cuts, days[ok], side="right")
+    key = (seg * 3 + tipos[ok]) * n_cat + np.frombuffer(store.cats, dtype=np.ushort)[ok]
+    weights = np.abs(np.frombuffer(store.values, dtype=np.float64)[ok])
+    del days, tipos, ok, seg
 
-    elif kind == "mensal":
-        start = today.replace(day=1)
+    size = n_seg * 3 * n_cat
+    sums = np.bincount(key, weights=weights, minlength=size).reshape(n_seg, 3, n_cat)
+    counts = np.bincount(key, minlength=size).reshape(n_seg, 3, n_cat)
 
-    elif kind == "3m":
-        start = today - dt.timedelta(days=90)
+    rec_code, des_code = TIPO_CODES["receita"], TIPO_CODES["despesa"]
+    names = store.cat_names
+    out = []
+    for start, end in windows:
+        a = int(np.searchsorted(cuts, start.toordinal(), side="right"))
+        b = int(np.searchsorted(cuts, end.toordinal() + 1, side="right"))
+        s = sums[a:b].sum(axis=0)
+        c = counts[a:b].sum(axis=0)
+        out.append((
+            float(s[rec_code].sum()),
+            float(s[des_code].sum()),
+            {names[j]: float(s[rec_code, j]) for j in np.flatnonzero(c[rec_code])},
+            {names[j]: float(s[des_code, j]) for j in np.flatnonzero(c[des_code])},
+        ))
+    return out
 
-    elif kind == "6m":
-        start = today - dt.timedelta(days=182)
+RESUMO_CACHE_MAX = int(os.environ.get("RESUMO_CACHE_MAX", "256"))
 
-    elif kind == "12m":
-        start = today - dt.timedelta(days=364)
+class ResumoCache:
+    """
+    Textos de resumo já renderizados, por (kind, hoje, versão do ledger) — ou
+    (kind, start, end, versão) para intervalos livres. Qualquer append ou
+    edição externa detectada muda a versão, então entradas velhas nunca mais
+    casam e só saem pelo LRU. Um por tenant (Tenant.resumo_cache).
+    """
 
-    else:
-        start = today
+    def __init__(self, max_entries: int):
+        self.items = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
 
-    return start, today
+    def get(self, key):
+        with self.lock:
+            text = self.items.get(key)
+            if text is None:
+                self.stats["misses"] += 1
+                return None
+            self.items.move_to_end(key)
+            self.stats["hits"] += 1
+            return text
 
-def build_resumo_text(kind: str):
-    rows = read_all_rows()
-    if not rows:
-        return "Não encontrei lançamentos na planilha ainda."
+    def put(self, key, text: str):
+        with self.lock:
+            self.items[key] = text
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_entries:
+                self.items.popitem(last=False)
+                self.stats["evictions"] += 1
 
-    start, end = get_period_range(kind)
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {**self.stats, "size": len(self.items)}
 
-    total_rec = 0.0
-    total_des = 0.0
-    rec_by_cat = defaultdict(float)
-    des_by_cat = defaultdict(float)
+def build_resumo_text(kind: str, start: dt.date = None, end: dt.date = None):
+    """
+    Resumo de um período pré-definido (kind) ou de um intervalo start..end qualquer.
+    """
+    with M_RESUMO.time():
+        if start is None or end is None:
+            return _resumo_texts([(kind, *get_period_range(kind), True)])[kind]
+        return _resumo_texts([(kind, start, end, False)])[kind]
 
-    for r in rows:
-        d = _parse_date_any(r.get("data"))
-        if not d:
-            continue
-        if d < start or d > end:
-            continue
+def build_resumo_texts(kinds: list) -> dict:
+    """Vários resumos pré-definidos de uma vez (ex.: digest): {kind: texto}."""
+    with M_RESUMO.time():
+        return _resumo_texts([(kind, *get_period_range(kind), True) for kind in kinds])
+
+def _resumo_texts(periods: list) -> dict:
+    """
+    periods: [(kind, start, end, pré-definido)]. Os que não estão no cache
+    de resumos do tenant são calculados juntos numa chamada a window_totals.
+    """
+    tenant = current_tenant()
+    cache = tenant.resumo_cache()
+    # A versão é lida antes dos totais: se um append entrar no meio, o texto
+    # guardado fica mais novo que a chave, nunca mais velho.
+    with span("resumo.version"):
+        version = tenant.ledger().synced_version()
+    today = dt.date.today()
+    texts, missing = {}, []
+    for kind, start, end, preset in periods:
+        key = (kind, today, version) if preset else (kind, start, end, version)
+        text = cache.get(key)
+        if text is None:
+            missing.append((kind, start, end, key))
+        else:
+            texts[kind] = text
 
-        tipo = (r.get("tipo") or "").strip().lower()
-        cat = (r.get("categoria") or "Sem categoria").strip() or "Sem categoria"
-        val = _to_float(r.get("valor"))
+    if missing:
+        with span("resumo.window_totals", windows=len(missing), cached=len(texts)):
+            totals = tenant.ledger().window_totals([(start, end) for _, start, end, _ in missing])
+        with span("resumo.format", windows=len(missing)):
+            for i, (kind, start, end, key) in enumerate(missing):
+                texts[kind] = format_resumo_text(kind, start, end, totals[i] if totals else None)
+                cache.put(key, texts[kind])
+    return texts
 
-        if tipo == "receita":
-            total_rec += abs(val)
-            rec_by_cat[cat] += abs(val)
-        elif tipo == "despesa":
-            total_des += abs(val)
-            des_by_cat[cat] += abs(val)
+def format_resumo_text(kind: str, start: dt.date, end: dt.date, totals):
+    if totals is None:
+        return "Não encontrei lançamentos na planilha ainda."
+    total_rec, total_des, rec_by_cat, des_by_cat = totals
 
     # ordenar top categorias
     rec_top = sorted(rec_by_cat.items(), key=lambda x: x[1], reverse=True)[:8]
@@ -573,6 +3212,352 @@ def build_resumo_text(kind: str):
 
     return "\n".join(lines)
 
+# =========================================================
+# Importação de extratos (CSV/OFX)
+# =========================================================
+# O arquivo é lido em stream (linha a linha; no OFX, bloco <STMTTRN> a
+# bloco) e só o lote atual fica em memória: IMPORT_BATCH_ROWS linhas por
+# values.append, pelo agendador do tenant (mesma cota e backoff do resto).
+# Com LEDGER_BACKEND=sqlite o lote vai para o banco e a réplica o leva em
+# values.append de até LEDGER_REPLICA_MAX_BATCH_ROWS linhas. No espelho não
+# há add_local: as linhas chegam pelo rabo da planilha, como as de outro worker.
+#
+# Duplicatas: chave data+valor+descrição (_import_key). As chaves do ledger
+# são contadas antes de ler o arquivo; uma linha cuja chave ainda tem saldo
+# é pulada e consome uma unidade. Reimportar o mesmo extrato não grava nada,
+# e duas compras iguais no mesmo dia continuam duas.
+IMPORT_BATCH_ROWS = int(os.environ.get("IMPORT_BATCH_ROWS", "5000"))
+IMPORT_DIR = os.environ.get("IMPORT_DIR", "").strip() or None  # uploads do /admin/import (None = tmp do sistema)
+IMPORT_JOBS_MAX = 20
+IMPORT_ERRORS_MAX = 20  # linhas inválidas guardadas no progresso (as primeiras)
+
+# header do CSV (_norm_header) -> campo
+IMPORT_CSV_COLUNAS = {
+    **dict.fromkeys(("data", "date", "dt", "data_lancamento", "data_movimento", "data_da_transacao"), "data"),
+    **dict.fromkeys(("valor", "value", "amount", "quantia", "montante"), "valor"),
+    **dict.fromkeys(("credito", "entrada", "entradas"), "credito"),
+    **dict.fromkeys(("debito", "saida", "saidas"), "debito"),
+    **dict.fromkeys((
+        "descricao", "description", "historico", "lancamento", "memo", "title", "titulo",
+        "detalhes", "estabelecimento",
+    ), "descricao"),
+    **dict.fromkeys(("categoria", "category"), "categoria"),
+    **dict.fromkeys(("tipo", "type"), "tipo"),
+    **dict.fromkeys(("pagamento", "forma_de_pagamento"), "pagamento"),
+}
+IMPORT_TIPOS = {
+    **TEXTO_TIPOS,
+    "credito": "receita", "c": "receita", "entrada": "receita",
+    "debito": "despesa", "d": "despesa", "saida": "despesa",
+}
+
+_IMPORT_VALOR_RE = re.compile(r"^([+-]?)(\d[\d.,]*)$")
+_OFX_TAG_RE = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)")
+
+def _import_valor(s: str):
+    """"-1.234,56", "1234.56", "(35,90)", "R$ 35,90 D" -> float com sinal (None se não for valor)."""
+    t = (s or "").strip().upper().replace("R$", "").replace(" ", "")
+    neg = False
+    if t.startswith("(") and t.endswith(")"):
+        t, neg = t[1:-1], True
+    if t[-1:] in ("C", "D"):
+        t, neg = t[:-1], neg or t.endswith("D")
+    m = _IMPORT_VALOR_RE.match(t)
+    if not m:
+        return None
+    sign, num = m.groups()
+    # separador seguido de 1-2 dígitos no fim é o decimal; os demais são de milhar
+    cut = max(num.rfind("."), num.rfind(","))
+    if cut >= 0 and len(num) - cut - 1 in (1, 2):
+        num = num[:cut].replace(".", "").replace(",", "") + "." + num[cut + 1:]
+    else:
+        num = num.replace(".", "").replace(",", "")
+    v = float(num)
+    return -v if neg or sign == "-" else v
+
+def _import_data(s: str):
+    """Data do extrato em ISO: "20240115120000[-3:BRT]" (OFX), ISO ou dd/mm/aaaa."""
+    s = (s or "").strip()
+    if len(s) >= 8 and s[:8].isdigit():
+        try:
+            return dt.date(int(s[:4]), int(s[4:6]), int(s[6:8])).isoformat()
+        except ValueError:
+            return None
+    d = _parse_date_any(s)
+    return d.isoformat() if d else None
+
+def _import_key(data, valor, descricao) -> int:
+    """Chave de duplicata: dia + centavos + descrição dobrada (64 bits do blake2b)."""
+    d = _parse_date_any(data)
+    desc = " ".join(_fold(str(descricao or "")).split())
+    raw = f"{d.toordinal() if d else 0}|{round((valor or 0.0) * 100)}|{desc}"
+    return int.from_bytes(hashlib.blake2b(raw.encode(), digest_size=8).digest(), "big")
+
+def _import_guess(words: list, options: dict):
+    for w in words:
+        if w in options:
+            return options[w]
+    return None
+
+def _import_tx(f: dict, moeda: str = "BRL"):
+    """
+    Campos lidos de uma linha do extrato -> lançamento (dict do tx_to_row), ou
+    None sem data ou valor. O tipo vem da coluna tipo ou do sinal; categoria
+    e pagamento vêm das colunas ou de uma palavra da descrição (mesmos dicts
+    do parse_lancamento). Data, valor e descrição vêm do banco, então a
+    confianca parte de 0,6 e ganha 0,15 por campo reconhecido (categoria,
+    pagamento).
+    """
+    data = _import_data(f.get("data"))
+    if f.get("valor"):
+        valor = _import_valor(f["valor"])
+    elif f.get("credito"):
+        valor = _import_valor(f["credito"])
+        valor = abs(valor) if valor is not None else None
+    elif f.get("debito"):
+        valor = _import_valor(f["debito"])
+        valor = -abs(valor) if valor is not None else None
+    else:
+        valor = None
+    if data is None or not valor:
+        return None
+    tipo = IMPORT_TIPOS.get(_fold(f.get("tipo") or "").strip()) or ("despesa" if valor < 0 else "receita")
+    descricao = " ".join((f.get("descricao") or "").split())
+    words = [_fold(w).strip(_TEXTO_BORDA) for w in descricao.split()]
+    options = TEXTO_CATEGORIAS if tipo == "despesa" else TEXTO_ORIGENS
+    categoria = (
+        options.get(_fold(f.get("categoria") or "").strip()) or (f.get("categoria") or "").strip()
+        or _import_guess(words, options)
+    )
+    pagamento = (
+        TEXTO_PAGAMENTOS[tipo].get(_fold(f.get("pagamento") or "").strip())
+        or _import_guess(words, TEXTO_PAGAMENTOS[tipo])
+    )
+    tx = {
+        "id": str(uuid.uuid4()),
+        "timestamp": now_iso(),
+        "tipo": tipo,
+        "valor": valor,
+        "moeda": moeda,
+        "categoria": categoria or "Outros",
+        "descricao": descricao,
+        "pagamento": pagamento or "desconhecido",
+        "data": data,
+        "confianca": round(0.6 + 0.15 * ((categoria is not None) + (pagamento is not None)), 2),
+        "confirmado": "sim",
+    }
+    ensure_receita_descricao(tx)
+    normalize_sign(tx)
+    return tx
+
+def _import_lines(fh, job: "ImportJob" = None):
+    """Linhas de texto de um arquivo binário: UTF-8 (com ou sem BOM) ou, linha a linha, cp1252."""
+    for raw in fh:
+        if job is not None:
+            job.bytes_read += len(raw)
+        try:
+            line = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            line = raw.decode("cp1252", errors="replace")
+        yield line.lstrip("\ufeff")
+
+def iter_csv_statement(lines):
+    """
+    (nº da linha, lançamento ou None) de um extrato CSV. O separador (; , ou
+    tab) e as colunas saem do header (IMPORT_CSV_COLUNAS); valor numa coluna
+    só, com sinal, ou em crédito/débito.
+    """
+    lines = iter(lines)
+    header = next(lines, "")
+    delim = max(";,\t", key=header.count)
+    cols = [IMPORT_CSV_COLUNAS.get(_norm_header(h)) for h in next(csv.reader([header], delimiter=delim), [])]
+    if "data" not in cols or not {"valor", "credito", "debito"} & set(cols):
+        raise ValueError(f"CSV sem colunas de data e valor: {header.strip()[:200]!r}")
+    reader = csv.reader(lines, delimiter=delim)
+    for values in reader:
+        if not any(v.strip() for v in values):
+            continue
+        f = {}
+        for col, v in zip(cols, values):
+            if col and not f.get(col):
+                f[col] = v.strip()
+        yield reader.line_num + 1, _import_tx(f)
+
+def iter_ofx_statement(lines):
+    """
+    (nº do lançamento, lançamento ou None) dos <STMTTRN> de um OFX, SGML
+    (1.x, tags sem fechamento) ou XML (2.x). Descrição do MEMO (ou NAME),
+    moeda do CURDEF.
+    """
+    moeda = "BRL"
+    trn = None
+    n = 0
+    for line in lines:
+        for close, tag, value in _OFX_TAG_RE.findall(line):
+            tag = tag.upper()
+            if tag == "STMTTRN" or (close and tag == "BANKTRANLIST"):
+                if trn is not None:
+                    n += 1
+                    yield n, _ofx_tx(trn, moeda)
+                trn = {} if tag == "STMTTRN" and not close else None
+            elif tag == "CURDEF" and not close:
+                moeda = value.strip() or moeda
+            elif trn is not None and not close:
+                trn.setdefault(tag, value.strip())
+    if trn is not None:  # arquivo cortado no meio de um <STMTTRN>
+        yield n + 1, _ofx_tx(trn, moeda)
+
+def _ofx_tx(trn: dict, moeda: str):
+    return _import_tx({
+        "data": trn.get("DTPOSTED"), "valor": trn.get("TRNAMT"),
+        "descricao": trn.get("MEMO") or trn.get("NAME"),
+    }, moeda)
+
+def import_format(head: bytes, name: str = "") -> str:
+    """"ofx" ou "csv", pela extensão ou pelo começo do arquivo."""
+    if name.lower().endswith(".ofx") or b"OFXHEADER" in head.upper() or b"<OFX" in head.upper():
+        return "ofx"
+    return "csv"
+
+class ImportJob:
+    """Progresso de um import (o que GET /admin/import/{id} e a CLI mostram)."""
+
+    def __init__(self, source: str, fmt: str, tenant: str, total_bytes: int = 0):
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.format = fmt
+        self.tenant = tenant
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.state = "queued"
+        self.error = None
+        self.invalid_lines = []   # as primeiras IMPORT_ERRORS_MAX
+        self.stats = {"lines": 0, "imported": 0, "duplicates": 0, "invalid": 0, "batches": 0, "ledger_rows": 0}
+        self.started = self.finished = None
+
+    def snapshot(self) -> dict:
+        end = self.finished or time.time()
+        return {
+            "id": self.id, "source": self.source, "format": self.format, "tenant": self.tenant,
+            "state": self.state, "error": self.error,
+            "progress": round(self.bytes_read / self.total_bytes, 3) if self.total_bytes else None,
+            **self.stats,
+            "invalid_lines": list(self.invalid_lines),
+            "seconds": round(end - self.started, 3) if self.started else 0.0,
+        }
+
+def _ledger_keys(tenant: "Tenant") -> dict:
+    """Chave de duplicata -> quantas vezes aparece no ledger do tenant (lido em janelas)."""
+    keys = defaultdict(int)
+    if LEDGER_BACKEND == "sqlite":
+        led = tenant.ledger()
+        led.ensure_seeded()  # banco novo: o que já está na planilha também conta como duplicata
+        rows = led.iter_all()
+    else:
+        rows = iter_rows()
+    for row in rows:
+        keys[_import_key(row.get("data"), _import_valor(str(row.get("valor") or "")), row.get("descricao"))] += 1
+    return keys
+
+def _import_write(tenant: "Tenant", rows: list):
+    with M_APPEND.time(LEDGER_BACKEND):
+        if LEDGER_BACKEND == "sqlite":
+            tenant.ledger().append(rows)
+        else:
+            sheets_append_rows(rows, tenant)
+
+def import_statement(fh, fmt: str, job: ImportJob, batch_rows: int = None, on_batch=None) -> ImportJob:
+    """
+    Importa um extrato (arquivo binário aberto, CSV ou OFX) no ledger do
+    tenant atual: pula as duplicatas e grava o resto em lotes de batch_rows
+    (IMPORT_BATCH_ROWS). on_batch(job) roda depois de cada lote gravado. Um
+    erro no meio para o import (state "error"); o que já foi gravado fica, e
+    rodar de novo pula essas linhas.
+    """
+    tenant = current_tenant()
+    batch_rows = batch_rows or IMPORT_BATCH_ROWS
+    job.state, job.started = "running", time.time()
+    stats = job.stats
+    try:
+        seen = _ledger_keys(tenant)
+        stats["ledger_rows"] = sum(seen.values())
+        lines = _import_lines(fh, job)
+        records = iter_ofx_statement(lines) if fmt == "ofx" else iter_csv_statement(lines)
+        batch = []
+        for n, tx in records:
+            stats["lines"] += 1
+            if tx is None:
+                stats["invalid"] += 1
+                if len(job.invalid_lines) < IMPORT_ERRORS_MAX:
+                    job.invalid_lines.append(n)
+                continue
+            key = _import_key(tx["data"], tx["valor"], tx["descricao"])
+            if seen.get(key):
+                seen[key] -= 1
+                stats["duplicates"] += 1
+                continue
+            tx["mensagem_original"] = f"extrato {job.source} #{n}"
+            batch.append(tx_to_row(tx))
+            if len(batch) >= batch_rows:
+                _import_write(tenant, batch)
+                stats["imported"] += len(batch)
+                stats["batches"] += 1
+                batch = []
+                if on_batch is not None:
+                    on_batch(job)
+        if batch:
+            _import_write(tenant, batch)
+            stats["imported"] += len(batch)
+            stats["batches"] += 1
+        job.state = "done"
+    except Exception as e:
+        job.state, job.error = "error", repr(e)
+        print("IMPORT ERROR:", job.id, job.source, repr(e))
+    finally:
+        job.finished = time.time()
+        M_IMPORT_ROWS.inc("imported", amount=stats["imported"])
+        M_IMPORT_ROWS.inc("duplicate", amount=stats["duplicates"])
+        M_IMPORT_ROWS.inc("invalid", amount=stats["invalid"])
+    return job
+
+IMPORT_JOBS = OrderedDict()  # id -> ImportJob (os IMPORT_JOBS_MAX mais recentes)
+_IMPORT_LOCK = threading.Lock()
+
+def start_import(path: str, fmt: str, tenant: "Tenant", source: str, remove: bool = False) -> ImportJob:
+    """
+    Roda import_statement num thread, para o tenant; um import por tenant de
+    cada vez (dois em paralelo não veriam as linhas um do outro e gravariam
+    duplicatas). RuntimeError se já houver um rodando. remove apaga o
+    arquivo no fim (upload temporário).
+    """
+    job = ImportJob(source, fmt, tenant.key, os.path.getsize(path))
+    with _IMPORT_LOCK:
+        if any(j.tenant == tenant.key and j.state in ("queued", "running") for j in IMPORT_JOBS.values()):
+            raise RuntimeError(f"já há um import rodando para {tenant.key}")
+        IMPORT_JOBS[job.id] = job
+        while len(IMPORT_JOBS) > IMPORT_JOBS_MAX:
+            oldest = next(iter(IMPORT_JOBS.values()))
+            if oldest.state in ("queued", "running"):
+                break
+            IMPORT_JOBS.popitem(last=False)
+
+    def run():
+        _TENANT.set(tenant)
+        try:
+            with open(path, "rb") as fh:
+                import_statement(fh, fmt, job)
+        except OSError as e:
+            job.state, job.error = "error", repr(e)
+        finally:
+            if remove:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    threading.Thread(target=run, name=f"import-{job.id}", daemon=True).start()
+    return job
+
 # =========================================================
 # Inbound parse
 # =========================================================
@@ -590,6 +3575,498 @@ def extract_inbound(msg: dict):
     text = (msg.get("text") or {}).get("body", "")
     return ("text", (text or "").strip(), "")
 
+# =========================================================
+# Estado das conversas (sessões do wizard)
+# =========================================================
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory").strip().lower()
+SESSION_DB = os.environ.get("SESSION_DB", "sessions.db")
+SESSION_CACHE_MAX = int(os.environ.get("SESSION_CACHE_MAX", "1000"))
+SESSION_CAS_RETRIES = 3
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "1800"))      # inatividade até expirar (s)
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "10000"))       # teto de sessões vivas (LRU)
+SESSION_SWEEP_SECONDS = 60.0
+
+TX_FIELDS = (
+    "id", "timestamp", "tipo", "valor", "moeda", "categoria", "descricao",
+    "pagamento", "data", "confianca", "confirmado", "mensagem_original",
+)
+
+class Tx:
+    """
+    Lançamento em edição. Slots fixos em vez de dict por sessão, mas com o
+    mesmo acesso (tx["valor"], tx.get("data")) usado pelos helpers.
+    """
+
+    __slots__ = TX_FIELDS
+
+    def __init__(self, **fields):
+        for name in TX_FIELDS:
+            setattr(self, name, fields.get(name))
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in TX_FIELDS else default
+
+    def __getitem__(self, key: str):
+        if key not in TX_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in TX_FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in TX_FIELDS}
+
+class Session:
+    """Estado do wizard de um número: tx em edição, passo esperado e última atividade."""
+
+    __slots__ = ("tx", "step", "stage", "last")
+
+    def __init__(self, tx=None, step="inicio", stage="menu", last=0.0):
+        self.tx = tx
+        self.step = step
+        self.stage = stage
+        self.last = last
+
+    def expired(self, now: float) -> bool:
+        return SESSION_TTL > 0 and now - self.last > SESSION_TTL
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"tx": self.tx.to_dict() if self.tx else None, "await": self.step, "stage": self.stage, "last": self.last},
+            ensure_ascii=False,
+        )
+
+    @classmethod
+    def from_json(cls, data: str) -> "Session":
+        d = json.loads(data)
+        tx = Tx(**d["tx"]) if d.get("tx") else None
+        return cls(tx, d.get("await"), d.get("stage"), d.get("last") or 0.0)
+
+class MemorySessionStore:
+    """
+    Sessões num OrderedDict do processo (um único worker uvicorn), em ordem
+    de última atividade.
+
+    load devolve (sessão ou None, versão, expirou); save só grava se a versão
+    ainda for a lida (compare-and-set) e sessão None apaga. Sessões paradas há
+    mais de SESSION_TTL saem pela frente da fila (varredura barata a cada
+    save), e acima de SESSION_MAX a menos recente é despejada. Quem perdeu a
+    sessão assim fica marcado para receber o aviso de expiração.
+    """
+
+    def __init__(self, max_sessions: int):
+        self.items = OrderedDict()
+        self.expired = OrderedDict()
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        self.stats = {"conflicts": 0, "expired": 0, "evicted": 0}
+
+    def load(self, number: str):
+        now = time.time()
+        with self.lock:
+            hit = self.items.get(number)
+            if hit is not None and hit[0].expired(now):
+                self._drop(number, "expired")
+                hit = None
+            if hit is None:
+                return None, 0, self.expired.pop(number, None) is not None
+            return hit[0], hit[1], False
+
+    def save(self, number: str, session, version: int) -> bool:
+        now = time.time()
+        with self.lock:
+            hit = self.items.get(number)
+            if (hit[1] if hit else 0) != version:
+                self.stats["conflicts"] += 1
+                return False
+            if session is None:
+                self.items.pop(number, None)
+            else:
+                session.last = now
+                self.items[number] = (session, version + 1)
+                self.items.move_to_end(number)
+            self._sweep(now)
+            return True
+
+    def _sweep(self, now: float):
+        while self.items:
+            number, (session, _) = next(iter(self.items.items()))
+            if session.expired(now):
+                self._drop(number, "expired")
+            elif len(self.items) > self.max_sessions:
+                self._drop(number, "evicted")
+            else:
+                break
+
+    def _drop(self, number: str, reason: str):
+        del self.items[number]
+        self.stats[reason] += 1
+        self.expired[number] = True
+        if len(self.expired) > self.max_sessions:
+            self.expired.popitem(last=False)
+
+    def active(self) -> int:
+        with self.lock:
+            return len(self.items)
+
+class SqliteSessionStore:
+    """
+    Sessões num SQLite local em modo WAL, compartilhado pelos workers da máquina.
+
+    Cada número tem uma versão que só cresce (apagar grava data NULL em vez
+    de remover a linha), e save é um UPDATE ... WHERE version = ?: se outro
+    worker avançou o wizard antes, a gravação falha e o turno é refeito sobre
+    o estado novo. Sessões quentes ficam num cache LRU do processo; um cache
+    velho só custa um conflito.
+
+    A expiração é preguiçosa no load (last_seen além de SESSION_TTL) e, a cada
+    SESSION_SWEEP_SECONDS, um save varre as paradas e as que passam do teto
+    SESSION_MAX. A varredura também só avança a versão, com expired = 1 para
+    o aviso na próxima mensagem.
+    """
+
+    def __init__(self, path: str, cache_max: int, max_sessions: int):
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (number TEXT PRIMARY KEY, data TEXT, version INTEGER NOT NULL)"
+        )
+        cols = {row[1] for row in self.db.execute("PRAGMA table_info(sessions)")}
+        if "last_seen" not in cols:
+            self.db.execute("ALTER TABLE sessions ADD COLUMN last_seen REAL NOT NULL DEFAULT 0")
+        if "expired" not in cols:
+            self.db.execute("ALTER TABLE sessions ADD COLUMN expired INTEGER NOT NULL DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_live ON sessions (last_seen) WHERE data IS NOT NULL")
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_max = cache_max
+        self.max_sessions = max_sessions
+        self.swept_at = 0.0
+        self.stats = {"conflicts": 0, "cache_hits": 0, "cache_misses": 0, "expired": 0, "evicted": 0}
+
+    def load(self, number: str):
+        now = time.time()
+        with self.lock:
+            hit = self.cache.get(number)
+            if hit is not None and not (hit[0] is not None and hit[0].expired(now)):
+                self.cache.move_to_end(number)
+                self.stats["cache_hits"] += 1
+                return hit[0], hit[1], False
+            self.stats["cache_misses"] += 1
+            row = self.db.execute(
+                "SELECT data, version, expired FROM sessions WHERE number = ?", (number,)
+            ).fetchone()
+            if row is None:
+                return None, 0, False
+            session = Session.from_json(row[0]) if row[0] else None
+            if session is not None and session.expired(now):
+                # o próximo save grava por cima (CAS na mesma versão)
+                self.cache.pop(number, None)
+                self.stats["expired"] += 1
+                return None, row[1], True
+            self._cache_put(number, (session, row[1]))
+            return session, row[1], bool(row[2])
+
+    def save(self, number: str, session, version: int) -> bool:
+        now = time.time()
+        if session is not None:
+            session.last = now
+        data = session.to_json() if session is not None else None
+        with self.lock:
+            if version == 0:
+                cur = self.db.execute(
+                    "INSERT INTO sessions (number, data, version, last_seen) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT(number) DO NOTHING",
+                    (number, data, now),
+                )
+            else:
+                cur = self.db.execute(
+                    "UPDATE sessions SET data = ?, version = version + 1, last_seen = ?, expired = 0 "
+                    "WHERE number = ? AND version = ?",
+                    (data, now, number, version),
+                )
+            if cur.rowcount != 1:
+                self.stats["conflicts"] += 1
+                self.cache.pop(number, None)
+                return False
+            self._cache_put(number, (session, version + 1))
+            if now - self.swept_at >= SESSION_SWEEP_SECONDS:
+                self._sweep(now)
+            return True
+
+    def _sweep(self, now: float):
+        self.swept_at = now
+        cur = self.db.execute(
+            "UPDATE sessions SET data = NULL, version = version + 1, expired = 1 "
+            "WHERE data IS NOT NULL AND last_seen < ?",
+            (now - SESSION_TTL if SESSION_TTL > 0 else 0,),
+        )
+        self.stats["expired"] += cur.rowcount
+        cur = self.db.execute(
+            "UPDATE sessions SET data = NULL, version = version + 1, expired = 1 WHERE number IN ("
+            "SELECT number FROM sessions WHERE data IS NOT NULL ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,),
+        )
+        self.stats["evicted"] += cur.rowcount
+        # versões mudaram por baixo do cache: um conflito custaria um turno refeito
+        self.cache.clear()
+
+    def _cache_put(self, number: str, value):
+        self.cache[number] = value
+        self.cache.move_to_end(number)
+        if len(self.cache) > self.cache_max:
+            self.cache.popitem(last=False)
+
+    def active(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM sessions WHERE data IS NOT NULL").fetchone()[0]
+
+def make_session_store():
+    if SESSION_BACKEND == "sqlite":
+        return SqliteSessionStore(SESSION_DB, SESSION_CACHE_MAX, SESSION_MAX)
+    return MemorySessionStore(SESSION_MAX)
+
+SESSIONS = make_session_store()
+Gauge("finbot_sessions_active", "Sessões do wizard em andamento (PENDING)", lambda: SESSIONS.active())
+
+class Turn:
+    """
+    Um turno do wizard (uma mensagem recebida): sessão em edição, envios
+    (outbox) e linhas confirmadas. Nada disso sai antes do save da sessão.
+    expired indica que a sessão anterior caiu por inatividade.
+    """
+
+    def __init__(self, session, expired: bool = False):
+        self.session = session
+        self.expired = expired
+        self.outbox = []
+        self.rows = []
+
+# =========================================================
+# Fila do webhook: ack rápido + workers
+# =========================================================
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_MAX = int(os.environ.get("WEBHOOK_QUEUE_MAX", "1000"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.environ.get("WEBHOOK_DRAIN_TIMEOUT", "25"))
+
+class InboundQueue:
+    """
+    Fila de mensagens recebidas, dividida em uma sub-fila por worker.
+    O número de origem escolhe a sub-fila, então mensagens do mesmo número
+    são processadas em ordem e números diferentes em paralelo.
+    A capacidade total (maxsize) é repartida igualmente entre as sub-filas.
+    """
+
+    def __init__(self, handler, workers: int, maxsize: int):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.queues = []
+        self.tasks = []
+        self.accepting = False
+        self.stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "rejected": 0,
+            "errors": 0,
+            "max_depth": 0,
+            "max_wait_ms": 0.0,
+        }
+
+    def start(self):
+        if self.tasks:
+            return
+        per_queue = max(1, self.maxsize // self.workers)
+        self.queues = [asyncio.Queue(maxsize=per_queue) for _ in range(self.workers)]
+        self.tasks = [asyncio.create_task(self._worker(q)) for q in self.queues]
+        self.accepting = True
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def submit(self, key: str, item) -> bool:
+        if not self.tasks:
+            self.start()
+        if not self.accepting:
+            self.stats["rejected"] += 1
+            return False
+        q = self.queues[hash(key) % self.workers]
+        try:
+            q.put_nowait((time.monotonic(), item))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            return False
+        self.stats["enqueued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.depth())
+        return True
+
+    async def _worker(self, q: asyncio.Queue):
+        while True:
+            queued_at, item = await q.get()
+            wait_ms = (time.monotonic() - queued_at) * 1000.0
+            self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], wait_ms)
+            try:
+                await self.handler(item)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print("WEBHOOK WORKER ERROR:", repr(e))
+            finally:
+                self.stats["processed"] += 1
+                q.task_done()
+
+    async def drain(self, timeout: float):
+        """Para de aceitar, espera as filas esvaziarem (até timeout) e encerra os workers."""
+        self.accepting = False
+        if not self.tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            print("WEBHOOK DRAIN TIMEOUT: descartando", self.depth(), "mensagens")
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "depth": self.depth(),
+            "capacity": self.maxsize,
+            "workers": self.workers,
+            "accepting": self.accepting,
+        }
+
+INBOUND = InboundQueue(lambda item: handle_sender_group(item), WEBHOOK_WORKERS, WEBHOOK_QUEUE_MAX)
+
+# =========================================================
+# Idempotência: IDs de mensagens já recebidas
+# =========================================================
+DEDUPE_TTL = float(os.environ.get("DEDUPE_TTL", str(24 * 3600)))
+DEDUPE_MAX = int(os.environ.get("DEDUPE_MAX", "50000"))
+DEDUPE_DB = os.environ.get("DEDUPE_DB", "").strip()
+
+class SeenMessages:
+    """
+    Conjunto limitado de message IDs já vistos, com TTL e despejo LRU.
+    A Meta reenvia o webhook em timeout; o mesmo msg["id"] não pode rodar o
+    wizard de novo (ex.: um "SIM" repetido gravaria a linha duas vezes).
+
+    Em memória é um OrderedDict (O(1) por operação, no máximo max_entries).
+    Com db_path, um SQLite local também é consultado, para vários workers
+    uvicorn na mesma máquina compartilharem o que já foi visto.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, db_path: str = ""):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        self._db_writes = 0
+        if db_path:
+            self.db = sqlite3.connect(db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS seen_messages (id TEXT PRIMARY KEY, expires REAL NOT NULL)")
+
+    def _expire(self, now: float):
+        # TTL igual para todos, contado da última vez que o ID apareceu: os que vencem antes estão no começo
+        while self.items:
+            key, expires = next(iter(self.items.items()))
+            if expires > now:
+                break
+            self.items.popitem(last=False)
+
+    def seen(self, msg_id: str) -> bool:
+        """True se o ID já foi visto (duplicata); senão registra e devolve False."""
+        if not msg_id:
+            return False
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            if msg_id in self.items:
+                # reentrega renova o TTL: o fim da fila segue sendo o que vence por último
+                self.items[msg_id] = now + self.ttl
+                self.items.move_to_end(msg_id)
+                self.hits += 1
+                return True
+            if self.db is not None and self._db_seen(msg_id, now):
+                self.hits += 1
+                return True
+            self.items[msg_id] = now + self.ttl
+            if len(self.items) > self.max_entries:
+                self.items.popitem(last=False)
+            self.misses += 1
+            return False
+
+    def _db_seen(self, msg_id: str, now: float) -> bool:
+        cur = self.db.execute(
+            "INSERT INTO seen_messages (id, expires) VALUES (?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET expires = excluded.expires WHERE seen_messages.expires <= ?",
+            (msg_id, now + self.ttl, now),
+        )
+        if cur.rowcount == 0:
+            return True
+        self._db_writes += 1
+        if self._db_writes % 1000 == 0:
+            self.db.execute("DELETE FROM seen_messages WHERE expires <= ?", (now,))
+            self.db.execute(
+                "DELETE FROM seen_messages WHERE id NOT IN "
+                "(SELECT id FROM seen_messages ORDER BY expires DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+        return False
+
+    def forget(self, msg_id: str):
+        """Desfaz o registro (mensagem não pôde ser enfileirada e será reenviada)."""
+        with self.lock:
+            self.items.pop(msg_id, None)
+            if self.db is not None:
+                self.db.execute("DELETE FROM seen_messages WHERE id = ?", (msg_id,))
+
+    def snapshot(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.items)}
+
+SEEN = SeenMessages(DEDUPE_TTL, DEDUPE_MAX, DEDUPE_DB)
+
+STATUS_COUNTS = defaultdict(int)
+
+def collect_webhook_items(body: dict):
+    """
+    Percorre todas as entries/changes da entrega e separa mensagens de
+    callbacks de status (sent/delivered/read/failed).
+    """
+    messages, statuses = [], []
+    for entry in body.get("entry") or []:
+        for change in (entry or {}).get("changes") or []:
+            value = (change or {}).get("value") or {}
+            messages.extend(m for m in value.get("messages") or [] if m.get("from"))
+            statuses.extend(value.get("statuses") or [])
+    return messages, statuses
+
+def group_by_sender(messages: list):
+    """{from: [msgs em ordem de timestamp]} (sort estável: empate mantém a ordem da entrega)."""
+    groups = defaultdict(list)
+    for m in messages:
+        groups[m["from"]].append(m)
+    for msgs in groups.values():
+        msgs.sort(key=lambda m: int(m.get("timestamp") or 0))
+    return groups
+
+def handle_statuses(statuses: list):
+    for st in statuses:
+        status = st.get("status") or "unknown"
+        STATUS_COUNTS[status] += 1
+        if status == "failed":
+            print("WHATSAPP STATUS FAILED:", st.get("recipient_id"), st.get("errors"))
+
 # =========================================================
 # Webhook Meta
 # =========================================================
@@ -608,279 +4085,498 @@ def verify(request: Request):
 
 @app.post("/webhook")
 async def receive(req: Request):
-    body = await req.json()
+    with M_WEBHOOK.time():
+        resp = await _receive(req)
+    if isinstance(resp, Response) and resp.status_code >= 400:
+        M_ERRORS.inc("webhook", str(resp.status_code))
+    return resp
+
+async def _receive(req: Request):
+    try:
+        body = await req.json()
+    except ValueError:
+        return Response(status_code=400)
+    if not isinstance(body, dict):
+        return Response(status_code=400)
 
-    entry = (body.get("entry") or [{}])[0]
-    changes = (entry.get("changes") or [{}])[0]
-    value = changes.get("value") or {}
-    messages = value.get("messages") or []
+    messages, statuses = collect_webhook_items(body)
+    handle_statuses(statuses)
 
+    # números sem tenant (ALLOWED_WA_NUMBER ou TENANTS_FILE) são ignorados
+    tenants = {}
+    for m in messages:
+        if m["from"] not in tenants:
+            tenants[m["from"]] = TENANTS.get(m["from"])
+    messages = [m for m in messages if tenants[m["from"]] is not None]
+    # reentregas da Meta: descarta antes de qualquer mudança de estado
+    messages = [m for m in messages if not SEEN.seen(m.get("id"))]
     if not messages:
         return {"ok": True}
 
-    msg = messages[0]
+    # Ack imediato; o wizard roda nos workers. Fila cheia -> 503 e a Meta reenvia depois.
+    ok = True
+    for from_number, msgs in group_by_sender(messages).items():
+        if not INBOUND.submit(from_number, (msgs, tenants[from_number])):
+            ok = False
+            for m in msgs:
+                SEEN.forget(m.get("id"))
+    if not ok:
+        return Response(status_code=503)
+    return {"ok": True}
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _admin_ok(req: Request) -> bool:
+    got = req.headers.get("x-admin-token") or req.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(got.encode(), ADMIN_TOKEN.encode())
+
+@app.post("/admin/profile")
+async def admin_profile_start(req: Request):
+    """
+    Liga o profiler para as próximas N mensagens: ?webhooks=N&mode=cprofile|sampling.
+    Exige ADMIN_TOKEN (header X-Admin-Token ou Authorization: Bearer); sem
+    ADMIN_TOKEN configurado os endpoints de admin não existem.
+    """
+    if not ADMIN_TOKEN:
+        return Response(status_code=404)
+    if not _admin_ok(req):
+        return Response(status_code=403)
+    mode = req.query_params.get("mode", "cprofile")
+    try:
+        webhooks = int(req.query_params.get("webhooks", "20"))
+    except ValueError:
+        return Response(status_code=400)
+    if mode not in ("cprofile", "sampling") or not 0 < webhooks <= PROFILE_MAX_WEBHOOKS:
+        return Response(status_code=400)
+    try:
+        PROFILER.arm(webhooks, mode)
+    except (RuntimeError, ValueError) as e:  # ValueError: outro profiler já ligado no thread
+        return Response(content=str(e), status_code=409, media_type="text/plain")
+    return PROFILER.snapshot()
+
+@app.get("/admin/profile")
+def admin_profile_result(req: Request):
+    if not ADMIN_TOKEN:
+        return Response(status_code=404)
+    if not _admin_ok(req):
+        return Response(status_code=403)
+    return PROFILER.snapshot()
+
+@app.post("/admin/import")
+async def admin_import_start(req: Request):
+    """
+    Importa um extrato enviado no corpo (bytes do CSV ou OFX). ?number=
+    escolhe o tenant (sem ele, o default), ?format=csv|ofx (sem ele, pelo
+    conteúdo) e ?name= identifica o arquivo no mensagem_original. O corpo vai
+    em stream para um arquivo temporário e o import roda num thread: a
+    resposta (202) traz o id para acompanhar em GET /admin/import/{id}.
+    """
+    if not ADMIN_TOKEN:
+        return Response(status_code=404)
+    if not _admin_ok(req):
+        return Response(status_code=403)
+    number = req.query_params.get("number", "").strip()
+    tenant = TENANTS.get(number) if number else TENANTS.default
+    fmt = req.query_params.get("format", "").strip().lower()
+    name = req.query_params.get("name", "").strip() or "upload"
+    if tenant is None:
+        return Response(status_code=404)
+    if fmt not in ("", "csv", "ofx"):
+        return Response(status_code=400)
+    fd, path = tempfile.mkstemp(prefix="import-", dir=IMPORT_DIR)
+    head = b""
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in req.stream():
+                if len(head) < 1024:
+                    head += chunk[:1024]
+                f.write(chunk)
+        job = start_import(path, fmt or import_format(head, name), tenant, name, remove=True)
+    except RuntimeError as e:
+        os.unlink(path)
+        return Response(content=str(e), status_code=409, media_type="text/plain")
+    except BaseException:
+        os.unlink(path)
+        raise
+    return Response(content=json.dumps(job.snapshot()), status_code=202, media_type="application/json")
+
+@app.get("/admin/import/{job_id}")
+def admin_import_progress(job_id: str, req: Request):
+    if not ADMIN_TOKEN:
+        return Response(status_code=404)
+    if not _admin_ok(req):
+        return Response(status_code=403)
+    job = IMPORT_JOBS.get(job_id)
+    if job is None:
+        return Response(status_code=404)
+    return job.snapshot()
+
+@app.get("/webhook/stats")
+def webhook_stats(req: Request):
+    """Sem autenticação; o detalhe por tenant (números e nomes) só com o ADMIN_TOKEN."""
+    return {
+        **INBOUND.snapshot(),
+        "statuses": dict(STATUS_COUNTS),
+        "dedupe": SEEN.snapshot(),
+        "sessions": {**SESSIONS.stats, "active": SESSIONS.active()},
+        "whatsapp": dict(WA_STATS),
+        "sheets": SHEETS.snapshot(),
+        "tenants": TENANTS.snapshot(detail=_admin_ok(req)),
+    }
+
+async def handle_sender_group(item):
+    msgs, tenant = item
+    token = _TENANT.set(tenant)
+    try:
+        for msg in msgs:
+            try:
+                await handle_message(msg)
+            except Exception as e:
+                INBOUND.stats["errors"] += 1
+                M_ERRORS.inc("handler", "exception")
+                print("WEBHOOK HANDLER ERROR:", msg.get("id"), repr(e))
+    finally:
+        _TENANT.reset(token)
+
+async def handle_message(msg: dict):
+    """
+    Roda um turno do wizard e grava a sessão com compare-and-set. Se outro
+    worker avançou a mesma sessão no meio, o turno é descartado e refeito
+    sobre o estado novo; envios e gravações só saem depois do save. As linhas
+    confirmadas vão para o writer do tenant antes do MSG_SALVO, sem esperar os
+    outros remetentes da mesma entrega.
+    """
     from_number = msg.get("from")
+    t0 = time.perf_counter()
+    step = "none"
+    trace = start_trace(msg.get("id"), type=msg.get("type"))
+    try:
+        for _ in range(SESSION_CAS_RETRIES):
+            with span("session.load"):
+                session, version, expired = SESSIONS.load(from_number)
+            step = session.step if session else "none"
+            turn = Turn(session, expired)
+            token = _OUTBOX.set(turn.outbox)
+            try:
+                with span("turn.run", step=step):
+                    await run_turn(msg, turn)
+            finally:
+                _OUTBOX.reset(token)
+            with span("session.save") as sp:
+                saved = SESSIONS.save(from_number, turn.session, version)
+                sp.set(conflict=not saved)
+            if saved:
+                break
+        else:
+            print("SESSION CAS: desistindo de", msg.get("id"), "após", SESSION_CAS_RETRIES, "conflitos")
+            return
 
-    allowed = os.environ.get("ALLOWED_WA_NUMBER", "").strip()
-    if allowed and from_number != allowed:
-        return {"ok": True}
+        with span("wa.flush", messages=len(turn.outbox)):
+            await flush_outbox(turn.outbox)
+        if turn.rows:
+            # journal ou ledger SQLite (durável); o Sheets recebe em lote pelo thread de fundo
+            with span("ledger.append", rows=len(turn.rows)):
+                await asyncio.to_thread(current_tenant().writer().append, turn.rows)
+            await AVISO_SALVO.send(from_number)
+    finally:
+        M_TURN.observe(time.perf_counter() - t0, step)
+        finish_trace(trace, step=step)
+        PROFILER.tick()
 
+class Inbound:
+    """Mensagem recebida já decodificada, como os handlers de passo a recebem."""
+
+    __slots__ = ("to", "kind", "val", "title")
+
+    def __init__(self, to: str, kind: str, val: str, title: str):
+        self.to = to
+        self.kind = kind
+        self.val = val
+        self.title = title
+
+CANCEL_WORDS = frozenset(("cancelar", "cancela"))
+CONFIRM_WORDS = frozenset(("sim", "ok", "confirmar"))
+DISCARD_WORDS = frozenset(("nao", "não", "cancelar", "cancela"))
+INICIO_TIPOS = {"inicio_receita": "receita", "inicio_despesa": "despesa"}
+RESUMO_KINDS = {
+    "res_diario": "diario", "res_semanal": "semanal", "res_mensal": "mensal",
+    "res_3m": "3m", "res_6m": "6m", "res_12m": "12m",
+}
+RECEBIMENTOS = {"rec_dinheiro": "dinheiro", "rec_pix": "pix"}
+DATA_OFFSETS = {"data_hoje": 0, "data_ontem": 1}
+
+async def run_turn(msg: dict, turn: Turn):
     kind, val, title = extract_inbound(msg)
+    inp = Inbound(msg.get("from"), kind, val, title)
+
+    if turn.expired:
+        await AVISO_EXPIRADA.send(inp.to)
 
     # cancelar
-    if kind == "text" and val.lower().strip() in ["cancelar", "cancela"]:
-        PENDING.pop(from_number, None)
-        send_whatsapp_text(from_number, "Cancelado. Mande qualquer mensagem para começar de novo.")
-        return {"ok": True}
+    if kind == "text" and val.lower().strip() in CANCEL_WORDS:
+        turn.session = None
+        await AVISO_CANCELADO.send(inp.to)
+        return
 
-    pending = PENDING.get(from_number)
+    # Se não há estado: lançamento escrito numa frase ou menu inicial
+    if not turn.session:
+        turn.session = Session()
+        if kind == "text" and await _start_from_text(turn, inp):
+            return
+        await ask_inicio(inp.to)
+        return
 
-    # Se não há estado: mostra menu inicial
-    if not pending:
-        PENDING[from_number] = {"tx": None, "await": "inicio", "stage": "menu"}
-        ask_inicio(from_number)
-        return {"ok": True}
+    await STEP_HANDLERS.get(turn.session.step, step_fallback)(turn, inp)
 
-    await_field = pending.get("await")
-
-    # -------------------------
-    # MENU INICIAL
-    # -------------------------
-    if await_field == "inicio":
-        if kind != "choice":
-            ask_inicio(from_number)
-            return {"ok": True}
-
-        if val == "inicio_receita":
-            tx = {
-                "id": str(uuid.uuid4()),
-                "timestamp": now_iso(),
-                "tipo": "receita",
-                "valor": None,
-                "moeda": "BRL",
-                "categoria": None,     # origem
-                "descricao": None,     # auto
-                "pagamento": None,     # recebimento
-                "data": None,
-                "confianca": 0.60,
-                "confirmado": "não",
-                "mensagem_original": "",
-            }
-            pending["tx"] = tx
-            pending["await"] = continue_wizard(from_number, tx)
-            return {"ok": True}
-
-        if val == "inicio_despesa":
-            tx = {
-                "id": str(uuid.uuid4()),
-                "timestamp": now_iso(),
-                "tipo": "despesa",
-                "valor": None,
-                "moeda": "BRL",
-                "categoria": None,
-                "descricao": None,
-                "pagamento": None,
-                "data": None,
-                "confianca": 0.60,
-                "confirmado": "não",
-                "mensagem_original": "",
-            }
-            pending["tx"] = tx
-            pending["await"] = continue_wizard(from_number, tx)
-            return {"ok": True}
+async def _advance(turn: Turn, to: str, tx: Tx):
+    turn.session.tx = tx
+    turn.session.step = await continue_wizard(to, tx)
 
-        if val == "inicio_resumo":
-            pending["tx"] = None
-            pending["await"] = "resumo_periodo"
-            ask_resumo_periodo(from_number)
-            return {"ok": True}
+def _tx(turn: Turn) -> Tx:
+    return turn.session.tx or Tx()
 
-        ask_inicio(from_number)
-        return {"ok": True}
+async def _start_from_text(turn: Turn, inp: Inbound) -> bool:
+    """
+    "mercado 35,90 pix ontem pão e leite" já é o lançamento: o wizard começa
+    com o que parse_lancamento tirou da frase e só pergunta o que faltou
+    (next_missing); com tudo preenchido vai direto para a confirmação.
+    """
+    fields = parse_lancamento(inp.val)
+    if fields is None:
+        return False
+    tx = Tx(
+        id=str(uuid.uuid4()),
+        timestamp=now_iso(),
+        moeda="BRL",
+        confirmado="não",
+        mensagem_original=inp.val,
+        **fields,
+    )
+    await _advance(turn, inp.to, tx)
+    return True
 
-    # -------------------------
-    # RESUMO: escolher período
-    # -------------------------
-    if await_field == "resumo_periodo":
-        if kind != "choice":
-            ask_resumo_periodo(from_number)
-            return {"ok": True}
-
-        if val == "res_diario":
-            send_whatsapp_text(from_number, build_resumo_text("diario"))
-            PENDING.pop(from_number, None)
-            return {"ok": True}
-
-        if val == "res_semanal":
-            send_whatsapp_text(from_number, build_resumo_text("semanal"))
-            PENDING.pop(from_number, None)
-            return {"ok": True}
-
-        if val == "res_mensal":
-            send_whatsapp_text(from_number, build_resumo_text("mensal"))
-            PENDING.pop(from_number, None)
-            return {"ok": True}
-
-        if val == "res_3m":
-            send_whatsapp_text(from_number, build_resumo_text("3m"))
-            PENDING.pop(from_number, None)
-            return {"ok": True}
-
-        if val == "res_6m":
-            send_whatsapp_text(from_number, build_resumo_text("6m"))
-            PENDING.pop(from_number, None)
-            return {"ok": True}
-
-        if val == "res_12m":
-            send_whatsapp_text(from_number, build_resumo_text("12m"))
-            PENDING.pop(from_number, None)
-            return {"ok": True}
-
-        ask_resumo_periodo(from_number)
-        return {"ok": True}
+# -------------------------
+# MENU INICIAL
+# -------------------------
+async def step_inicio(turn: Turn, inp: Inbound):
+    if inp.kind != "choice":
+        if inp.kind == "text" and await _start_from_text(turn, inp):
+            return
+        await ask_inicio(inp.to)
+        return
 
-    # -------------------------
-    # FLUXO DE LANÇAMENTO
-    # -------------------------
-    tx = pending.get("tx") or {}
-
-    # CONFIRMAR
-    if await_field == "confirm":
-        if (kind == "choice" and val == "confirm_sim") or (kind == "text" and val.lower().strip() in ["sim", "ok", "confirmar"]):
-            tx["confirmado"] = "sim"
-            ensure_receita_descricao(tx)
-            normalize_sign(tx)
-            append_row(tx_to_row(tx))
-            PENDING.pop(from_number, None)
-            send_whatsapp_text(from_number, MSG_SALVO)
-            return {"ok": True}
-
-        if (kind == "choice" and val == "confirm_cancelar") or (kind == "text" and val.lower().strip() in ["nao", "não", "cancelar", "cancela"]):
-            PENDING.pop(from_number, None)
-            send_whatsapp_text(from_number, "Cancelado. Mande qualquer mensagem para começar de novo.")
-            return {"ok": True}
-
-        send_whatsapp_text(from_number, "Selecione SIM para gravar ou CANCELAR para descartar.")
-        return {"ok": True}
+    tipo = INICIO_TIPOS.get(inp.val)
+    if tipo is not None:
+        tx = Tx(
+            id=str(uuid.uuid4()),
+            timestamp=now_iso(),
+            tipo=tipo,
+            moeda="BRL",
+            confianca=0.60,
+            confirmado="não",
+            mensagem_original="",
+        )
+        await _advance(turn, inp.to, tx)
+        return
 
-    # CATEGORIA/ORIGEM
-    if await_field == "categoria":
-        if kind == "choice" and val:
-            if tx.get("tipo") == "receita":
-                if val.startswith("origem_"):
-                    tx["categoria"] = title or "Outros"
-            else:
-                if val.startswith("cat_"):
-                    tx["categoria"] = title or "Outros"
+    if inp.val == "inicio_resumo":
+        turn.session.tx = None
+        turn.session.step = "resumo_periodo"
+        await ask_resumo_periodo(inp.to)
+        return
 
-            if (tx.get("categoria") or "").lower() == "outros":
-                pending["tx"] = tx
-                pending["await"] = "categoria_texto"
-                ask_text_field(from_number, "categoria", tx)
-                return {"ok": True}
+    await ask_inicio(inp.to)
 
-            pending["tx"] = tx
-            pending["await"] = continue_wizard(from_number, tx)
-            return {"ok": True}
+# -------------------------
+# RESUMO: escolher período
+# -------------------------
+async def step_resumo_periodo(turn: Turn, inp: Inbound):
+    resumo = RESUMO_KINDS.get(inp.val) if inp.kind == "choice" else None
+    if resumo is None:
+        await ask_resumo_periodo(inp.to)
+        return
 
-        send_whatsapp_text(from_number, "Escolha uma opção na lista.")
-        ask_categoria_ou_origem(from_number, tx)
-        return {"ok": True}
+    await send_whatsapp_text(inp.to, await asyncio.to_thread(build_resumo_text, resumo))
+    turn.session = None
 
-    if await_field == "categoria_texto":
-        if kind != "text" or not val.strip():
-            ask_text_field(from_number, "categoria", tx)
-            return {"ok": True}
-        tx["categoria"] = val.strip()
-        pending["tx"] = tx
-        pending["await"] = continue_wizard(from_number, tx)
-        return {"ok": True}
+# -------------------------
+# FLUXO DE LANÇAMENTO
+# -------------------------
+async def step_confirm(turn: Turn, inp: Inbound):
+    text = inp.val.lower().strip() if inp.kind == "text" else None
+    if (inp.kind == "choice" and inp.val == "confirm_sim") or text in CONFIRM_WORDS:
+        tx = _tx(turn)
+        tx["confirmado"] = "sim"
+        ensure_receita_descricao(tx)
+        normalize_sign(tx)
+        # gravada por handle_message depois do save da sessão, antes do MSG_SALVO
+        turn.rows.append(tx_to_row(tx))
+        turn.session = None
+        return
 
-    # VALOR
-    if await_field == "valor":
-        if kind != "text":
-            ask_text_field(from_number, "valor", tx)
-            return {"ok": True}
-        v = parse_valor(val)
-        if v is None:
-            send_whatsapp_text(from_number, "Valor inválido. Ex: 35,90")
-            ask_text_field(from_number, "valor", tx)
-            return {"ok": True}
-        tx["valor"] = v
-        pending["tx"] = tx
-        pending["await"] = continue_wizard(from_number, tx)
-        return {"ok": True}
+    if (inp.kind == "choice" and inp.val == "confirm_cancelar") or text in DISCARD_WORDS:
+        turn.session = None
+        await AVISO_CANCELADO.send(inp.to)
+        return
 
-    # DESCRIÇÃO (apenas despesa)
-    if await_field == "descricao":
-        if kind != "text" or not val.strip():
-            ask_text_field(from_number, "descricao", tx)
-            return {"ok": True}
-        tx["descricao"] = val.strip()
-        pending["tx"] = tx
-        pending["await"] = continue_wizard(from_number, tx)
-        return {"ok": True}
+    await AVISO_CONFIRMAR.send(inp.to)
 
-    # PAGAMENTO (despesa)
-    if await_field == "pagamento":
-        if kind == "choice" and val and val.startswith("pay_"):
-            tx["pagamento"] = (title or "desconhecido").lower().strip()
-            pending["tx"] = tx
-            pending["await"] = continue_wizard(from_number, tx)
-            return {"ok": True}
-        send_whatsapp_text(from_number, "Escolha uma opção na lista de pagamento.")
-        ask_pagamento_despesa(from_number)
-        return {"ok": True}
+async def step_categoria(turn: Turn, inp: Inbound):
+    tx = _tx(turn)
+    if inp.kind == "choice" and inp.val:
+        prefix = "origem_" if tx.get("tipo") == "receita" else "cat_"
+        if inp.val.startswith(prefix):
+            tx["categoria"] = inp.title or "Outros"
 
-    # RECEBIMENTO (receita)
-    if await_field == "recebimento":
-        if kind == "choice" and val in ["rec_dinheiro", "rec_pix"]:
-            tx["pagamento"] = "dinheiro" if val == "rec_dinheiro" else "pix"
-            pending["tx"] = tx
-            pending["await"] = continue_wizard(from_number, tx)
-            return {"ok": True}
-        send_whatsapp_text(from_number, "Use os botões: Dinheiro ou PIX.")
-        ask_recebimento_receita(from_number)
-        return {"ok": True}
+        if (tx.get("categoria") or "").lower() == "outros":
+            turn.session.tx = tx
+            turn.session.step = "categoria_texto"
+            await ask_text_field(inp.to, "categoria", tx)
+            return
 
-    # DATA
-    if await_field == "data":
-        if kind == "choice" and val in ["data_hoje", "data_ontem", "data_outra"]:
-            if val == "data_hoje":
-                tx["data"] = today_iso()
-                pending["tx"] = tx
-                pending["await"] = continue_wizard(from_number, tx)
-                return {"ok": True}
-            if val == "data_ontem":
-                tx["data"] = (dt.date.today() - dt.timedelta(days=1)).isoformat()
-                pending["tx"] = tx
-                pending["await"] = continue_wizard(from_number, tx)
-                return {"ok": True}
-            pending["tx"] = tx
-            pending["await"] = "data_texto"
-            ask_text_field(from_number, "data", tx)
-            return {"ok": True}
-
-        send_whatsapp_text(from_number, "Use os botões: Hoje / Ontem / Outra.")
-        ask_data(from_number)
-        return {"ok": True}
+        await _advance(turn, inp.to, tx)
+        return
 
-    if await_field == "data_texto":
-        if kind != "text" or not val.strip():
-            ask_text_field(from_number, "data", tx)
-            return {"ok": True}
-        d = parse_data(val.strip())
-        if not d:
-            send_whatsapp_text(from_number, "Data inválida. Use hoje/ontem ou dd/mm (ex: 29/12).")
-            ask_text_field(from_number, "data", tx)
-            return {"ok": True}
-        tx["data"] = d
-        pending["tx"] = tx
-        pending["await"] = continue_wizard(from_number, tx)
-        return {"ok": True}
+    await AVISO_LISTA.send(inp.to)
+    await ask_categoria_ou_origem(inp.to, tx)
 
-    # fallback: tenta continuar wizard
-    pending["tx"] = tx
-    pending["await"] = continue_wizard(from_number, tx)
-    return {"ok": True}
+async def step_categoria_texto(turn: Turn, inp: Inbound):
+    tx = _tx(turn)
+    if inp.kind != "text" or not inp.val.strip():
+        await ask_text_field(inp.to, "categoria", tx)
+        return
+    tx["categoria"] = inp.val.strip()
+    await _advance(turn, inp.to, tx)
+
+async def step_valor(turn: Turn, inp: Inbound):
+    tx = _tx(turn)
+    if inp.kind != "text":
+        await ask_text_field(inp.to, "valor", tx)
+        return
+    v = parse_valor(inp.val)
+    if v is None:
+        await AVISO_VALOR_INVALIDO.send(inp.to)
+        await ask_text_field(inp.to, "valor", tx)
+        return
+    tx["valor"] = v
+    await _advance(turn, inp.to, tx)
+
+# DESCRIÇÃO (apenas despesa)
+async def step_descricao(turn: Turn, inp: Inbound):
+    tx = _tx(turn)
+    if inp.kind != "text" or not inp.val.strip():
+        await ask_text_field(inp.to, "descricao", tx)
+        return
+    tx["descricao"] = inp.val.strip()
+    await _advance(turn, inp.to, tx)
+
+# PAGAMENTO (despesa)
+async def step_pagamento(turn: Turn, inp: Inbound):
+    if inp.kind == "choice" and inp.val and inp.val.startswith("pay_"):
+        tx = _tx(turn)
+        tx["pagamento"] = (inp.title or "desconhecido").lower().strip()
+        await _advance(turn, inp.to, tx)
+        return
+    await AVISO_PAGAMENTO.send(inp.to)
+    await ask_pagamento_despesa(inp.to)
+
+# RECEBIMENTO (receita)
+async def step_recebimento(turn: Turn, inp: Inbound):
+    pagamento = RECEBIMENTOS.get(inp.val) if inp.kind == "choice" else None
+    if pagamento is not None:
+        tx = _tx(turn)
+        tx["pagamento"] = pagamento
+        await _advance(turn, inp.to, tx)
+        return
+    await AVISO_RECEBIMENTO.send(inp.to)
+    await ask_recebimento_receita(inp.to)
+
+async def step_data(turn: Turn, inp: Inbound):
+    if inp.kind == "choice" and inp.val in ("data_hoje", "data_ontem", "data_outra"):
+        tx = _tx(turn)
+        days_ago = DATA_OFFSETS.get(inp.val)
+        if days_ago is not None:
+            tx["data"] = (dt.date.today() - dt.timedelta(days=days_ago)).isoformat()
+            await _advance(turn, inp.to, tx)
+            return
+        turn.session.tx = tx
+        turn.session.step = "data_texto"
+        await ask_text_field(inp.to, "data", tx)
+        return
+
+    await AVISO_DATA.send(inp.to)
+    await ask_data(inp.to)
+
+async def step_data_texto(turn: Turn, inp: Inbound):
+    tx = _tx(turn)
+    if inp.kind != "text" or not inp.val.strip():
+        await ask_text_field(inp.to, "data", tx)
+        return
+    d = parse_data(inp.val.strip())
+    if not d:
+        await AVISO_DATA_INVALIDA.send(inp.to)
+        await ask_text_field(inp.to, "data", tx)
+        return
+    tx["data"] = d
+    await _advance(turn, inp.to, tx)
+
+# fallback: tenta continuar wizard
+async def step_fallback(turn: Turn, inp: Inbound):
+    await _advance(turn, inp.to, _tx(turn))
+
+# Passo esperado -> handler: uma consulta de dict por mensagem, em vez da
+# cadeia de ifs sobre o passo.
+STEP_HANDLERS = {
+    "inicio": step_inicio,
+    "resumo_periodo": step_resumo_periodo,
+    "confirm": step_confirm,
+    "categoria": step_categoria,
+    "categoria_texto": step_categoria_texto,
+    "valor": step_valor,
+    "descricao": step_descricao,
+    "pagamento": step_pagamento,
+    "recebimento": step_recebimento,
+    "data": step_data,
+    "data_texto": step_data_texto,
+}
+
+# =========================================================
+# CLI
+# =========================================================
+def main(argv=None) -> int:
+    """
+    python app.py import extrato.ofx [--format csv|ofx] [--number 5511...] [--batch-rows N]
+
+    Mesmo import do POST /admin/import, direto do arquivo; o progresso sai
+    em stderr a cada lote e o resumo final (JSON) em stdout.
+    """
+    import argparse
+
+    ap = argparse.ArgumentParser(prog="app.py")
+    cmd = ap.add_subparsers(dest="cmd", required=True)
+    imp = cmd.add_parser("import", help="importa um extrato CSV/OFX no ledger")
+    imp.add_argument("path")
+    imp.add_argument("--format", choices=("csv", "ofx"))
+    imp.add_argument("--number", help="número do tenant (sem ele, o default)")
+    imp.add_argument("--batch-rows", type=int, default=IMPORT_BATCH_ROWS)
+    args = ap.parse_args(argv)
+
+    tenant = TENANTS.get(args.number) if args.number else TENANTS.default
+    if tenant is None:
+        ap.error(f"número sem tenant: {args.number}")
+    _TENANT.set(tenant)
+    with open(args.path, "rb") as fh:
+        fmt = args.format or import_format(fh.read(1024), args.path)
+        fh.seek(0)
+        job = ImportJob(os.path.basename(args.path), fmt, tenant.key, os.path.getsize(args.path))
+        import_statement(fh, fmt, job, args.batch_rows, on_batch=lambda j: print(
+            f"{j.snapshot()['progress']:.0%} {j.stats['lines']} linhas, {j.stats['imported']} gravadas,"
+            f" {j.stats['duplicates']} duplicadas", file=sys.stderr))
+    tenant.stop(WEBHOOK_DRAIN_TIMEOUT)  # sqlite: a réplica manda o que falta ao Sheets
+    print(json.dumps(job.snapshot(), ensure_ascii=False))
+    return 0 if job.state == "done" else 1
 
+if __name__ == "__main__":
+    sys.exit(main())
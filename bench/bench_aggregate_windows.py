@@ -0,0 +1,83 @@
+"""
+Benchmark: os seis resumos (diário ... 12 meses) juntos, por três caminhos
+sobre o mesmo LedgerStore:
+- laço: uma varredura linha a linha das colunas por período
+- PeriodIndex: montagem do índice + uma consulta por período
+- aggregate_windows: uma passada numpy (searchsorted + bincount) para todos
+
+Confere também que os três dão os mesmos totais.
+
+Uso:
+    python bench/bench_aggregate_windows.py [--sizes 100000 1000000 3000000]
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app
+from bench_period_index import KINDS, make_rows, to_store, timed
+
+
+def loop_totals(store, start, end):
+    lo, hi = start.toordinal(), end.toordinal()
+    total_rec = total_des = 0.0
+    rec_by_cat = defaultdict(float)
+    des_by_cat = defaultdict(float)
+    names = store.cat_names
+    for day, tipo, cat, val in zip(store.dates, store.tipos, store.cats, store.values):
+        if not day or day < lo or day > hi:
+            continue
+        if tipo == 1:
+            total_rec += abs(val)
+            rec_by_cat[names[cat]] += abs(val)
+        elif tipo == 2:
+            total_des += abs(val)
+            des_by_cat[names[cat]] += abs(val)
+    return total_rec, total_des, dict(rec_by_cat), dict(des_by_cat)
+
+
+def same(a, b):
+    if abs(a[0] - b[0]) > 1e-6 * max(1.0, a[0]) or abs(a[1] - b[1]) > 1e-6 * max(1.0, a[1]):
+        return False
+    for x, y in ((a[2], b[2]), (a[3], b[3])):
+        if x.keys() != y.keys() or any(abs(x[k] - y[k]) > 1e-6 * max(1.0, x[k]) for k in x):
+            return False
+    return True
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 3_000_000])
+    args = ap.parse_args()
+
+    if not app.HAS_NUMPY:
+        sys.exit("numpy não instalado")
+    app._numpy()  # o app só importa o numpy no primeiro resumo; fora da medida
+
+    windows = [app.get_period_range(k) for k in KINDS]
+    for n in args.sizes:
+        store = to_store(make_rows(n))
+
+        loop, loop_ms = timed(lambda: [loop_totals(store, s, e) for s, e in windows])
+
+        def with_index():
+            idx = app.PeriodIndex.from_store(store)
+            return [idx.totals(s, e) for s, e in windows]
+        indexed, index_ms = timed(with_index)
+
+        vec, np_ms = timed(app.aggregate_windows, store, windows)
+        ok = all(same(a, b) and same(a, c) for a, b, c in zip(loop, indexed, vec))
+
+        print(
+            f"n={n:>9,d}  laço(6 períodos)={loop_ms:9.1f}ms  "
+            f"PeriodIndex(build+6)={index_ms:8.1f}ms  numpy(1 passada)={np_ms:7.1f}ms  "
+            f"iguais={ok}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark: pico de memória e tempo de um full sync do espelho (e de uma
+passada do iter_rows) lendo a planilha numa janela só vs em janelas de
+SHEETS_CHUNK_ROWS, contra o fake local do Sheets (bench/fake_sheets.py)
+rodando noutro processo para não entrar na conta do tracemalloc.
+
+Uso:
+    python bench/bench_chunked_read.py [--rows 200000] [--chunks 1000,5000,20000]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+PORT = 8096
+os.environ["GOOGLE_SHEETS_API_ENDPOINT"] = f"http://127.0.0.1:{PORT}"
+os.environ["GOOGLE_SHEETS_SPREADSHEET_ID"] = "s"
+os.environ.pop("GOOGLE_APPLICATION_CREDENTIALS", None)
+os.environ.setdefault("SHEETS_QUOTA_PER_MINUTE", "100000")
+
+import app
+from bench_ledger_store import make_values
+
+
+def seed(rows: int):
+    values = make_values(rows)[1:]
+    with httpx.Client(base_url=f"http://127.0.0.1:{PORT}", timeout=60) as client:
+        for i in range(0, len(values), 20_000):
+            client.post("/v4/spreadsheets/s/values/lancamentos!A1:L:append",
+                        json={"values": values[i:i + 20_000]}).raise_for_status()
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn()
+    elapsed = (time.perf_counter() - t0) * 1000.0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed, peak / 1e6
+
+
+def full_sync():
+    mirror = app.LedgerMirror(app.TENANTS.default, 3600)
+    mirror._full_sync()
+    return mirror.sheet_rows
+
+
+def scan():
+    return sum(1 for _ in app.iter_rows())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--chunks", default="1000,5000,20000")
+    args = ap.parse_args()
+
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_sheets.py"), "--port", str(PORT)])
+    try:
+        for _ in range(500):
+            try:
+                httpx.get(f"http://127.0.0.1:{PORT}/v4/spreadsheets/s/values/A1", timeout=0.5)
+                break
+            except httpx.TransportError:
+                time.sleep(0.02)
+        seed(args.rows)
+        full_sync()  # service, discovery e imports fora da medida
+
+        sizes = [args.rows + 1] + [int(c) for c in args.chunks.split(",")]
+        print(f"{args.rows} linhas")
+        for size in sizes:
+            app.SHEETS_CHUNK_ROWS = size
+            label = "janela única" if size > args.rows else f"chunk {size}"
+            rows, ms, peak = measure(full_sync)
+            _, ms_scan, peak_scan = measure(scan)
+            print(f"  {label:14s} full sync {ms:8.1f} ms  pico {peak:7.1f} MB ({rows} linhas) | "
+                  f"iter_rows {ms_scan:8.1f} ms  pico {peak_scan:7.1f} MB")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+if __name__ == "__main__":
+    main()
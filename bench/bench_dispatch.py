@@ -0,0 +1,180 @@
+"""
+Micro-benchmark do despacho por mensagem: roda run_turn sobre conversas
+roteirizadas (receita e despesa completas, pelo wizard e escritas numa frase)
+sem rede nem Sheets, com os envios retidos num outbox, conta mensagens
+recebidas/enviadas por lançamento e compara o custo de montar um menu fixo do
+zero (dict + json.dumps) com o PayloadTemplate pré-serializado. Antes,
+confere o parse_lancamento nos CASOS: um erro sai com código 1.
+
+Uso:
+    python bench/bench_dispatch.py [--rounds 2000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app
+
+# (kind, val, title) na ordem em que o wizard pede
+DESPESA = [
+    ("text", "oi", ""),
+    ("choice", "inicio_despesa", "Despesa"),
+    ("text", "35,90", ""),
+    ("choice", "cat_mercado", "Mercado"),
+    ("text", "pão e leite", ""),
+    ("choice", "pay_pix", "pix"),
+    ("choice", "data_hoje", "Hoje"),
+    ("choice", "confirm_sim", "SIM"),
+]
+RECEITA = [
+    ("text", "oi", ""),
+    ("choice", "inicio_receita", "Receita"),
+    ("text", "5000", ""),
+    ("choice", "origem_outros", "Outros"),
+    ("text", "Aluguel do quarto", ""),
+    ("choice", "rec_pix", "PIX"),
+    ("choice", "data_outra", "Outra"),
+    ("text", "29/12", ""),
+    ("choice", "confirm_sim", "SIM"),
+]
+# o mesmo lançamento numa frase: só a confirmação
+DESPESA_TEXTO = [
+    ("text", "mercado 35,90 pix hoje pão e leite", ""),
+    ("choice", "confirm_sim", "SIM"),
+]
+# frase sem pagamento nem data: o wizard pergunta só esses dois
+RECEITA_TEXTO = [
+    ("text", "recebi 5000 freela", ""),
+    ("choice", "rec_pix", "PIX"),
+    ("choice", "data_outra", "Outra"),
+    ("text", "29/12", ""),
+    ("choice", "confirm_sim", "SIM"),
+]
+FRASES = [
+    "mercado 35,90 pix ontem pão e leite",
+    "Gastei R$ 1.234,56 no crédito em Saúde 29/12 dentista",
+    "recebi 5000 salário pix hoje",
+    "oi",
+]
+# frase -> campos esperados do parse_lancamento (None: não é lançamento)
+CASOS = [
+    ("mercado 35,90 pix ontem pão e leite", {"tipo": "despesa", "valor": 35.9, "categoria": "Mercado", "pagamento": "pix"}),
+    ("mercado 35,9 pix ontem pão", {"tipo": "despesa", "valor": 35.9, "descricao": "pão"}),
+    ("mercado 35.9 pix", {"valor": 35.9}),
+    ("Gastei R$ 1.234,5 no crédito", {"tipo": "despesa", "valor": 1234.5, "pagamento": "crédito"}),
+    ("recebi 5000 salário pix hoje", {"tipo": "receita", "valor": 5000.0, "categoria": "Salário"}),
+    ("oi", None),
+]
+
+
+def make_msg(number, kind, val, title):
+    if kind == "choice":
+        return {"from": number, "type": "interactive",
+                "interactive": {"type": "button_reply", "button_reply": {"id": val, "title": title}}}
+    return {"from": number, "type": "text", "text": {"body": val}}
+
+
+async def run_script(script, rounds):
+    msgs = [make_msg("5511999990000", *step) for step in script]
+    outbox = []
+    token = app._OUTBOX.set(outbox)
+    try:
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            session = None
+            for msg in msgs:
+                turn = app.Turn(session)
+                await app.run_turn(msg, turn)
+                session = turn.session
+            outbox.clear()
+        elapsed = time.perf_counter() - t0
+    finally:
+        app._OUTBOX.reset(token)
+    return elapsed / (rounds * len(msgs)) * 1e6
+
+
+async def exchanges(script):
+    """(recebidas, enviadas) num lançamento; o MSG_SALVO sai pelo handle_message, fora do outbox."""
+    outbox = []
+    token = app._OUTBOX.set(outbox)
+    try:
+        session = None
+        for step in script:
+            turn = app.Turn(session)
+            await app.run_turn(make_msg("5511999990000", *step), turn)
+            session = turn.session
+    finally:
+        app._OUTBOX.reset(token)
+    return len(script), len(outbox) + 1
+
+
+def check_parse() -> list:
+    """Casos de CASOS que o parse_lancamento erra (lista vazia = todos certos)."""
+    erros = []
+    for frase, esperado in CASOS:
+        got = app.parse_lancamento(frase)
+        if esperado is None:
+            if got is not None:
+                erros.append((frase, got))
+        elif got is None or any(got.get(k) != v for k, v in esperado.items()):
+            erros.append((frase, got))
+    return erros
+
+
+def bench_parse(rounds):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for frase in FRASES:
+            app.parse_lancamento(frase)
+    return (time.perf_counter() - t0) / (rounds * len(FRASES)) * 1e6
+
+
+def bench_payload(rounds):
+    rows = [{"id": f"cat_{c.lower().replace(' ', '_')}", "title": c} for c in app.CATEGORIAS_DESPESA]
+
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        rows = [{"id": f"cat_{c.lower().replace(' ', '_')}", "title": c} for c in app.CATEGORIAS_DESPESA]
+        payload = {"to": "5511999990000", **app._list_payload(
+            "Qual a CATEGORIA dessa despesa?", "Escolher", rows, section_title="Categoria")}
+        json.dumps(payload).encode()
+    dynamic = (time.perf_counter() - t0) / rounds * 1e6
+
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        app.MENU_CATEGORIA.render("5511999990000")
+    template = (time.perf_counter() - t0) / rounds * 1e6
+    return dynamic, template
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=2000)
+    args = ap.parse_args()
+
+    erros = check_parse()
+    for frase, got in erros:
+        print(f"parse_lancamento({frase!r}) errado: {got}")
+    if erros:
+        sys.exit(1)
+
+    print(f"despacho despesa: {asyncio.run(run_script(DESPESA, args.rounds)):8.2f} µs/mensagem")
+    print(f"despacho receita: {asyncio.run(run_script(RECEITA, args.rounds)):8.2f} µs/mensagem")
+    print(f"despacho despesa numa frase: {asyncio.run(run_script(DESPESA_TEXTO, args.rounds)):8.2f} µs/mensagem")
+    print(f"parse_lancamento: {bench_parse(args.rounds * 10):8.2f} µs/frase")
+    for name, wizard, texto in (("despesa", DESPESA, DESPESA_TEXTO), ("receita", RECEITA, RECEITA_TEXTO)):
+        (w_in, w_out), (t_in, t_out) = asyncio.run(exchanges(wizard)), asyncio.run(exchanges(texto))
+        print(f"{name} por lançamento: wizard {w_in} recebidas / {w_out} enviadas; "
+              f"frase {t_in} / {t_out} ({1 - t_out / w_out:.0%} menos chamadas ao Graph)")
+    dynamic, template = bench_payload(args.rounds * 10)
+    print(f"menu categorias montado + json.dumps: {dynamic:8.2f} µs")
+    print(f"menu categorias PayloadTemplate:      {template:8.2f} µs ({dynamic / template:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark: throughput de envios para a Graph API contra o mock local.
+
+Compara o caminho antigo (requests.post síncrono, um envio por vez, como
+acontecia dentro do webhook) com o cliente assíncrono com pool de conexões.
+
+Uso:
+    python bench/bench_graph_client.py [--sends 200] [--concurrency 20] [--latency-ms 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import requests
+
+import mock_graph
+
+PORT = 8099
+
+
+def bench_sync(n: int):
+    import app
+    t0 = time.perf_counter()
+    for i in range(n):
+        r = requests.post(app.wa_url(), headers=app.wa_headers(), json={"to": str(i), "type": "text"}, timeout=20)
+        r.raise_for_status()
+    return time.perf_counter() - t0
+
+
+async def bench_async(n: int, concurrency: int):
+    import app
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await app.send_whatsapp_text(str(i), "bench")
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - t0
+    await app.close_wa_client()
+    return elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sends", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    args = ap.parse_args()
+
+    os.environ["WA_GRAPH_BASE"] = f"http://127.0.0.1:{PORT}"
+    os.environ.setdefault("WA_PHONE_NUMBER_ID", "123")
+    os.environ.setdefault("WA_ACCESS_TOKEN", "bench")
+    mock_graph.start_in_thread(PORT, latency_ms=args.latency_ms)
+
+    t_sync = bench_sync(args.sends)
+    t_async = asyncio.run(bench_async(args.sends, args.concurrency))
+    print(f"sync  requests.post : {args.sends / t_sync:8.1f} envios/s ({t_sync:.2f}s)")
+    print(f"async pool (c={args.concurrency:<3d}): {args.sends / t_async:8.1f} envios/s ({t_async:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Harness: rajada de envios contra o mock do Graph com limite de vazão
+(throttle), comparando três configurações do cliente:
+- sem balde e sem retry (como era: o 429 vira erro no webhook)
+- sem balde, com retry (Retry-After / backoff com jitter)
+- balde por número abaixo do limite do servidor, com retry
+
+Mostra entregues, 429/503 vistos pelo servidor, tempo e WA_STATS.
+
+Uso:
+    python bench/bench_graph_throttle.py [--sends 300] [--throttle-rps 50] [--error-rate 0.02]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import mock_graph
+
+PORT = 8097
+
+
+async def burst(app, n: int):
+    async def one(i):
+        try:
+            return await app.send_whatsapp_text(f"55119{i:08d}", "bench") is not None
+        except Exception:
+            return False
+
+    t0 = time.perf_counter()
+    ok = await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - t0
+    await app.close_wa_client()
+    return sum(ok), elapsed
+
+
+def run(app, mock, label: str, n: int, rate: float, retries: int):
+    app.WA_RATE_PER_NUMBER = rate
+    app.WA_RETRY_MAX = retries
+    app._WA_NUMBER_BUCKETS.clear()
+    for k in app.WA_STATS:
+        app.WA_STATS[k] = 0
+    mock.state.rejected.clear()
+    time.sleep(1.0)  # balde do servidor cheio de novo
+
+    delivered, elapsed = asyncio.run(burst(app, n))
+    stats = {k: v for k, v in app.WA_STATS.items() if k not in ("waiting", "retrying")}
+    print(
+        f"{label:<24s} entregues={delivered:>4d}/{n}  servidor 429={mock.state.rejected[429]:>4d} "
+        f"503={mock.state.rejected[503]:>3d}  {elapsed:6.2f}s  {stats}"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sends", type=int, default=300)
+    ap.add_argument("--throttle-rps", type=float, default=50.0)
+    ap.add_argument("--retry-after", type=float, default=0.5)
+    ap.add_argument("--error-rate", type=float, default=0.02)
+    ap.add_argument("--latency-ms", type=float, default=5.0)
+    args = ap.parse_args()
+
+    os.environ["WA_GRAPH_BASE"] = f"http://127.0.0.1:{PORT}"
+    os.environ.setdefault("WA_PHONE_NUMBER_ID", "123")
+    os.environ.setdefault("WA_ACCESS_TOKEN", "bench")
+    os.environ.setdefault("WA_HTTP2", "0")
+    _, mock = mock_graph.start_in_thread(
+        PORT, latency_ms=args.latency_ms, throttle_rps=args.throttle_rps,
+        retry_after=args.retry_after, error_rate=args.error_rate,
+    )
+    import app
+
+    run(app, mock, "sem balde, sem retry", args.sends, 0, 0)
+    run(app, mock, "sem balde, com retry", args.sends, 0, 6)
+    run(app, mock, "balde 90% + retry", args.sends, args.throttle_rps * 0.9, 6)
+
+
+if __name__ == "__main__":
+    main()
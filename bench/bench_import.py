@@ -0,0 +1,126 @@
+"""
+Benchmark do import de extratos (import_statement): um extrato de --lines
+linhas (CSV no formato dos bancos, ou OFX) gerado em disco e importado
+contra o fake local do Sheets (bench/fake_sheets.py) rodando noutro processo,
+para não entrar na conta do tracemalloc.
+
+Para cada tamanho de lote (--batches) mede tempo, pico de memória e chamadas
+ao Sheets (leituras para as chaves de duplicata + values.append) de:
+
+1. import do extrato numa planilha vazia;
+2. o mesmo extrato de novo (tudo duplicata: nenhuma gravação).
+
+O tracemalloc deixa o import várias vezes mais lento; --no-trace mede só
+o tempo.
+
+Uso:
+    python bench/bench_import.py [--lines 50000] [--format csv|ofx] [--batches 50,5000] [--no-trace]
+"""
+import argparse
+import datetime as dt
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+PORT = 8098
+os.environ["GOOGLE_SHEETS_API_ENDPOINT"] = f"http://127.0.0.1:{PORT}"
+os.environ.pop("GOOGLE_APPLICATION_CREDENTIALS", None)
+os.environ.setdefault("SHEETS_QUOTA_PER_MINUTE", "100000")
+
+import app
+
+DESCRICOES = [
+    "COMPRA CARTAO MERCADO EXTRA", "PIX ENVIADO FULANO", "UBER TRANSPORTE", "IFOOD alimentacao",
+    "PAGTO CONTA LUZ moradia", "NETFLIX assinaturas", "FARMACIA saude", "PIX RECEBIDO salario",
+]
+
+
+def write_statement(path: str, lines: int, fmt: str, seed: int = 1):
+    rnd = random.Random(seed)
+    day0 = dt.date(2023, 1, 1)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if fmt == "ofx":
+            f.write("OFXHEADER:100\nDATA:OFXSGML\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><CURDEF>BRL\n<BANKTRANLIST>\n")
+        else:
+            f.write("Data;Descrição;Valor (R$);Saldo\n")
+        for i in range(lines):
+            d = day0 + dt.timedelta(days=i * 730 // lines)
+            desc = f"{rnd.choice(DESCRICOES)} {i % 997}"
+            v = rnd.randint(100, 500_000) / 100 * (1 if "RECEBIDO" in desc else -1)
+            if fmt == "ofx":
+                f.write(f"<STMTTRN><TRNTYPE>{'CREDIT' if v > 0 else 'DEBIT'}<DTPOSTED>{d:%Y%m%d}120000"
+                        f"<TRNAMT>{v:.2f}<FITID>{i}<MEMO>{desc}\n</STMTTRN>\n")
+            else:
+                f.write(f"{d:%d/%m/%Y};{desc};{v:_.2f}".replace(".", ",").replace("_", ".") + ";0,00\n")
+        if fmt == "ofx":
+            f.write("</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n")
+
+
+def run_import(path: str, fmt: str, batch_rows: int, trace: bool):
+    before = dict(app.SHEETS.stats)
+    job = app.ImportJob(os.path.basename(path), fmt, "default", os.path.getsize(path))
+    if trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    with open(path, "rb") as fh:
+        app.import_statement(fh, fmt, job, batch_rows)
+    elapsed = time.perf_counter() - t0
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    if job.state != "done":
+        raise SystemExit(f"import falhou: {job.error}")
+    calls = {k: app.SHEETS.stats[k] - before[k] for k in ("reads", "writes")}
+    return job.stats, elapsed, peak / 1e6, calls
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=50_000)
+    ap.add_argument("--format", choices=("csv", "ofx"), default="csv")
+    ap.add_argument("--batches", default="50,5000")
+    ap.add_argument("--trace", action=argparse.BooleanOptionalAction, default=True)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-import-")
+    path = os.path.join(tmp, f"extrato.{args.format}")
+    write_statement(path, args.lines, args.format)
+    print(f"{args.lines} linhas, {args.format}, {os.path.getsize(path) / 1e6:.1f} MB "
+          f"(chunk de leitura {app.SHEETS_CHUNK_ROWS})")
+
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_sheets.py"), "--port", str(PORT)])
+    try:
+        for _ in range(500):
+            try:
+                httpx.get(f"http://127.0.0.1:{PORT}/v4/spreadsheets/s/values/A1", timeout=0.5)
+                break
+            except httpx.TransportError:
+                time.sleep(0.02)
+        for n, batch_rows in enumerate(int(b) for b in args.batches.split(",")):
+            # planilha nova por tamanho de lote; header como o da planilha real
+            app.TENANTS.default.spreadsheet_id = sid = f"bench{n}"
+            httpx.post(f"http://127.0.0.1:{PORT}/v4/spreadsheets/{sid}/values/lancamentos!A1:L:append",
+                       json={"values": [[c.upper() for c in app.LEDGER_COLUMNS]]}).raise_for_status()
+            for label in ("planilha vazia", "de novo"):
+                stats, secs, peak, calls = run_import(path, args.format, batch_rows, args.trace)
+                print(f"  lote {batch_rows:5d} {label:14s} {secs:7.2f} s  pico {peak:6.1f} MB  "
+                      f"leituras {calls['reads']:3d}  appends {calls['writes']:4d}  "
+                      f"gravadas {stats['imported']:6d}  duplicadas {stats['duplicates']:6d}  "
+                      f"inválidas {stats['invalid']}")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: memória e tempo de iteração de list[dict] (formato antigo de
+read_all_rows) vs LedgerStore colunar, a partir da mesma matriz "values" do
+Sheets.
+
+Uso:
+    python bench/bench_ledger_store.py [--rows 200000]
+"""
+import argparse
+import datetime as dt
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app
+
+HEADERS = [
+    "ID", "TIMESTAMP", "TIPO", "VALOR", "MOEDA", "CATEGORIA", "DESCRIÇÃO",
+    "pagamento (pix/débito/crédito)", "Data", "confianca", "confirmado", "mensagem_original",
+]
+
+
+def make_values(n: int):
+    rnd = random.Random(7)
+    today = dt.date.today()
+    cats = app.CATEGORIAS_DESPESA + app.ORIGENS_RECEITA
+    out = [HEADERS]
+    for i in range(n):
+        d = today - dt.timedelta(days=rnd.randint(0, 1500))
+        out.append([
+            f"{i:08x}-0000-0000-0000-000000000000", "2024-01-01T00:00:00Z",
+            rnd.choice(("receita", "despesa")), f"{rnd.uniform(1, 5000):.2f}".replace(".", ","), "BRL",
+            rnd.choice(cats), f"descrição {i}", rnd.choice(app.PAGAMENTOS_DESPESA), d.isoformat(),
+            "0,6", "sim", f"mensagem original {i}",
+        ])
+    return out
+
+
+def measure(build):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    obj = build()
+    elapsed = (time.perf_counter() - t0) * 1000.0
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, elapsed, size / 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    args = ap.parse_args()
+
+    values = make_values(args.rows)
+
+    def build_dicts():
+        headers = [app._norm_header(h) for h in values[0]]
+        return app._rows_from_values(headers, values[1:])
+
+    def build_store():
+        _, pos = app._header_map(tuple(values[0]))
+        store = app.LedgerStore(pos)
+        store.extend(values[1:], 2)
+        return store
+
+    rows, t_dicts, mb_dicts = measure(build_dicts)
+    store, t_store, mb_store = measure(build_store)
+    # "values" continua vivo nos dois casos; o que conta é o que cada formato acrescenta
+    print(f"list[dict]  : build={t_dicts:8.1f}ms  memória extra={mb_dicts:8.1f}MB")
+    print(f"LedgerStore : build={t_store:8.1f}ms  memória extra={mb_store:8.1f}MB")
+
+    t0 = time.perf_counter()
+    total = sum(app._to_float(r["valor"]) for r in rows if r["tipo"] == "despesa")
+    t_iter_dicts = (time.perf_counter() - t0) * 1000.0
+    t0 = time.perf_counter()
+    code = app.TIPO_CODES["despesa"]
+    total2 = sum(v for v, t in zip(store.values, store.tipos) if t == code)
+    t_iter_store = (time.perf_counter() - t0) * 1000.0
+    assert abs(total - total2) < 1e-3
+    print(f"soma despesas: dicts={t_iter_dicts:7.1f}ms  store={t_iter_store:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark: resumo por varredura linha a linha sobre dicts (como
+build_resumo_text fazia) vs PeriodIndex (somas acumuladas por dia + busca
+binária) montado a partir do LedgerStore colunar.
+
+Uso:
+    python bench/bench_period_index.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import datetime as dt
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app
+
+KINDS = ["diario", "semanal", "mensal", "3m", "6m", "12m"]
+
+
+def make_rows(n: int, years: int = 5):
+    rnd = random.Random(42)
+    today = dt.date.today()
+    dates = [(today - dt.timedelta(days=i)).isoformat() for i in range(365 * years)]
+    cats = app.CATEGORIAS_DESPESA + app.ORIGENS_RECEITA
+    return [
+        {
+            "data": rnd.choice(dates),
+            "tipo": rnd.choice(("receita", "despesa", "despesa")),
+            "categoria": rnd.choice(cats),
+            "valor": f"{rnd.uniform(1, 5000):.2f}".replace(".", ","),
+        }
+        for _ in range(n)
+    ]
+
+
+def to_store(rows):
+    headers = ["data", "tipo", "categoria", "valor"]
+    _, pos = app._header_map(tuple(headers))
+    store = app.LedgerStore(pos)
+    store.extend([[r[h] for h in headers] for r in rows])
+    return store
+
+
+def scan_totals(rows, start, end):
+    total_rec = total_des = 0.0
+    rec_by_cat = defaultdict(float)
+    des_by_cat = defaultdict(float)
+    for r in rows:
+        d = app._parse_date_any(r.get("data"))
+        if not d or d < start or d > end:
+            continue
+        tipo = (r.get("tipo") or "").strip().lower()
+        cat = (r.get("categoria") or "Sem categoria").strip() or "Sem categoria"
+        val = abs(app._to_float(r.get("valor")))
+        if tipo == "receita":
+            total_rec += val
+            rec_by_cat[cat] += val
+        elif tipo == "despesa":
+            total_des += val
+            des_by_cat[cat] += val
+    return total_rec, total_des, rec_by_cat, des_by_cat
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - t0) * 1000.0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = ap.parse_args()
+
+    ranges = [app.get_period_range(k) for k in KINDS]
+    for n in args.sizes:
+        rows = make_rows(n)
+        scan_ms = sum(timed(scan_totals, rows, s, e)[1] for s, e in ranges) / len(ranges)
+        store, store_ms = timed(to_store, rows)
+        idx, build_ms = timed(app.PeriodIndex.from_store, store)
+
+        t0 = time.perf_counter()
+        reps = 1000
+        for _ in range(reps):
+            for s, e in ranges:
+                idx.totals(s, e)
+        query_ms = (time.perf_counter() - t0) * 1000.0 / (reps * len(ranges))
+
+        today = dt.date.today().toordinal()
+        _, add_ms = timed(idx.add, today, "despesa", "Mercado", 10.0)
+        print(
+            f"n={n:>9,d}  varredura/período={scan_ms:9.1f}ms  "
+            f"store={store_ms:8.1f}ms  índice: build={build_ms:8.1f}ms  consulta={query_ms * 1000:7.1f}µs  add(hoje)={add_ms * 1000:6.1f}µs"
+        )
+
+
+if __name__ == "__main__":
+    main()
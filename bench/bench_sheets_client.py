@@ -0,0 +1,98 @@
+"""
+Benchmark: custo por chamada para obter o cliente do Sheets.
+
+Antes: cada append_row/read_all_rows lia o JSON da service account, criava
+Credentials, buscava token e rodava build("sheets", "v4").
+Depois: _sheets_service() reaproveita credenciais e service por thread.
+
+Roda offline: gera uma service account descartável e simula o token fetch com
+uma latência fixa (--token-ms), já que sem rede não dá para medir o real.
+
+Uso:
+    python bench/bench_sheets_client.py [--calls 50] [--token-ms 150]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
+
+import app
+
+
+def _fake_service_account():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    info = {
+        "type": "service_account",
+        "project_id": "bench",
+        "private_key_id": "bench",
+        "private_key": pem,
+        "client_email": "bench@bench.iam.gserviceaccount.com",
+        "client_id": "1",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }
+    f = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    json.dump(info, f)
+    f.close()
+    return f.name
+
+
+def _patch_refresh(token_ms: float):
+    def refresh(self, request):
+        time.sleep(token_ms / 1000.0)
+        self.token = "bench-token"
+        self.expiry = app.dt.datetime.utcnow() + app.dt.timedelta(hours=1)
+    Credentials.refresh = refresh
+
+
+def old_service():
+    creds = Credentials.from_service_account_file(os.environ["GOOGLE_APPLICATION_CREDENTIALS"], scopes=app.SCOPES)
+    creds.refresh(None)
+    return build("sheets", "v4", credentials=creds)
+
+
+def measure(fn, calls: int):
+    out = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000.0)
+    return out
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:8s} média={statistics.mean(samples):8.2f}ms  p50={statistics.median(samples):8.2f}ms  p95={p95:8.2f}ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=50)
+    ap.add_argument("--token-ms", type=float, default=150.0)
+    args = ap.parse_args()
+
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = _fake_service_account()
+    _patch_refresh(args.token_ms)
+
+    report("antes", measure(old_service, args.calls))
+    app.reset_sheets_service()
+    report("depois", measure(app._sheets_service, args.calls))
+
+
+if __name__ == "__main__":
+    main()
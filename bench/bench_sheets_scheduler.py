@@ -0,0 +1,161 @@
+"""
+Harness do SheetsScheduler contra o fake local do Sheets (bench/fake_sheets.py),
+com a janela de cota encurtada para rodar em segundos:
+
+1. cota + prioridade: uma fila de leituras passa da cota e gravações chegam
+   depois; as gravações devem sair antes das leituras que estavam esperando,
+   sem nenhum 429 no servidor.
+2. coalescência: várias leituras idênticas ao mesmo tempo viram uma chamada.
+3. 503 intermitente: leituras são refeitas com backoff até darem certo.
+
+Cada parte confere o que espera; qualquer falha sai com código 1.
+
+Uso:
+    python bench/bench_sheets_scheduler.py [--quota 20] [--window 4]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import fake_sheets
+
+PORT = 8096
+SID = "bench"
+
+
+def in_threads(pool, fns, spacing: float = 0.002):
+    """
+    Roda fns no pool (threads com o service já montado), uma a cada spacing
+    segundos; devolve (status, segundos desde o submit).
+    """
+    def run(fn, t0):
+        try:
+            fn()
+            return "ok", time.perf_counter() - t0
+        except Exception as e:
+            return repr(e), time.perf_counter() - t0
+
+    futures = []
+    for fn in fns:
+        futures.append(pool.submit(run, fn, time.perf_counter()))
+        time.sleep(spacing)
+    return [f.result() for f in futures]
+
+
+def warm_pool(app, workers: int):
+    """Um service por thread, montado antes de medir (como nos workers do app)."""
+    pool = ThreadPoolExecutor(max_workers=workers)
+    barrier = threading.Barrier(workers)
+
+    def warm():
+        app._sheets_service()
+        barrier.wait()
+
+    for f in [pool.submit(warm) for _ in range(workers)]:
+        f.result()
+    return pool
+
+
+def read_cell(app, row):
+    rng = f"lancamentos!A{row}"
+    return lambda: app.SHEETS.read(
+        ("get", SID, rng), lambda svc: svc.spreadsheets().values().get(spreadsheetId=SID, range=rng)
+    )
+
+
+def append(app, i):
+    row = [f"id{i}", "t", "despesa", "-1", "BRL", "Mercado", "x", "pix", "2026-01-01", "0.6", "sim", ""]
+    return lambda: app.SHEETS.write(
+        lambda svc: svc.spreadsheets().values().append(
+            spreadsheetId=SID, range="lancamentos!A1:L", valueInputOption="USER_ENTERED",
+            insertDataOption="INSERT_ROWS", body={"values": [row]},
+        )
+    )
+
+
+def check(failures: list, ok: bool, what: str):
+    if not ok:
+        failures.append(what)
+        print("    FALHOU:", what)
+
+
+def reset(app, fake, quota, window):
+    app.SHEETS = app.SheetsScheduler(quota, window)
+    fake.state.calls.clear()
+    fake.state.rejected.clear()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--quota", type=int, default=20)
+    ap.add_argument("--window", type=float, default=4.0)
+    args = ap.parse_args()
+
+    _, fake = fake_sheets.start_in_thread(PORT, latency_ms=20, quota_per_minute=args.quota, quota_window=args.window)
+    os.environ["GOOGLE_SHEETS_API_ENDPOINT"] = f"http://127.0.0.1:{PORT}"
+    os.environ.pop("GOOGLE_APPLICATION_CREDENTIALS", None)
+    import app
+    pool = warm_pool(app, 64)
+    failures = []
+
+    # 1. cota + prioridade
+    reset(app, fake, args.quota, args.window)
+    n_reads = args.quota * 2
+    fns = [read_cell(app, 1000 + i) for i in range(n_reads)] + [append(app, i) for i in range(5)]
+    res = in_threads(pool, fns)
+    reads, writes = res[:n_reads], res[n_reads:]
+    # as que passaram de read_limit tiveram de esperar a janela andar
+    waited = sorted(t for _, t in reads)[app.SHEETS.read_limit:]
+    last_write = max(t for _, t in writes)
+    print(
+        f"[cota] {n_reads} leituras + 5 gravações, cota {args.quota}/{args.window:g}s: "
+        f"erros={sum(1 for s, _ in res if s != 'ok')} 429 no servidor={fake.state.rejected[429]} "
+        f"gravações em até {last_write:.2f}s; das {len(waited)} leituras que esperaram cota, "
+        f"{sum(1 for t in waited if t > last_write)} saíram depois das gravações"
+    )
+    print("       ", app.SHEETS.snapshot(), {s for s, _ in res if s != "ok"} or "")
+    check(failures, all(s == "ok" for s, _ in res), "cota: todas as chamadas dão certo")
+    check(failures, fake.state.rejected[429] == 0, "cota: nenhum 429 no servidor")
+    check(failures, len(waited) > 0, "cota: leituras passaram do read_limit e esperaram")
+    check(failures, all(t > last_write for t in waited), "prioridade: gravações antes das leituras em espera")
+
+    # 2. coalescência
+    time.sleep(args.window)
+    reset(app, fake, args.quota, args.window)
+    res = in_threads(pool, [read_cell(app, 5)] * 15, spacing=0)
+    print(
+        f"[coalescência] 15 leituras iguais: chamadas no servidor={sum(fake.state.calls.values())} "
+        f"coalesced={app.SHEETS.stats['coalesced']} erros={sum(1 for s, _ in res if s != 'ok')}"
+    )
+    check(failures, all(s == "ok" for s, _ in res), "coalescência: todas as leituras dão certo")
+    check(failures, sum(fake.state.calls.values()) == 1, "coalescência: uma chamada no servidor")
+    check(failures, app.SHEETS.stats["coalesced"] == 14, "coalescência: 14 leituras aproveitadas")
+
+    # 3. 503 intermitente
+    time.sleep(args.window)
+    _, flaky = fake_sheets.start_in_thread(PORT + 1, error_rate=0.4)
+    app.SHEETS_API_ENDPOINT = f"http://127.0.0.1:{PORT + 1}"
+    app.reset_sheets_service()
+    pool = warm_pool(app, 64)
+    app.SHEETS_RETRY_BASE = 0.05
+    app.SHEETS = app.SheetsScheduler(1000, args.window)
+    res = in_threads(pool, [read_cell(app, 100 + i) for i in range(20)])
+    print(
+        f"[503] 20 leituras com 40% de 503: ok={sum(1 for s, _ in res if s == 'ok')} "
+        f"503 no servidor={flaky.state.rejected[503]} {app.SHEETS.snapshot()}"
+    )
+    check(failures, all(s == "ok" for s, _ in res), "503: todas as leituras dão certo depois dos retries")
+    check(failures, flaky.state.rejected[503] > 0, "503: o servidor recusou alguma chamada")
+    check(failures, app.SHEETS.stats["retries"] >= flaky.state.rejected[503], "503: cada recusa foi refeita")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
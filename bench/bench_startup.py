@@ -0,0 +1,121 @@
+"""
+Tempo de partida a frio do app, cada medida num processo Python novo:
+
+1. import: `import app` (mediana de --runs processos) e os módulos de topo
+   mais caros segundo o -X importtime.
+2. primeiro GET /: do spawn do uvicorn até a primeira resposta 200.
+3. primeira chamada ao Sheets: um values.get contra o fake local
+   (bench/fake_sheets.py), incluindo montar o service a partir do discovery.
+
+Uso:
+    python bench/bench_startup.py [--runs 7]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_sheets
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+APP_PORT = 8093
+SHEETS_PORT = 8094
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+SHEETS_SNIPPET = """
+import time
+t = time.perf_counter()
+import app
+t_import = time.perf_counter() - t
+t = time.perf_counter()
+app.SHEETS.read(("get", "s", "lancamentos!A1:L"), lambda svc: svc.spreadsheets().values().get(
+    spreadsheetId="s", range="lancamentos!A1:L"))
+print(t_import, time.perf_counter() - t)
+"""
+
+
+def clean_env(tmp: str) -> dict:
+    env = {k: v for k, v in os.environ.items() if k != "GOOGLE_APPLICATION_CREDENTIALS"}
+    env.update({
+        "GOOGLE_SHEETS_API_ENDPOINT": f"http://127.0.0.1:{SHEETS_PORT}",
+        "GOOGLE_SHEETS_SPREADSHEET_ID": "s",
+        "LEDGER_JOURNAL_PATH": os.path.join(tmp, "ledger_journal.jsonl"),
+        "TRACE_PATH": os.path.join(tmp, "traces.jsonl"),
+    })
+    return env
+
+
+def run_py(code: str, env: dict) -> str:
+    return subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env=env, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def top_imports(env: dict, n: int = 8):
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=env,
+        check=True, capture_output=True, text=True,
+    ).stderr
+    rows = []
+    for line in err.splitlines():
+        parts = line.split("|")
+        # módulos importados direto pelo app: dois espaços de indentação
+        if len(parts) == 3 and parts[2].startswith("   ") and not parts[2].startswith("    "):
+            try:
+                rows.append((int(parts[1]) / 1000.0, parts[2].strip()))
+            except ValueError:
+                pass
+    return sorted(rows, reverse=True)[:n]
+
+
+def first_response(env: dict) -> float:
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(APP_PORT), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{APP_PORT}/", timeout=0.5).status_code == 200:
+                    return time.perf_counter() - t0
+            except httpx.TransportError:
+                pass
+            if proc.poll() is not None:
+                raise RuntimeError("uvicorn saiu antes de responder")
+            time.sleep(0.005)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=7)
+    args = ap.parse_args()
+
+    fake_sheets.start_in_thread(SHEETS_PORT)
+    env = clean_env(tempfile.mkdtemp(prefix="bench-startup-"))
+
+    imports = [float(run_py(IMPORT_SNIPPET, env)) * 1000 for _ in range(args.runs)]
+    print(f"import app:            mediana {statistics.median(imports):7.1f} ms  (min {min(imports):.1f})")
+    for ms, mod in top_imports(env):
+        print(f"    {mod:32s} {ms:7.1f} ms")
+
+    firsts = [first_response(env) * 1000 for _ in range(args.runs)]
+    print(f"spawn -> primeiro GET /: mediana {statistics.median(firsts):7.1f} ms  (min {min(firsts):.1f})")
+
+    calls = [tuple(float(x) * 1000 for x in run_py(SHEETS_SNIPPET, env).split()) for _ in range(args.runs)]
+    print(f"primeira chamada Sheets: mediana {statistics.median(c[1] for c in calls):7.1f} ms "
+          f"(import antes: {statistics.median(c[0] for c in calls):.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Confere a deduplicação de reentregas do webhook (SeenMessages) ponta a ponta,
+com os mesmos stand-ins do loadtest_e2e (bench/mock_graph.py e
+bench/fake_sheets.py) e o app num subprocesso uvicorn.
+
+Uma despesa completa (do "oi" ao "SIM") é mandada com cada entrega repetida
+como a Meta faz em timeout: o mesmo corpo, com o mesmo msg["id"], duas vezes
+em paralelo. Depois da confirmação a conversa inteira é reentregue mais uma
+vez. O esperado é uma resposta por mensagem, um único MSG_SALVO e uma única
+linha na planilha; qualquer diferença sai com código 1.
+
+Com --workers 2 os workers uvicorn dividem o DEDUPE_DB, e a reentrega pode
+cair no worker que não viu a primeira.
+
+Uso:
+    python bench/check_dedupe.py [--workers 1] [--ledger sheets|sqlite]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_sheets
+import mock_graph
+import webhook_payloads
+from loadtest_e2e import body_text
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+GRAPH_PORT = 8089
+SHEETS_PORT = 8088
+APP_PORT = 8012
+SPREADSHEET_ID = "dedupe"
+NUMBER = "5511900000001"
+SALVO = "Show, já registrei"
+QUIET_SECONDS = 1.5   # tempo sem respostas novas depois das reentregas
+
+
+def wait_ready(timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{APP_PORT}/", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("app não subiu")
+
+
+async def deliver(client, body: dict, times: int) -> list:
+    url = f"http://127.0.0.1:{APP_PORT}/webhook"
+    return [r.status_code for r in await asyncio.gather(*(client.post(url, json=body) for _ in range(times)))]
+
+
+async def drive(mock, failures: list) -> list:
+    steps = webhook_payloads.despesa(random.Random(1))
+    replies = mock.state.by_to[NUMBER]
+    bodies = []
+    async with httpx.AsyncClient(timeout=30) as client:
+        for step in steps:
+            body = webhook_payloads.webhook_body(NUMBER, step.message)
+            bodies.append(body)
+            seen = len(replies)
+            codes = await deliver(client, body, 2)
+            if codes != [200, 200]:
+                failures.append(f"HTTP {codes} na entrega de {step.expect[0]!r}")
+                return bodies
+            deadline = time.monotonic() + 15
+            while len(replies) < seen + len(step.expect) and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+            got = [body_text(p) for p in replies[seen:]]
+            if len(got) != len(step.expect) or not all(t.startswith(e) for t, e in zip(got, step.expect)):
+                failures.append(f"esperava {step.expect} e recebeu {got}")
+                return bodies
+        # a Meta reentrega a conversa inteira, "SIM" inclusive
+        seen = len(replies)
+        for body in bodies:
+            await deliver(client, body, 1)
+        await asyncio.sleep(QUIET_SECONDS)
+        if len(replies) != seen:
+            failures.append(f"reentrega gerou respostas: {[body_text(p) for p in replies[seen:]]}")
+    return bodies
+
+
+def wait_rows(sheets, timeout: float = 15.0) -> int:
+    """Espera o journal descarregar e mais um pouco, para pegar uma linha repetida."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and len(sheets.state.grids[SPREADSHEET_ID]) < 2:
+        time.sleep(0.1)
+    time.sleep(QUIET_SECONDS)
+    return len(sheets.state.grids[SPREADSHEET_ID]) - 1
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--ledger", choices=("sheets", "sqlite"), default="sheets")
+    args = ap.parse_args()
+
+    _, mock = mock_graph.start_in_thread(GRAPH_PORT, latency_ms=5)
+    _, sheets = fake_sheets.start_in_thread(SHEETS_PORT, latency_ms=5)
+    tmp = tempfile.mkdtemp(prefix="check-dedupe-")
+    env = {k: v for k, v in os.environ.items() if k != "GOOGLE_APPLICATION_CREDENTIALS"}
+    env.update({
+        "WA_GRAPH_BASE": f"http://127.0.0.1:{GRAPH_PORT}",
+        "WA_PHONE_NUMBER_ID": webhook_payloads.PHONE_NUMBER_ID,
+        "WA_ACCESS_TOKEN": "dedupe",
+        "WA_HTTP2": "0",
+        "ALLOWED_WA_NUMBER": "",
+        "GOOGLE_SHEETS_SPREADSHEET_ID": SPREADSHEET_ID,
+        "GOOGLE_SHEETS_API_ENDPOINT": f"http://127.0.0.1:{SHEETS_PORT}",
+        "SHEETS_QUOTA_PER_MINUTE": "100000",
+        "SESSION_BACKEND": "sqlite" if args.workers > 1 else "memory",
+        "SESSION_DB": os.path.join(tmp, "sessions.db"),
+        "DEDUPE_DB": os.path.join(tmp, "dedupe.db"),
+        "LEDGER_JOURNAL_PATH": os.path.join(tmp, "ledger_journal.jsonl"),
+        "LEDGER_BACKEND": args.ledger,
+        "LEDGER_DB": os.path.join(tmp, "ledger.db"),
+    })
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(APP_PORT),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    failures = []
+    try:
+        wait_ready()
+        bodies = asyncio.run(drive(mock, failures))
+        rows = wait_rows(sheets)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+    salvos = sum(body_text(p).startswith(SALVO) for p in mock.state.by_to[NUMBER])
+    print(f"{len(bodies)} mensagens, cada uma entregue 3 vezes: "
+          f"{len(mock.state.by_to[NUMBER])} respostas, {salvos} MSG_SALVO, {rows} linha(s) na planilha")
+    if salvos != 1:
+        failures.append(f"{salvos} MSG_SALVO (esperado 1)")
+    if rows != 1:
+        failures.append(f"{rows} linhas gravadas (esperado 1)")
+    for f in failures:
+        print("FALHOU:", f)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
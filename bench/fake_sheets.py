@@ -0,0 +1,169 @@
+"""
+Fake local da Google Sheets API v4, só o que o app usa:
+    GET  /v4/spreadsheets/{id}/values/{range}
+    GET  /v4/spreadsheets/{id}/values:batchGet?ranges=...
+    POST /v4/spreadsheets/{id}/values/{range}:append
+
+Uma planilha em memória por id (as abas são ignoradas: todas as faixas caem
+na mesma grade). Com quota_per_minute > 0 recusa com 429 o que passar da cota
+numa janela deslizante de quota_window segundos (60 por padrão); error_rate devolve 503 numa fração aleatória
+dos pedidos; latency_ms atrasa cada resposta.
+
+Uso standalone:
+    python bench/fake_sheets.py --port 8095 --quota-per-minute 60
+e no app:
+    GOOGLE_SHEETS_API_ENDPOINT=http://127.0.0.1:8095
+"""
+import argparse
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import defaultdict, deque
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+HEADERS = [
+    "ID", "TIMESTAMP", "TIPO", "VALOR", "MOEDA", "CATEGORIA", "DESCRIÇÃO",
+    "pagamento (pix/débito/crédito)", "Data", "confianca", "confirmado", "mensagem_original",
+]
+
+_RANGE_RE = re.compile(r"^(?:(.+)!)?([A-Za-z]+)(\d*)(?::([A-Za-z]+)(\d*))?$")
+
+
+def _col(letters: str) -> int:
+    n = 0
+    for ch in letters.upper():
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+def _letters(n: int) -> str:
+    out = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        out = chr(65 + r) + out
+    return out
+
+
+def parse_range(rng: str):
+    """(aba, col0, row0, col1, row1) com colunas 1-based; row1 None = até o fim."""
+    m = _RANGE_RE.match(rng)
+    if not m:
+        raise ValueError(rng)
+    sheet, c0, r0, c1, r1 = m.groups()
+    c1 = c1 or c0
+    r0 = int(r0) if r0 else 1
+    r1 = int(r1) if r1 else (r0 if not m.group(4) and m.group(3) else None)
+    return sheet, _col(c0), r0, _col(c1), r1
+
+
+def create_app(latency_ms: float = 0.0, quota_per_minute: int = 0, error_rate: float = 0.0, quota_window: float = 60.0):
+    fake = FastAPI()
+    fake.state.grids = defaultdict(lambda: [list(HEADERS)])
+    fake.state.calls = defaultdict(int)
+    fake.state.rejected = defaultdict(int)
+    window = deque()
+
+    def gate(kind: str):
+        fake.state.calls[kind] += 1
+        now = time.monotonic()
+        while window and now - window[0] >= quota_window:
+            window.popleft()
+        if quota_per_minute and len(window) >= quota_per_minute:
+            fake.state.rejected[429] += 1
+            return JSONResponse(
+                {"error": {"code": 429, "message": "Quota exceeded", "status": "RESOURCE_EXHAUSTED"}},
+                status_code=429,
+            )
+        window.append(now)
+        if error_rate and random.random() < error_rate:
+            fake.state.rejected[503] += 1
+            return JSONResponse({"error": {"code": 503, "message": "unavailable", "status": "UNAVAILABLE"}}, status_code=503)
+        return None
+
+    def read(grid: list, rng: str) -> dict:
+        sheet, c0, r0, c1, r1 = parse_range(rng)
+        rows = grid[r0 - 1: r1 if r1 is not None else len(grid)]
+        values = [[str(v) for v in row[c0 - 1: c1]] for row in rows]
+        while values and not any(values[-1]):
+            values.pop()
+        out = {"range": rng, "majorDimension": "ROWS"}
+        if values:
+            out["values"] = values
+        return out
+
+    async def delay():
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000.0)
+
+    @fake.get("/v4/spreadsheets/{sid}/values:batchGet")
+    async def batch_get(sid: str, req: Request):
+        await delay()
+        denied = gate("batchGet")
+        if denied:
+            return denied
+        grid = fake.state.grids[sid]
+        return {"spreadsheetId": sid, "valueRanges": [read(grid, r) for r in req.query_params.getlist("ranges")]}
+
+    @fake.get("/v4/spreadsheets/{sid}/values/{rng:path}")
+    async def get(sid: str, rng: str):
+        await delay()
+        denied = gate("get")
+        if denied:
+            return denied
+        return read(fake.state.grids[sid], rng)
+
+    @fake.post("/v4/spreadsheets/{sid}/values/{rng:path}")
+    async def append(sid: str, rng: str, req: Request):
+        await delay()
+        if not rng.endswith(":append"):
+            return JSONResponse({"error": {"code": 404, "message": "not found"}}, status_code=404)
+        denied = gate("append")
+        if denied:
+            return denied
+        sheet, c0, _, _, _ = parse_range(rng[: -len(":append")])
+        grid = fake.state.grids[sid]
+        rows = (await req.json()).get("values") or []
+        first = len(grid) + 1
+        grid.extend([[str(v) for v in row] for row in rows])
+        last = len(grid)
+        width = max((len(r) for r in rows), default=1)
+        prefix = f"{sheet}!" if sheet else ""
+        updated = f"{prefix}{_letters(c0)}{first}:{_letters(c0 + width - 1)}{last}"
+        return {
+            "spreadsheetId": sid,
+            "updates": {"updatedRange": updated, "updatedRows": len(rows), "updatedCells": len(rows) * width},
+        }
+
+    return fake
+
+
+def start_in_thread(port: int = 8095, **kwargs):
+    """Sobe o fake num thread daemon e devolve (server, app) quando estiver ouvindo."""
+    fake = create_app(**kwargs)
+    server = uvicorn.Server(uvicorn.Config(fake, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, fake
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8095)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--quota-per-minute", type=int, default=0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    fake = create_app(
+        latency_ms=args.latency_ms, quota_per_minute=args.quota_per_minute, error_rate=args.error_rate,
+    )
+    uvicorn.run(fake, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Teste de carga ponta a ponta do POST /webhook com stand-ins locais do Graph
+(bench/mock_graph.py) e do Sheets (bench/fake_sheets.py).
+
+O app roda num subprocesso uvicorn apontado para os dois fakes. Cada número
+simulado encadeia conversas sorteadas por bench/webhook_payloads.py (despesa,
+receita, resumo, cancelamento), mandando a próxima mensagem só depois de
+receber todas as respostas da anterior. Mede a latência mensagem -> última
+resposta, o throughput e as chamadas de saída (Graph e Sheets) por lançamento
+gravado, e confere que cada lançamento confirmado chegou à planilha.
+
+O resultado pode ser salvo como baseline JSON e comparado nas rodadas seguintes:
+    python bench/loadtest_e2e.py --users 40 --conversations 5 --save-baseline
+    python bench/loadtest_e2e.py --users 40 --conversations 5   # compara
+
+Uso:
+    python bench/loadtest_e2e.py [--users 40] [--conversations 5] [--workers 1]
+        [--graph-latency-ms 20] [--sheets-latency-ms 60] [--baseline bench/baseline_e2e.json]
+        [--save-baseline] [--tolerance 0.25] [--ledger sheets|sqlite] [--free-text]
+
+--free-text troca despesas e receitas do wizard pelas escritas numa frase
+(webhook_payloads.MIX_TEXTO); compare graph_calls_per_tx com o baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_sheets
+import mock_graph
+import webhook_payloads
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+GRAPH_PORT = 8099
+SHEETS_PORT = 8095
+APP_PORT = 8011
+SPREADSHEET_ID = "load"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline_e2e.json")
+
+
+def body_text(payload: dict) -> str:
+    if payload.get("type") == "text":
+        return payload["text"]["body"]
+    return payload["interactive"]["body"]["text"]
+
+
+def percentile(sorted_vals: list, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * q))]
+
+
+async def run_user(client, mock, number: str, conversations: int, seed: int, out: dict):
+    rnd = random.Random(seed)
+    replies = mock.state.by_to[number]
+    for _ in range(conversations):
+        for step in webhook_payloads.conversation(rnd):
+            seen = len(replies)
+            t0 = time.perf_counter()
+            r = await client.post(
+                f"http://127.0.0.1:{APP_PORT}/webhook", json=webhook_payloads.webhook_body(number, step.message)
+            )
+            if r.status_code != 200:
+                out["errors"].append(f"{number}: HTTP {r.status_code}")
+                return
+            deadline = time.monotonic() + 30
+            while len(replies) < seen + len(step.expect):
+                if time.monotonic() > deadline:
+                    out["errors"].append(f"{number}: sem resposta para {step.expect[0]!r}")
+                    return
+                await asyncio.sleep(0.003)
+            out["latencies"].append((time.perf_counter() - t0) * 1000.0)
+            got = sorted(body_text(p) for p in replies[seen:])
+            if not all(any(g.startswith(e) for g in got) for e in step.expect):
+                out["errors"].append(f"{number}: esperava {step.expect}, veio {[g[:30] for g in got]}")
+                return
+            out["messages"] += 1
+            if step.confirms:
+                out["confirmed"] += 1
+
+
+def wait_ready(timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{APP_PORT}/", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("app não subiu")
+
+
+async def drive(args, mock) -> dict:
+    out = {"latencies": [], "errors": [], "messages": 0, "confirmed": 0}
+    limits = httpx.Limits(max_connections=args.users)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            run_user(client, mock, f"55119{u:07d}", args.conversations, args.seed + u, out)
+            for u in range(args.users)
+        ))
+        out["elapsed"] = time.perf_counter() - t0
+    return out
+
+
+def wait_rows(sheets, expected: int, timeout: float = 15.0) -> int:
+    """Espera o journal descarregar os lançamentos confirmados na planilha."""
+    deadline = time.monotonic() + timeout
+    rows = 0
+    while time.monotonic() < deadline:
+        rows = len(sheets.state.grids[SPREADSHEET_ID]) - 1
+        if rows >= expected:
+            break
+        time.sleep(0.1)
+    return rows
+
+
+def summarize(args, out: dict, mock, sheets, rows: int) -> dict:
+    lat = sorted(out["latencies"])
+    graph_calls = len(mock.state.received) + sum(mock.state.rejected.values())
+    sheets_calls = sum(sheets.state.calls.values())
+    confirmed = max(1, out["confirmed"])
+    return {
+        "config": {
+            "users": args.users, "conversations": args.conversations, "workers": args.workers,
+            "graph_latency_ms": args.graph_latency_ms, "sheets_latency_ms": args.sheets_latency_ms,
+            "seed": args.seed, "free_text": args.free_text,
+            "python": platform.python_version(), "cpus": os.cpu_count(),
+        },
+        "messages": out["messages"],
+        "confirmed": out["confirmed"],
+        "rows_in_sheet": rows,
+        "errors": len(out["errors"]),
+        "elapsed_s": round(out["elapsed"], 3),
+        "throughput_msg_s": round(out["messages"] / out["elapsed"], 2) if out["elapsed"] else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(lat, 0.50), 2),
+            "p95": round(percentile(lat, 0.95), 2),
+            "p99": round(percentile(lat, 0.99), 2),
+            "max": round(lat[-1], 2) if lat else 0.0,
+        },
+        "graph_calls": graph_calls,
+        "sheets_calls": dict(sheets.state.calls),
+        "graph_calls_per_tx": round(graph_calls / confirmed, 2),
+        "sheets_calls_per_tx": round(sheets_calls / confirmed, 2),
+    }
+
+
+def report(result: dict):
+    lat = result["latency_ms"]
+    print(
+        f"mensagens={result['messages']} lançamentos={result['confirmed']} (planilha: {result['rows_in_sheet']}) "
+        f"erros={result['errors']} tempo={result['elapsed_s']:.2f}s"
+    )
+    print(f"throughput: {result['throughput_msg_s']:.1f} msg/s")
+    print(f"latência msg->última resposta: p50={lat['p50']:.1f}ms p95={lat['p95']:.1f}ms p99={lat['p99']:.1f}ms max={lat['max']:.1f}ms")
+    print(
+        f"chamadas de saída por lançamento: Graph={result['graph_calls_per_tx']:.2f} "
+        f"Sheets={result['sheets_calls_per_tx']:.2f} {result['sheets_calls']}"
+    )
+
+
+# métrica -> True se maior é melhor
+COMPARED = {
+    ("throughput_msg_s",): True,
+    ("latency_ms", "p50"): False,
+    ("latency_ms", "p95"): False,
+    ("latency_ms", "p99"): False,
+    ("graph_calls_per_tx",): False,
+    ("sheets_calls_per_tx",): False,
+}
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    print(f"\ncomparação com o baseline ({baseline['config']}):")
+    for path, higher_better in COMPARED.items():
+        old, new = baseline, result
+        for k in path:
+            old, new = old[k], new[k]
+        delta = (new - old) / old if old else 0.0
+        worse = -delta if higher_better else delta
+        flag = "  <-- regressão" if worse > tolerance else ""
+        print(f"  {'.'.join(path):<22s} {old:>10.2f} -> {new:>10.2f} ({delta:+.1%}){flag}")
+        if flag:
+            regressions.append(".".join(path))
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=40)
+    ap.add_argument("--conversations", type=int, default=5)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--graph-latency-ms", type=float, default=20.0)
+    ap.add_argument("--sheets-latency-ms", type=float, default=60.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--ledger", choices=("sheets", "sqlite"), default="sheets")
+    ap.add_argument("--free-text", action="store_true")
+    args = ap.parse_args()
+    if args.free_text:
+        webhook_payloads.MIX = webhook_payloads.MIX_TEXTO
+
+    _, mock = mock_graph.start_in_thread(GRAPH_PORT, latency_ms=args.graph_latency_ms)
+    _, sheets = fake_sheets.start_in_thread(SHEETS_PORT, latency_ms=args.sheets_latency_ms)
+    tmp = tempfile.mkdtemp(prefix="loadtest-e2e-")
+    env = {
+        k: v for k, v in os.environ.items() if k != "GOOGLE_APPLICATION_CREDENTIALS"
+    }
+    env.update({
+        "WA_GRAPH_BASE": f"http://127.0.0.1:{GRAPH_PORT}",
+        "WA_PHONE_NUMBER_ID": webhook_payloads.PHONE_NUMBER_ID,
+        "WA_ACCESS_TOKEN": "load",
+        "WA_HTTP2": "0",
+        "ALLOWED_WA_NUMBER": "",
+        "GOOGLE_SHEETS_SPREADSHEET_ID": SPREADSHEET_ID,
+        "GOOGLE_SHEETS_API_ENDPOINT": f"http://127.0.0.1:{SHEETS_PORT}",
+        "SHEETS_QUOTA_PER_MINUTE": "100000",
+        "SESSION_BACKEND": "sqlite" if args.workers > 1 else "memory",
+        "SESSION_DB": os.path.join(tmp, "sessions.db"),
+        "DEDUPE_DB": os.path.join(tmp, "dedupe.db"),
+        "LEDGER_JOURNAL_PATH": os.path.join(tmp, "ledger_journal.jsonl"),
+        "LEDGER_BACKEND": args.ledger,
+        "LEDGER_DB": os.path.join(tmp, "ledger.db"),
+    })
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(APP_PORT),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready()
+        out = asyncio.run(drive(args, mock))
+        rows = wait_rows(sheets, out["confirmed"])
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+    result = summarize(args, out, mock, sheets, rows)
+    report(result)
+    for e in out["errors"][:10]:
+        print("  ", e)
+
+    failed = bool(out["errors"]) or rows != out["confirmed"]
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\nbaseline salvo em {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            failed |= bool(compare(result, json.load(f), args.tolerance))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Teste de carga multi-tenant: o mesmo tráfego (N números, cada um encadeando
+conversas de bench/webhook_payloads.py) contra
+
+- "compartilhada": o modo antigo, todos os números na mesma planilha
+  (um espelho, um cache de resumos, uma cota de --tenant-quota chamadas);
+- "tenants": TENANTS_FILE com um tenant por número, cada um com a própria
+  planilha e a própria cota de --tenant-quota chamadas.
+
+Para cada N de --tenants sobe o app num subprocesso uvicorn apontado para os
+fakes do Graph e do Sheets (os mesmos do loadtest_e2e) e mede throughput,
+latência e chamadas ao Sheets. O tráfego é puxado para resumos (3 para 1
+despesa) e, com LEDGER_TAIL_MIN_SECONDS=0, cada resumo lê o rabo da
+planilha: a cota da planilha é o gargalo. Na compartilhada os N números
+dividem uma cota; com um tenant por número, o throughput cresce com N até a
+cota global (SHEETS_QUOTA_PER_MINUTE, aqui folgada). A janela da cota é
+encurtada (--quota-window) para o teste caber em segundos.
+
+Uso:
+    python bench/loadtest_tenants.py [--tenants 1,2,4,8] [--conversations 12]
+        [--sheets-latency-ms 20] [--tenant-quota 6] [--quota-window 2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_sheets
+import loadtest_e2e
+import mock_graph
+import webhook_payloads
+
+ROOT = loadtest_e2e.ROOT
+SHARED_ID = "shared"
+
+
+def number(i: int) -> str:
+    return f"55118{i:07d}"
+
+
+def app_env(tmp: str, args, tenants_file: str = "") -> dict:
+    env = {k: v for k, v in os.environ.items() if k != "GOOGLE_APPLICATION_CREDENTIALS"}
+    env.update({
+        "WA_GRAPH_BASE": f"http://127.0.0.1:{loadtest_e2e.GRAPH_PORT}",
+        "WA_PHONE_NUMBER_ID": webhook_payloads.PHONE_NUMBER_ID,
+        "WA_ACCESS_TOKEN": "load",
+        "WA_HTTP2": "0",
+        "ALLOWED_WA_NUMBER": "",
+        "TENANTS_FILE": tenants_file,
+        "GOOGLE_SHEETS_SPREADSHEET_ID": SHARED_ID,
+        "GOOGLE_SHEETS_API_ENDPOINT": f"http://127.0.0.1:{loadtest_e2e.SHEETS_PORT}",
+        "SHEETS_QUOTA_PER_MINUTE": "100000",
+        "SHEETS_QUOTA_WINDOW": str(args.quota_window),
+        "TENANT_SHEETS_QUOTA_PER_MINUTE": str(args.tenant_quota),
+        "LEDGER_TAIL_MIN_SECONDS": "0",
+        "LEDGER_JOURNAL_PATH": os.path.join(tmp, "ledger_journal.jsonl"),
+        "DEDUPE_DB": os.path.join(tmp, "dedupe.db"),
+    })
+    return env
+
+
+async def drive(numbers: list, conversations: int, seed: int, mock) -> dict:
+    out = {"latencies": [], "errors": [], "messages": 0, "confirmed": 0}
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=len(numbers)), timeout=30) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            loadtest_e2e.run_user(client, mock, num, conversations, seed + i, out)
+            for i, num in enumerate(numbers)
+        ))
+        out["elapsed"] = time.perf_counter() - t0
+    return out
+
+
+def run(mode: str, n: int, args, mock, sheets) -> dict:
+    tmp = tempfile.mkdtemp(prefix=f"loadtest-tenants-{mode}-{n}-")
+    numbers = [number(i) for i in range(n)]
+    sheet_of = {num: SHARED_ID for num in numbers}
+    tenants_file = ""
+    if mode == "tenants":
+        sheet_of = {num: f"t{num}" for num in numbers}
+        tenants_file = os.path.join(tmp, "tenants.json")
+        with open(tenants_file, "w", encoding="utf-8") as f:
+            json.dump({
+                num: {"spreadsheet_id": sheet_of[num]} for num in numbers
+            }, f)
+    sheets.state.grids.clear()
+    sheets.state.calls.clear()
+    before = {k: len(v) for k, v in mock.state.by_to.items()}
+
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(loadtest_e2e.APP_PORT), "--log-level", "warning"],
+        cwd=ROOT, env=app_env(tmp, args, tenants_file), stdout=subprocess.DEVNULL,
+    )
+    try:
+        loadtest_e2e.wait_ready()
+        out = asyncio.run(drive(numbers, args.conversations, args.seed, mock))
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            rows = sum(len(sheets.state.grids[sid]) - 1 for sid in set(sheet_of.values()))
+            if rows >= out["confirmed"]:
+                break
+            time.sleep(0.1)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+    lat = sorted(out["latencies"])
+    wrong = sum(
+        1 for num in numbers
+        for p in mock.state.by_to[num][before.get(num, 0):]
+        if p.get("to") not in (None, num)
+    )
+    return {
+        "mode": mode, "n": n, "messages": out["messages"], "confirmed": out["confirmed"], "rows": rows,
+        "errors": len(out["errors"]) + wrong, "first_error": (out["errors"] or [""])[0],
+        "throughput": out["messages"] / out["elapsed"] if out["elapsed"] else 0.0,
+        "p50": loadtest_e2e.percentile(lat, 0.50), "p95": loadtest_e2e.percentile(lat, 0.95),
+        "sheets_calls": sum(sheets.state.calls.values()), "sheets": len(set(sheet_of.values())),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tenants", default="1,2,4,8")
+    ap.add_argument("--conversations", type=int, default=12)
+    ap.add_argument("--graph-latency-ms", type=float, default=5.0)
+    ap.add_argument("--sheets-latency-ms", type=float, default=20.0)
+    ap.add_argument("--tenant-quota", type=int, default=6)
+    ap.add_argument("--quota-window", type=float, default=2.0)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    webhook_payloads.MIX = [(webhook_payloads.despesa, 1), (webhook_payloads.resumo, 3)]
+
+    _, mock = mock_graph.start_in_thread(loadtest_e2e.GRAPH_PORT, latency_ms=args.graph_latency_ms)
+    _, sheets = fake_sheets.start_in_thread(loadtest_e2e.SHEETS_PORT, latency_ms=args.sheets_latency_ms)
+
+    results = []
+    print(f"{'modo':13s} {'N':>3s} {'planilhas':>9s} {'msgs':>5s} {'msg/s':>7s} {'x N=1':>6s} "
+          f"{'p50 ms':>7s} {'p95 ms':>7s} {'Sheets':>6s} {'linhas':>9s} {'erros':>5s}")
+    for mode in ("compartilhada", "tenants"):
+        base = None
+        for n in (int(x) for x in args.tenants.split(",")):
+            r = run(mode, n, args, mock, sheets)
+            results.append(r)
+            base = base or r["throughput"]
+            print(f"{mode:13s} {n:3d} {r['sheets']:9d} {r['messages']:5d} {r['throughput']:7.1f} "
+                  f"{r['throughput'] / base:6.2f} {r['p50']:7.1f} {r['p95']:7.1f} {r['sheets_calls']:6d} "
+                  f"{r['rows']:4d}/{r['confirmed']:<4d} {r['errors']:5d}")
+            if r["first_error"]:
+                print("   ", r["first_error"])
+
+    failed = any(r["errors"] or r["rows"] != r["confirmed"] for r in results)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
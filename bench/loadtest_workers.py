@@ -0,0 +1,165 @@
+"""
+Teste de carga com vários workers uvicorn compartilhando as sessões em SQLite.
+
+Sobe o mock da Graph API (bench/mock_graph.py) neste processo e o app com
+--workers N num subprocesso (SESSION_BACKEND=sqlite, DEDUPE_DB). Cada número
+simulado percorre um wizard de despesa até o CANCELAR, mandando a próxima
+mensagem só depois de receber a resposta da anterior (como uma pessoa faria),
+então mensagens seguidas do mesmo número caem em workers diferentes.
+
+Confere que cada número recebeu exatamente as respostas esperadas, na ordem
+(nenhum passo pulado ou repetido), e mede a latência mensagem -> resposta.
+
+Uso:
+    python bench/loadtest_workers.py [--workers 4] [--users 50]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import mock_graph
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+GRAPH_PORT = 8099
+APP_PORT = 8010
+
+# (mensagem enviada, começo do texto esperado na resposta)
+STEPS = [
+    ({"text": "oi"}, "Olá, bora conferir"),
+    ({"choice": "inicio_despesa", "title": "Despesa"}, "Qual o VALOR?"),
+    ({"text": "12,50"}, "Qual a CATEGORIA"),
+    ({"choice": "cat_lazer", "title": "Lazer"}, "Qual a DESCRIÇÃO"),
+    ({"text": "cinema"}, "Como foi o pagamento?"),
+    ({"choice": "pay_pix", "title": "pix"}, "Qual a data de competência?"),
+    ({"choice": "data_hoje", "title": "Hoje"}, "Confirma o lançamento?"),
+    ({"choice": "confirm_cancelar", "title": "CANCELAR"}, "Cancelado."),
+]
+
+_ids = itertools.count(1)
+
+
+def webhook_body(number: str, step: dict):
+    msg = {"from": number, "id": f"wamid.load{next(_ids)}", "timestamp": str(int(time.time()))}
+    if "choice" in step:
+        msg["type"] = "interactive"
+        msg["interactive"] = {"type": "button_reply", "button_reply": {"id": step["choice"], "title": step["title"]}}
+    else:
+        msg["type"] = "text"
+        msg["text"] = {"body": step["text"]}
+    return {"entry": [{"changes": [{"value": {"messages": [msg]}}]}]}
+
+
+def body_text(payload: dict) -> str:
+    if payload.get("type") == "text":
+        return payload["text"]["body"]
+    return payload["interactive"]["body"]["text"]
+
+
+def replies_for(mock, number: str):
+    return mock.state.by_to[number]
+
+
+async def run_user(client, mock, number: str, latencies: list, errors: list):
+    for k, (step, expected) in enumerate(STEPS):
+        t0 = time.perf_counter()
+        r = await client.post(f"http://127.0.0.1:{APP_PORT}/webhook", json=webhook_body(number, step))
+        if r.status_code != 200:
+            errors.append(f"{number}: HTTP {r.status_code} no passo {k}")
+            return
+        deadline = time.monotonic() + 15
+        while len(replies_for(mock, number)) <= k:
+            if time.monotonic() > deadline:
+                errors.append(f"{number}: sem resposta no passo {k}")
+                return
+            await asyncio.sleep(0.005)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        got = body_text(replies_for(mock, number)[k])
+        if not got.startswith(expected):
+            errors.append(f"{number}: passo {k} esperava {expected!r}, veio {got[:40]!r}")
+            return
+
+
+def wait_ready(timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{APP_PORT}/", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("app não subiu")
+
+
+async def main_async(args, mock):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=args.users)
+    async with httpx.AsyncClient(limits=limits, timeout=20) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            run_user(client, mock, f"55119{u:07d}", latencies, errors) for u in range(args.users)
+        ))
+        elapsed = time.perf_counter() - t0
+
+    extra = sum(max(0, len(replies_for(mock, f"55119{u:07d}")) - len(STEPS)) for u in range(args.users))
+    msgs = args.users * len(STEPS)
+    latencies.sort()
+    print(f"workers={args.workers} usuários={args.users} mensagens={msgs} tempo={elapsed:.2f}s ({msgs / elapsed:.1f} msg/s)")
+    if latencies:
+        p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+        print(f"latência msg->resposta: p50={statistics.median(latencies):.1f}ms p95={p(0.95):.1f}ms p99={p(0.99):.1f}ms")
+    print(f"respostas extras (passos repetidos): {extra}")
+    print(f"erros: {len(errors)}")
+    for e in errors[:10]:
+        print("  ", e)
+    return 1 if errors or extra else 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--graph-latency-ms", type=float, default=20.0)
+    args = ap.parse_args()
+
+    _, mock = mock_graph.start_in_thread(GRAPH_PORT, latency_ms=args.graph_latency_ms)
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    env = {
+        **os.environ,
+        "WA_GRAPH_BASE": f"http://127.0.0.1:{GRAPH_PORT}",
+        "WA_PHONE_NUMBER_ID": "123",
+        "WA_ACCESS_TOKEN": "load",
+        "WA_HTTP2": "0",
+        "ALLOWED_WA_NUMBER": "",
+        "GOOGLE_SHEETS_SPREADSHEET_ID": "load",
+        "SESSION_BACKEND": "sqlite",
+        "SESSION_DB": os.path.join(tmp, "sessions.db"),
+        "DEDUPE_DB": os.path.join(tmp, "dedupe.db"),
+        "LEDGER_JOURNAL_PATH": os.path.join(tmp, "ledger_journal.jsonl"),
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(APP_PORT),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        wait_ready()
+        code = asyncio.run(main_async(args, mock))
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
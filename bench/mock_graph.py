@@ -0,0 +1,100 @@
+"""
+Mock local da WhatsApp Graph API (POST /{versão}/{phone_id}/messages).
+
+Responde como o Graph real ({"messages": [{"id": "wamid..."}]}) depois de uma
+latência configurável, para medir throughput do cliente de saída offline.
+Com throttle_rps > 0 aceita no máximo essa vazão (balde de fichas) e responde
+o excesso com 429 + Retry-After e o erro 130429 do Graph; error_rate devolve
+503 numa fração aleatória dos pedidos.
+
+Uso standalone:
+    python bench/mock_graph.py --port 8099 --latency-ms 80 [--throttle-rps 20]
+e no app:
+    WA_GRAPH_BASE=http://127.0.0.1:8099
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+_ids = itertools.count(1)
+
+
+def create_app(latency_ms: float = 50.0, throttle_rps: float = 0.0, retry_after: float = 1.0, error_rate: float = 0.0):
+    mock = FastAPI()
+    mock.state.received = []
+    mock.state.by_to = defaultdict(list)
+    mock.state.rejected = defaultdict(int)
+    bucket = {"tokens": throttle_rps, "stamp": time.monotonic()}
+
+    def admit() -> bool:
+        if throttle_rps <= 0:
+            return True
+        now = time.monotonic()
+        bucket["tokens"] = min(throttle_rps, bucket["tokens"] + (now - bucket["stamp"]) * throttle_rps)
+        bucket["stamp"] = now
+        if bucket["tokens"] < 1:
+            return False
+        bucket["tokens"] -= 1
+        return True
+
+    @mock.post("/{ver}/{phone_id}/messages")
+    async def messages(ver: str, phone_id: str, req: Request):
+        payload = await req.json()
+        if not admit():
+            mock.state.rejected[429] += 1
+            return JSONResponse(
+                {"error": {"message": "(#130429) Rate limit hit", "type": "OAuthException", "code": 130429}},
+                status_code=429,
+                headers={"Retry-After": str(retry_after)},
+            )
+        if error_rate and random.random() < error_rate:
+            mock.state.rejected[503] += 1
+            return JSONResponse({"error": {"message": "Service temporarily unavailable", "code": 2}}, status_code=503)
+        mock.state.received.append(payload)
+        mock.state.by_to[payload.get("to")].append(payload)
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000.0)
+        return {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+            "messages": [{"id": f"wamid.mock{next(_ids)}"}],
+        }
+
+    return mock
+
+
+def start_in_thread(port: int = 8099, **kwargs):
+    """Sobe o mock num thread daemon e devolve (server, app) quando estiver ouvindo."""
+    mock = create_app(**kwargs)
+    server = uvicorn.Server(uvicorn.Config(mock, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, mock
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--throttle-rps", type=float, default=0.0)
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    mock = create_app(
+        latency_ms=args.latency_ms, throttle_rps=args.throttle_rps,
+        retry_after=args.retry_after, error_rate=args.error_rate,
+    )
+    uvicorn.run(mock, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
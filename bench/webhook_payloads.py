@@ -0,0 +1,184 @@
+"""
+Gerador de entregas do webhook do WhatsApp no formato real da Cloud API
+(object / entry / changes / value com metadata, contacts e messages), para os
+testes de carga.
+
+Uma conversa é uma lista de Step: a mensagem que o número manda e o começo do
+texto de cada resposta esperada (em qualquer ordem, quando o bot manda mais de
+uma). conversation() sorteia entre despesa completa, receita completa, resumo
+e cancelamento no meio do wizard. Com MIX_TEXTO as despesas e receitas chegam
+escritas numa frase ("mercado 35,90 pix ontem pão e leite") e o wizard só
+pergunta o que a frase não trouxe.
+"""
+import itertools
+import random
+import time
+from dataclasses import dataclass, field
+
+PHONE_NUMBER_ID = "123"
+DISPLAY_NUMBER = "15550001111"
+WABA_ID = "102290129340398"
+
+CATEGORIAS = ["Mercado", "Transporte", "Moradia", "Alimentação", "Assinaturas", "Saúde", "Lazer", "Educação", "Impostos"]
+ORIGENS = ["Salário", "Férias", "13º", "Bônus", "Comissão", "PLR", "Reembolso", "Rendimentos", "Freela", "Outros"]
+PAGAMENTOS = ["pix", "débito", "crédito", "dinheiro"]
+RESUMOS = [("res_diario", "Diário"), ("res_semanal", "Semanal"), ("res_mensal", "Mensal"),
+           ("res_3m", "3 meses"), ("res_6m", "6 meses"), ("res_12m", "12 meses")]
+NOMES = ["Ana", "Bruno", "Carla", "Diego", "Elisa", "Fábio", "Gabi", "Hugo", "Iris", "João"]
+
+_ids = itertools.count(1)
+
+
+@dataclass
+class Step:
+    message: dict
+    expect: list = field(default_factory=list)   # prefixos (ou tuplas de alternativas) das respostas
+    confirms: bool = False                        # grava um lançamento
+
+
+def text(body: str) -> dict:
+    return {"type": "text", "text": {"body": body}}
+
+
+def button(choice: str, title: str) -> dict:
+    return {"type": "interactive", "interactive": {"type": "button_reply", "button_reply": {"id": choice, "title": title}}}
+
+
+def list_item(choice: str, title: str) -> dict:
+    return {"type": "interactive", "interactive": {"type": "list_reply", "list_reply": {"id": choice, "title": title}}}
+
+
+def _valor(rnd: random.Random) -> str:
+    return f"{rnd.uniform(2, 900):.2f}".replace(".", ",")
+
+
+def despesa(rnd: random.Random) -> list:
+    cat = rnd.choice(CATEGORIAS)
+    pay = rnd.choice(PAGAMENTOS)
+    pay_id = "pay_" + pay.replace("é", "e").replace("í", "i")
+    quando = rnd.choice([("data_hoje", "Hoje"), ("data_ontem", "Ontem")])
+    return [
+        Step(text("oi"), ["Olá, bora conferir"]),
+        Step(button("inicio_despesa", "Despesa"), ["Qual o VALOR?"]),
+        Step(text(_valor(rnd)), ["Qual a CATEGORIA"]),
+        Step(list_item(f"cat_{cat.lower().replace(' ', '_')}", cat), ["Qual a DESCRIÇÃO"]),
+        Step(text(rnd.choice(["pão e leite", "uber", "aluguel", "cinema", "farmácia", "curso"])), ["Como foi o pagamento?"]),
+        Step(list_item(pay_id, pay), ["Qual a data de competência?"]),
+        Step(button(*quando), ["Confirma o lançamento?"]),
+        Step(button("confirm_sim", "SIM"), ["Show, já registrei"], confirms=True),
+    ]
+
+
+def receita(rnd: random.Random) -> list:
+    origem = rnd.choice(ORIGENS)
+    steps = [
+        Step(text("oi"), ["Olá, bora conferir"]),
+        Step(button("inicio_receita", "Receita"), ["Qual o VALOR?"]),
+        Step(text(_valor(rnd)), ["Qual a ORIGEM"]),
+    ]
+    origem_id = f"origem_{origem.lower().replace('º', 'o').replace(' ', '_')}"
+    if origem == "Outros":
+        steps.append(Step(list_item(origem_id, origem), ["Digite a ORIGEM"]))
+        steps.append(Step(text("Venda de bicicleta"), ["Como foi o recebimento?"]))
+    else:
+        steps.append(Step(list_item(origem_id, origem), ["Como foi o recebimento?"]))
+    day = rnd.randint(1, 28)
+    steps += [
+        Step(button(*rnd.choice([("rec_pix", "PIX"), ("rec_dinheiro", "Dinheiro")])), ["Qual a data de competência?"]),
+        Step(button("data_outra", "Outra"), ["Digite a data"]),
+        Step(text(f"{day:02d}/{rnd.randint(1, 12):02d}"), ["Confirma o lançamento?"]),
+        Step(button("confirm_sim", "SIM"), ["Show, já registrei"], confirms=True),
+    ]
+    return steps
+
+
+def resumo(rnd: random.Random) -> list:
+    choice, label = rnd.choice(RESUMOS)
+    pick = button if choice in ("res_diario", "res_semanal", "res_mensal") else list_item
+    return [
+        Step(text("oi"), ["Olá, bora conferir"]),
+        Step(button("inicio_resumo", "Resumo"), ["Qual resumo você quer ver?", "Ou escolha em Outros:"]),
+        # planilha ainda vazia no começo da carga também é resposta válida
+        Step(pick(choice, label), [(f"*Resumo {label}*", "Não encontrei lançamentos")]),
+    ]
+
+
+def cancelamento(rnd: random.Random) -> list:
+    return [
+        Step(text("oi"), ["Olá, bora conferir"]),
+        Step(button("inicio_despesa", "Despesa"), ["Qual o VALOR?"]),
+        Step(text(_valor(rnd)), ["Qual a CATEGORIA"]),
+        Step(text("cancelar"), ["Cancelado."]),
+    ]
+
+
+def despesa_texto(rnd: random.Random) -> list:
+    cat = rnd.choice([c for c in CATEGORIAS if c != "Outros"])
+    desc = rnd.choice(["pão e leite", "uber", "aluguel", "cinema", "farmácia", "curso"])
+    frase = f"{cat.lower()} {_valor(rnd)} {rnd.choice(PAGAMENTOS)} {rnd.choice(['hoje', 'ontem'])} {desc}"
+    return [
+        Step(text(frase), ["Confirma o lançamento?"]),
+        Step(button("confirm_sim", "SIM"), ["Show, já registrei"], confirms=True),
+    ]
+
+
+def receita_texto(rnd: random.Random) -> list:
+    # sem recebimento nem data na frase: o wizard pergunta só os dois
+    origem = rnd.choice([o for o in ORIGENS if o != "Outros"])
+    return [
+        Step(text(f"recebi {_valor(rnd)} {origem}"), ["Como foi o recebimento?"]),
+        Step(button(*rnd.choice([("rec_pix", "PIX"), ("rec_dinheiro", "Dinheiro")])), ["Qual a data de competência?"]),
+        Step(button("data_hoje", "Hoje"), ["Confirma o lançamento?"]),
+        Step(button("confirm_sim", "SIM"), ["Show, já registrei"], confirms=True),
+    ]
+
+
+# peso de cada tipo de conversa no tráfego
+MIX = [(despesa, 5), (receita, 2), (resumo, 2), (cancelamento, 1)]
+MIX_TEXTO = [(despesa_texto, 5), (receita_texto, 2), (resumo, 2), (cancelamento, 1)]
+
+
+def conversation(rnd: random.Random) -> list:
+    kinds, weights = zip(*MIX)
+    return rnd.choices(kinds, weights)[0](rnd)
+
+
+def webhook_body(number: str, message: dict) -> dict:
+    """Entrega com uma mensagem, como a Cloud API manda."""
+    msg = {"from": number, "id": f"wamid.HBgN{next(_ids):012d}", "timestamp": str(int(time.time())), **message}
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": WABA_ID,
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": DISPLAY_NUMBER, "phone_number_id": PHONE_NUMBER_ID},
+                    "contacts": [{"profile": {"name": NOMES[int(number[-3:]) % len(NOMES)]}, "wa_id": number}],
+                    "messages": [msg],
+                },
+            }],
+        }],
+    }
+
+
+def status_body(number: str, wamid: str, status: str = "delivered") -> dict:
+    """Callback de status (sent/delivered/read) de uma mensagem enviada pelo bot."""
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": WABA_ID,
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": DISPLAY_NUMBER, "phone_number_id": PHONE_NUMBER_ID},
+                    "statuses": [{
+                        "id": wamid, "status": status, "timestamp": str(int(time.time())),
+                        "recipient_id": number,
+                    }],
+                },
+            }],
+        }],
+    }